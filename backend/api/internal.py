@@ -0,0 +1,51 @@
+import os
+import secrets
+from typing import Optional
+from fastapi import APIRouter, Header, HTTPException, Query, status
+from database.database import engine
+from database.async_database import async_engine
+from database.async_redis import async_redis_pool
+from database.circuit_breaker import redis_breaker
+from database.replicas import replicas
+from database.shards import shards
+from database.cache_warmup import CACHE_WARMUP_TOP_N, warm_url_cache
+
+router = APIRouter()
+
+# Not routed by nginx; callers must send it as X-Internal-Token. Without a
+# token configured the internal endpoints are switched off
+INTERNAL_API_TOKEN = os.getenv("INTERNAL_API_TOKEN")
+
+def check_internal_token(token: Optional[str]) -> None:
+    if not INTERNAL_API_TOKEN:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+    if not secrets.compare_digest(token or "", INTERNAL_API_TOKEN):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Forbidden")
+
+@router.get("/pools")
+async def pool_stats(x_internal_token: Optional[str] = Header(None)):
+    check_internal_token(x_internal_token)
+    return {
+        "postgres": async_engine.pool.describe(),
+        "postgres_sync": engine.pool.describe(),
+        "postgres_replicas": replicas.describe(),
+        "redis": async_redis_pool.describe(),
+        "redis_breaker": redis_breaker.describe(),
+        "shards": {
+            shard.name: {
+                "postgres": shard.engine.pool.describe(),
+                "redis": shard.redis.connection_pool.describe() if shard.redis is not None else None,
+                "redis_breaker": shard.breaker.describe() if shard.breaker is not None else None,
+            }
+            for shard in shards.values() if not shard.is_default
+        },
+    }
+
+@router.post("/cache/warm")
+async def warm_cache(
+    limit: int = Query(CACHE_WARMUP_TOP_N, ge=1, le=1_000_000),
+    x_internal_token: Optional[str] = Header(None)
+):
+    # Reloads the most clicked links into Redis, e.g. after a Redis restart
+    check_internal_token(x_internal_token)
+    return {"warmed": await warm_url_cache(limit=limit)}
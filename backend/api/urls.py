@@ -1,95 +1,482 @@
-from fastapi import APIRouter, Depends, HTTPException, Response
-from sqlalchemy.orm import Session
-import random
-import string
-from database.database import get_db
-from database.redis import redis_client
-from models.url import URL
-from models.user import User
-from schemas.url import URLCreate, URL as URLSchema
-from api.auth import get_current_user
-from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from pydantic import ValidationError
+from redis.exceptions import RedisError
+from sqlalchemy import func, literal, select, tuple_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from datetime import datetime, timedelta, timezone
+import asyncio
+import base64
+import heapq
+import json
+import os
+import orjson
+from contextlib import AsyncExitStack
+from database.async_database import get_async_db
+from database.replicas import first_with_fallback, pin_reads_to_primary, read_session, reads_pinned_to_primary, run_with_fallback
+from database.shards import fan_out, group_by_shard, merge_streams, shard_session, shards
+from database.invalidation import invalidate_url
+from database.redis_cache import publish_new_urls
+from database.click_buffer import click_buffer
+from models.url import URL, cache_value, hash_url
+from schemas.url import URLCreate, URL as URLSchema, ClickTimeSeries
+from api.auth import Principal, get_current_user, get_current_user_required
+from services.short_codes import short_code_allocator
+from services.analytics import get_time_series
+from services.metrics import SHORT_CODE_RETRIES
+from services.http_cache import etag_response, purge_redirect
+from services.proxies import client_ip
+from services.rate_limit import CREATES, enforce
+from typing import AsyncIterator, Optional, Union
 
 router = APIRouter()
 
-def generate_short_code(length=6):
-    chars = string.ascii_letters + string.digits
-    return ''.join(random.choice(chars) for _ in range(length))
+SHORT_CODE_MAX_ATTEMPTS = 5
+BATCH_INSERT_SIZE = int(os.getenv("SHORTEN_BATCH_INSERT_SIZE", "1000"))
+LIST_DEFAULT_LIMIT = int(os.getenv("LIST_DEFAULT_LIMIT", "100"))
+LIST_MAX_LIMIT = int(os.getenv("LIST_MAX_LIMIT", "1000"))
+LIST_STREAM_BATCH_SIZE = int(os.getenv("LIST_STREAM_BATCH_SIZE", "500"))
 
-@router.post("/shorten", response_model=URLSchema)
-def create_short_url(
+# What the URL schema shows, selected as plain rows (in the schema's field
+# order) so listings skip building ORM objects and validating every row
+URL_COLUMNS = (URL.original_url, URL.id, URL.short_code, URL.created_at, URL.clicks, URL.expires_at, URL.permanent)
+
+def url_row(row) -> dict:
+    return {"original_url": row.original_url, "id": row.id, "short_code": row.short_code, "created_at": row.created_at,
+            "clicks": row.clicks or 0, "expires_at": row.expires_at, "permanent": row.permanent}
+
+def dump_json(content) -> bytes:
+    # orjson writes UTC datetimes with a Z, like pydantic does
+    return orjson.dumps(content, option=orjson.OPT_UTC_Z)
+
+async def get_url_by_code(db: AsyncSession, short_code: str) -> Optional[URL]:
+    return await first_with_fallback(db, select(URL).where(URL.short_code == short_code))
+
+async def limit_creates(request: Request, current_user: Optional[Principal] = Depends(get_current_user)) -> None:
+    # Signed-in callers are limited per account, everyone else per address
+    await enforce(CREATES, f"user:{current_user.id}" if current_user else f"ip:{client_ip(request)}")
+
+async def get_read_db(
+    primary: AsyncSession = Depends(get_async_db),
+    current_user: Optional[Principal] = Depends(get_current_user)
+) -> AsyncIterator[AsyncSession]:
+    # Read-only endpoints go to a replica, unless the caller has just written
+    # something a lagging replica might not show yet
+    if current_user and await reads_pinned_to_primary(current_user.id):
+        yield primary
+        return
+    async for db in read_session(primary):
+        yield db
+
+async def save_url(db: AsyncSession, db_url: URL) -> bool:
+    # Returns False instead of raising when the short code is already taken
+    db.add(db_url)
+    try:
+        await db.commit()
+        return True
+    except IntegrityError:
+        await db.rollback()
+        return False
+
+async def find_duplicate(db: AsyncSession, original_url: str, user_id: Optional[int], permanent: bool = False) -> Optional[URL]:
+    # Served by the (url_hash, user_id) index; comparing original_url too
+    # rules out hash collisions. Only links that never expire and redirect
+    # the same way are reused
+    owner = URL.user_id.is_(None) if user_id is None else URL.user_id == user_id
+    query = (
+        select(URL)
+        .where(
+            URL.url_hash == hash_url(original_url),
+            owner,
+            URL.original_url == original_url,
+            URL.expires_at.is_(None),
+            URL.permanent == permanent,
+        )
+        .order_by(URL.id)
+        .limit(1)
+    )
+
+    async def first(session: AsyncSession, shard) -> Optional[URL]:
+        return (await session.execute(query)).scalars().first()
+
+    return next((db_url for db_url in await fan_out(db, first) if db_url is not None), None)
+
+@router.post("/shorten", response_model=URLSchema, dependencies=[Depends(limit_creates)])
+async def create_short_url(
     url: URLCreate,
-    db: Session = Depends(get_db),
-    current_user: Optional[User] = Depends(get_current_user)
+    dedup: bool = Query(False, description="Return the caller's existing short URL for this original URL, if any"),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: Optional[Principal] = Depends(get_current_user)
 ):
-    # Use custom short code if provided and valid
+    user_id = current_user.id if current_user else None
+    if user_id:
+        await pin_reads_to_primary(user_id)
+
+    # Anonymous callers share the unclaimed URLs, users only reuse their own
+    if dedup and not url.custom_short_code and url.expires_at is None:
+        existing = await find_duplicate(db, str(url.original_url), user_id, url.permanent)
+        if existing is not None:
+            return existing
+
+    # Use custom short code if provided and valid; the unique index on
+    # short_code rejects codes that are already taken
     if url.custom_short_code:
-        # Check if custom short code already exists
-        existing_url = db.query(URL).filter(URL.short_code == url.custom_short_code).first()
-        if existing_url:
+        db_url = URL(
+            original_url=str(url.original_url),
+            short_code=url.custom_short_code,
+            user_id=user_id,
+            expires_at=url.expires_at,
+            permanent=url.permanent
+        )
+        async with shard_session(db_url.short_code, db) as session:
+            saved = await save_url(session, db_url)
+        if not saved:
             raise HTTPException(
                 status_code=400,
                 detail="This custom short code is already in use. Please choose another one."
             )
-        short_code = url.custom_short_code
+        await publish_new_urls({db_url.short_code: cache_value(db_url.original_url, db_url.expires_at, db_url.permanent)})
+        return db_url
+
+    # Allocated codes never repeat, they can only clash with a custom code
+    # that happens to look like one
+    for _ in range(SHORT_CODE_MAX_ATTEMPTS):
+        try:
+            short_code = await short_code_allocator.allocate()
+        except RedisError:
+            raise HTTPException(status_code=503, detail="Could not allocate a short code, please retry")
+        db_url = URL(
+            original_url=str(url.original_url),
+            short_code=short_code,
+            user_id=user_id,
+            expires_at=url.expires_at,
+            permanent=url.permanent
+        )
+        async with shard_session(db_url.short_code, db) as session:
+            saved = await save_url(session, db_url)
+        if saved:
+            await publish_new_urls({db_url.short_code: cache_value(db_url.original_url, db_url.expires_at, db_url.permanent)})
+            return db_url
+        SHORT_CODE_RETRIES.inc()
+
+    raise HTTPException(status_code=503, detail="Could not allocate a short code, please retry")
+
+async def insert_urls(db: AsyncSession, rows: list[dict]) -> dict:
+    # One multi-row INSERT per shard, run concurrently; rows whose short code
+    # is taken are skipped, so only the codes that made it in come back from
+    # RETURNING
+    async def insert_group(group: list[dict]) -> list:
+        async with shard_session(group[0]["short_code"], db) as session:
+            insert = pg_insert if session.bind.dialect.name == "postgresql" else sqlite_insert
+            stmt = (
+                insert(URL)
+                .values(group)
+                .on_conflict_do_nothing(index_elements=["short_code"])
+                .returning(URL.id, URL.short_code, URL.original_url, URL.created_at, URL.expires_at, URL.permanent)
+            )
+            inserted = (await session.execute(stmt)).all()
+            await session.commit()
+            return inserted
+
+    groups = group_by_shard(rows, key=lambda row: row["short_code"]).values()
+    inserted = [row for group in await asyncio.gather(*(insert_group(group) for group in groups)) for row in group]
+    await publish_new_urls({row.short_code: cache_value(row.original_url, row.expires_at, row.permanent) for row in inserted})
+    return {row.short_code: row for row in inserted}
+
+async def shorten_chunk(db: AsyncSession, chunk: list, user_id: Optional[int]) -> list[dict]:
+    results = {}
+    pending = []
+    generated = []
+    for index, item in chunk:
+        if isinstance(item, str):
+            results[index] = {"index": index, "error": item}
+        elif item.custom_short_code:
+            pending.append((index, item, item.custom_short_code))
+        else:
+            generated.append((index, item))
+
+    unallocated = []
+    for _ in range(SHORT_CODE_MAX_ATTEMPTS):
+        try:
+            codes = await short_code_allocator.allocate_many(len(generated))
+        except RedisError:
+            # The code counter is unreachable; custom codes still go in
+            unallocated, generated, codes = unallocated + generated, [], []
+        pending.extend((index, item, code) for (index, item), code in zip(generated, codes))
+        if not pending:
+            break
+
+        inserted = await insert_urls(db, [
+            {
+                "original_url": str(item.original_url),
+                "url_hash": hash_url(str(item.original_url)),
+                "short_code": code,
+                "user_id": user_id,
+                "expires_at": item.expires_at,
+                "permanent": item.permanent,
+            }
+            for _, item, code in pending
+        ])
+
+        generated = []
+        for index, item, code in pending:
+            row = inserted.pop(code, None)
+            if row is not None:
+                results[index] = {
+                    "index": index,
+                    **URLSchema(
+                        id=row.id,
+                        short_code=row.short_code,
+                        original_url=item.original_url,
+                        created_at=row.created_at,
+                        clicks=0,
+                        expires_at=row.expires_at,
+                        permanent=row.permanent,
+                    ).model_dump(mode="json"),
+                }
+            elif item.custom_short_code:
+                results[index] = {"index": index, "error": "This custom short code is already in use."}
+            else:
+                generated.append((index, item))
+        SHORT_CODE_RETRIES.inc(len(generated))
+        pending = []
+
+    for index, _ in generated + unallocated:
+        results[index] = {"index": index, "error": "Could not allocate a short code, please retry"}
+    return [results[index] for index, _ in chunk]
+
+def parse_batch_item(raw) -> Union[URLCreate, str]:
+    try:
+        if isinstance(raw, (bytes, str)):
+            return URLCreate.model_validate_json(raw)
+        return URLCreate.model_validate(raw)
+    except ValidationError as exc:
+        return "; ".join(f"{'.'.join(str(part) for part in error['loc'])}: {error['msg']}" for error in exc.errors())
+
+@router.post("/shorten/batch", dependencies=[Depends(limit_creates)])
+async def create_short_urls_batch(
+    request: Request,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: Optional[Principal] = Depends(get_current_user)
+):
+    # Accepts a JSON array or an NDJSON stream (application/x-ndjson) of
+    # URLCreate objects and streams back one NDJSON line per item, in input
+    # order, holding either the created URL or an "error"
+    user_id = current_user.id if current_user else None
+    if user_id:
+        await pin_reads_to_primary(user_id)
+
+    # The body is read in full before streaming the response: once the
+    # response starts, Starlette listens for the client disconnecting and
+    # would take the request's remaining body messages
+    body = await request.body()
+    if "ndjson" in request.headers.get("content-type", ""):
+        items = [line for line in body.split(b"\n") if line.strip()]
     else:
-        # Generate random short code if not provided
-        short_code = generate_short_code()
-        # Check if the short code already exists
-        while db.query(URL).filter(URL.short_code == short_code).first():
-            short_code = generate_short_code()
-
-    db_url = URL(
-        original_url=str(url.original_url),
-        short_code=short_code,
-        user_id=current_user.id if current_user else None
-    )
-    db.add(db_url)
-    db.commit()
-    db.refresh(db_url)
+        try:
+            items = json.loads(body)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Request body must be a JSON array or NDJSON")
+        if not isinstance(items, list):
+            raise HTTPException(status_code=400, detail="Request body must be a JSON array or NDJSON")
 
-    return db_url
+    async def results():
+        chunk = []
+        index = 0
+        for raw in items:
+            chunk.append((index, parse_batch_item(raw)))
+            index += 1
+            if len(chunk) >= BATCH_INSERT_SIZE:
+                for result in await shorten_chunk(db, chunk, user_id):
+                    yield json.dumps(result) + "\n"
+                chunk = []
+        if chunk:
+            for result in await shorten_chunk(db, chunk, user_id):
+                yield json.dumps(result) + "\n"
+
+    return StreamingResponse(results(), media_type="application/x-ndjson")
 
 @router.post("/claim/{short_code}", response_model=URLSchema)
-def claim_url(
+async def claim_url(
     short_code: str,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    db: AsyncSession = Depends(get_async_db),
+    current_user: Principal = Depends(get_current_user_required)
 ):
-    db_url = db.query(URL).filter(URL.short_code == short_code).first()
-    if not db_url:
-        raise HTTPException(status_code=404, detail="URL not found")
+    async with shard_session(short_code, db) as db:
+        db_url = await get_url_by_code(db, short_code)
+        if not db_url:
+            raise HTTPException(status_code=404, detail="URL not found")
 
-    if db_url.user_id:
-        if db_url.user_id == current_user.id:
-            raise HTTPException(status_code=400, detail="You already own this URL")
-        raise HTTPException(status_code=400, detail="This URL is already claimed by another user")
+        if db_url.user_id:
+            if db_url.user_id == current_user.id:
+                raise HTTPException(status_code=400, detail="You already own this URL")
+            raise HTTPException(status_code=400, detail="This URL is already claimed by another user")
 
-    db_url.user_id = current_user.id
-    db.commit()
-    db.refresh(db_url)
+        db_url.user_id = current_user.id
+        await db.commit()
+        await db.refresh(db_url)
+    await pin_reads_to_primary(current_user.id)
+    await invalidate_url(short_code)
+    await purge_redirect(short_code)
     return db_url
 
-@router.get("/stats/{short_code}", response_model=URLSchema)
-def get_url_stats(
-    short_code: str,
-    db: Session = Depends(get_db),
-    current_user: Optional[User] = Depends(get_current_user)
-):
-    db_url = db.query(URL).filter(URL.short_code == short_code).first()
+async def get_visible_url(db: AsyncSession, short_code: str, current_user: Optional[Principal]):
+    # The URL_COLUMNS (and owner) of the code, as a row
+    db_url = await first_with_fallback(db, select(*URL_COLUMNS, URL.user_id).where(URL.short_code == short_code), scalar=False)
 
     if db_url is None:
         raise HTTPException(status_code=404, detail="URL not found")
 
-    if db_url.user_id and db_url.user_id != current_user.id:
+    if db_url.user_id and (current_user is None or db_url.user_id != current_user.id):
         raise HTTPException(status_code=403, detail="Not authorized to view this URL's stats")
 
     return db_url
 
-@router.get("/my-urls", response_model=list[URLSchema])
-def get_user_urls(db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    return db.query(URL).filter(URL.user_id == current_user.id).all()
+# Answered with a pre-serialized body, so the model only documents it
+@router.get(
+    "/stats/{short_code}",
+    response_class=ORJSONResponse,
+    responses={200: {"model": URLSchema}, 304: {"description": "Unchanged since the ETag sent in If-None-Match"}},
+)
+async def get_url_stats(
+    short_code: str,
+    request: Request,
+    db: AsyncSession = Depends(get_read_db),
+    current_user: Optional[Principal] = Depends(get_current_user)
+):
+    async with shard_session(short_code, db) as db:
+        db_url = await get_visible_url(db, short_code, current_user)
+
+    # Include clicks this worker has not flushed to the database yet
+    stats = url_row(db_url)
+    stats["clicks"] += click_buffer.pending(short_code)
+    # Pollers get a 304 until the stats change
+    return etag_response(request, dump_json(stats))
+
+@router.get("/stats/{short_code}/timeseries", response_model=ClickTimeSeries)
+async def get_url_time_series(
+    short_code: str,
+    granularity: str = Query("hour", pattern="^(minute|hour|day)$"),
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    db: AsyncSession = Depends(get_read_db),
+    current_user: Optional[Principal] = Depends(get_current_user)
+):
+    # Defaults to the last 24 hours
+    end = end or datetime.now(timezone.utc)
+    start = start or end - timedelta(days=1)
+    if start >= end:
+        raise HTTPException(status_code=400, detail="start must be before end")
+
+    async def visible_time_series(session: AsyncSession):
+        await get_visible_url(session, short_code, current_user)
+        return await get_time_series(session, short_code, granularity, start, end)
+
+    # Both queries run on whichever session answered, never on a replica
+    # that has just failed
+    async with shard_session(short_code, db) as db:
+        try:
+            points = await run_with_fallback(db, visible_time_series)
+        except ValueError as exc:
+            raise HTTPException(status_code=400, detail=str(exc))
 
-@router.get("/unclaimed", response_model=list[URLSchema])
-def get_unclaimed_urls(db: Session = Depends(get_db)):
-    return db.query(URL).filter(URL.user_id == None).all()
+    return ClickTimeSeries(short_code=short_code, granularity=granularity, start=start, end=end, points=points)
+
+# list_urls returns its own responses; this keeps the OpenAPI docs truthful
+LIST_RESPONSES = {
+    200: {
+        "model": list[URLSchema],
+        "description": "A page of URLs, or with format=ndjson all of them, one per line",
+        "content": {"application/x-ndjson": {}},
+    },
+}
+
+def encode_cursor(positions: dict) -> str:
+    # The (created_at, id) of the last row returned from each shard
+    encoded = {shard: [created_at.isoformat(), url_id] for shard, (created_at, url_id) in positions.items()}
+    return base64.urlsafe_b64encode(json.dumps(encoded, separators=(",", ":")).encode("utf-8")).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor: str) -> dict:
+    try:
+        positions = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return {str(shard): (datetime.fromisoformat(created_at), int(url_id)) for shard, (created_at, url_id) in positions.items()}
+    except (ValueError, TypeError, AttributeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def newest_first(row):
+    return row.created_at, row.id
+
+async def list_urls(request: Request, db: AsyncSession, condition, limit: int, cursor: Optional[str], format: str):
+    # Newest first, keyset-paginated on (created_at, id) so every page is an
+    # index range scan on each shard no matter how deep the client pages.
+    # Ids alone do not follow created_at: a rebalance copies rows to their new
+    # shard under new ids. The shards are queried in parallel and merged on
+    # the same key
+    positions = decode_cursor(cursor) if cursor else {}
+
+    def shard_query(session: AsyncSession, shard):
+        query = select(*URL_COLUMNS).where(condition).order_by(URL.created_at.desc(), URL.id.desc())
+        if shard.name in positions:
+            created_at, url_id = positions[shard.name]
+            column, value = URL.created_at, literal(created_at, URL.created_at.type)
+            if session.get_bind().dialect.name == "sqlite":
+                # SQLite (used by the tests) keeps timestamps as text, with or
+                # without fractions, so they are compared as dates
+                column, value = func.julianday(column), func.julianday(value)
+            query = query.where(tuple_(column, URL.id) < tuple_(value, literal(url_id)))
+        return query
+
+    if format == "ndjson":
+        # Stream every matching row through a server-side cursor per shard
+        async def rows():
+            async with AsyncExitStack() as stack:
+                streams = []
+                for shard in shards.values():
+                    session = db if shard.is_default else await stack.enter_async_context(shard.sessions())
+                    streams.append(await session.stream(shard_query(session, shard).execution_options(yield_per=LIST_STREAM_BATCH_SIZE)))
+                async for row in merge_streams(streams, key=newest_first, reverse=True):
+                    yield dump_json(url_row(row)) + b"\n"
+
+        return StreamingResponse(rows(), media_type="application/x-ndjson")
+
+    async def page(session: AsyncSession, shard) -> list:
+        rows = (await session.execute(shard_query(session, shard).limit(limit + 1))).all()
+        return [(row, shard.name) for row in rows]
+
+    pages = await fan_out(db, page)
+    merged = list(heapq.merge(*pages, key=lambda item: newest_first(item[0]), reverse=True))
+    response = ORJSONResponse([url_row(row) for row, _ in merged[:limit]])
+    if len(merged) > limit:
+        # Each shard's rows arrive in their keyset order, so the last row
+        # returned from a shard is where its next page starts
+        for row, shard_name in merged[:limit]:
+            positions[shard_name] = newest_first(row)
+        next_cursor = encode_cursor(positions)
+        next_url = request.url.include_query_params(cursor=next_cursor, limit=limit)
+        response.headers["X-Next-Cursor"] = next_cursor
+        response.headers["Link"] = f'<{next_url}>; rel="next"'
+    return response
+
+@router.get("/my-urls", response_class=ORJSONResponse, responses=LIST_RESPONSES)
+async def get_user_urls(
+    request: Request,
+    limit: int = Query(LIST_DEFAULT_LIMIT, ge=1, le=LIST_MAX_LIMIT),
+    cursor: Optional[str] = None,
+    format: str = Query("json", pattern="^(json|ndjson)$"),
+    db: AsyncSession = Depends(get_read_db),
+    current_user: Principal = Depends(get_current_user_required)
+):
+    return await list_urls(request, db, URL.user_id == current_user.id, limit, cursor, format)
+
+@router.get("/unclaimed", response_class=ORJSONResponse, responses=LIST_RESPONSES)
+async def get_unclaimed_urls(
+    request: Request,
+    limit: int = Query(LIST_DEFAULT_LIMIT, ge=1, le=LIST_MAX_LIMIT),
+    cursor: Optional[str] = None,
+    format: str = Query("json", pattern="^(json|ndjson)$"),
+    db: AsyncSession = Depends(get_read_db)
+):
+    return await list_urls(request, db, URL.user_id == None, limit, cursor, format)
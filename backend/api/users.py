@@ -1,53 +1,60 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Response, status
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import timedelta
-from database.database import get_db
+from database.async_database import get_async_db
+from database.invalidation import invalidate_user
+from database.shards import fan_out
+from models.url import URL
 from models.user import User
 from schemas.user import UserCreate, User as UserSchema, Token
 from api.auth import (
+    Principal,
     authenticate_user,
-    create_access_token,
+    create_user_token,
     get_password_hash,
     ACCESS_TOKEN_EXPIRE_MINUTES,
-    get_current_user,
+    get_current_user_required,
 )
 
 router = APIRouter()
 
 @router.post("/register", response_model=UserSchema)
-def register_user(user: UserCreate, db: Session = Depends(get_db)):
+async def register_user(user: UserCreate, db: AsyncSession = Depends(get_async_db)):
     # Check if email already exists
-    db_user = db.query(User).filter(User.email == user.email).first()
-    if db_user:
+    result = await db.execute(select(User.id).where(User.email == user.email))
+    if result.first():
         raise HTTPException(
             status_code=400,
             detail="Email already registered"
         )
 
     # Check if username already exists
-    db_user = db.query(User).filter(User.username == user.username).first()
-    if db_user:
+    result = await db.execute(select(User.id).where(User.username == user.username))
+    if result.first():
         raise HTTPException(
             status_code=400,
             detail="Username already taken"
         )
 
     # Create new user
-    hashed_password = get_password_hash(user.password)
+    hashed_password = await get_password_hash(user.password)
     db_user = User(
         email=user.email,
         username=user.username,
-        hashed_password=hashed_password
+        hashed_password=hashed_password,
+        # A new user has no URLs; setting it avoids a lazy load when serializing
+        urls=[]
     )
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
+    await db.refresh(db_user, attribute_names=["created_at"])
     return db_user
 
 @router.post("/token", response_model=Token)
-async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = authenticate_user(db, form_data.username, form_data.password)
+async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_async_db)):
+    user = await authenticate_user(db, form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -55,11 +62,35 @@ async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session =
             headers={"WWW-Authenticate": "Bearer"},
         )
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    access_token = create_access_token(
-        data={"sub": user.email}, expires_delta=access_token_expires
-    )
+    access_token = create_user_token(user, expires_delta=access_token_expires)
     return {"access_token": access_token, "token_type": "bearer"}
 
 @router.get("/me", response_model=UserSchema)
-async def get_current_user_info(current_user: User = Depends(get_current_user)):
-    return current_user
+async def get_current_user_info(
+    current_user: Principal = Depends(get_current_user_required),
+    db: AsyncSession = Depends(get_async_db)
+):
+    result = await db.execute(select(User).where(User.id == current_user.id))
+    user = result.scalars().one()
+
+    # The user lives on the default shard, their URLs on any of them
+    async def owned(session: AsyncSession, shard) -> list:
+        return (await session.execute(select(URL).where(URL.user_id == current_user.id).order_by(URL.id))).scalars().all()
+
+    urls = [db_url for shard_urls in await fan_out(db, owned) for db_url in shard_urls]
+    return {"id": user.id, "email": user.email, "username": user.username, "created_at": user.created_at, "urls": urls}
+
+@router.post("/logout-all", status_code=204)
+async def revoke_tokens(
+    current_user: Principal = Depends(get_current_user_required),
+    db: AsyncSession = Depends(get_async_db)
+):
+    # Bumping the version invalidates every token issued so far, on every worker
+    await db.execute(
+        update(User)
+        .where(User.id == current_user.id)
+        .values(token_version=User.token_version + 1)
+    )
+    await db.commit()
+    await invalidate_user(current_user.id)
+    return Response(status_code=204)
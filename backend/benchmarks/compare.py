@@ -0,0 +1,51 @@
+"""Print the change between two benchmark reports written by benchmarks.run.
+
+    python -m benchmarks.compare before.json after.json
+"""
+import argparse
+import json
+import sys
+
+METRICS = [
+    ("requests_per_second", "req/s", True),
+    ("p50_ms", "p50 ms", False),
+    ("p95_ms", "p95 ms", False),
+    ("p99_ms", "p99 ms", False),
+]
+
+def change(before: float, after: float) -> str:
+    if not before:
+        return "n/a"
+    return f"{100 * (after - before) / before:+.1f}%"
+
+def compare(before: dict, after: dict, threshold: float) -> int:
+    print(f"{'scenario':<18}{'metric':<8}{before['commit']:>12}{after['commit']:>12}{'change':>10}")
+    regressions = 0
+    for name, old in before["scenarios"].items():
+        new = after["scenarios"].get(name)
+        if new is None:
+            continue
+        for key, label, higher_is_better in METRICS:
+            delta = (new[key] - old[key]) / old[key] if old[key] else 0.0
+            worse = -delta if higher_is_better else delta
+            marker = "  !" if worse > threshold else ""
+            regressions += bool(marker)
+            print(f"{name:<18}{label:<8}{old[key]:>12}{new[key]:>12}{change(old[key], new[key]):>10}{marker}")
+    return regressions
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("before")
+    parser.add_argument("after")
+    parser.add_argument("--threshold", type=float, default=0.10, help="flag changes worse than this fraction (default 0.10)")
+    parser.add_argument("--fail-on-regression", action="store_true", help="exit with status 1 if anything is flagged")
+    args = parser.parse_args(argv)
+    with open(args.before) as file:
+        before = json.load(file)
+    with open(args.after) as file:
+        after = json.load(file)
+    regressions = compare(before, after, args.threshold)
+    return 1 if regressions and args.fail_on_regression else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,21 @@
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+import os
+from dotenv import load_dotenv
+from database.pools import DB_CONNECT_TIMEOUT_SECONDS, InstrumentedAsyncQueuePool, engine_options
+
+load_dotenv()
+
+ASYNC_SQLALCHEMY_DATABASE_URL = f"postgresql+asyncpg://{os.getenv('DB_USER')}:{os.getenv('DB_PASSWORD')}@{os.getenv('DB_HOST')}/{os.getenv('DB_NAME')}"
+
+async_engine = create_async_engine(
+    ASYNC_SQLALCHEMY_DATABASE_URL,
+    poolclass=InstrumentedAsyncQueuePool,
+    connect_args={"timeout": DB_CONNECT_TIMEOUT_SECONDS},
+    **engine_options()
+)
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
+# Dependency
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
@@ -0,0 +1,39 @@
+import redis.asyncio as aioredis
+import os
+from dotenv import load_dotenv
+from database.pools import (
+    REDIS_MAX_CONNECTIONS,
+    REDIS_POOL_TIMEOUT_SECONDS,
+    REDIS_SOCKET_CONNECT_TIMEOUT_SECONDS,
+    InstrumentedRedisPool,
+    PerLoopRedisPool,
+    redis_options,
+)
+
+load_dotenv()
+
+REDIS_HOST = os.getenv("REDIS_HOST", "redis")
+REDIS_PORT = int(os.getenv("REDIS_PORT", "6379"))
+
+async_redis_pool = InstrumentedRedisPool(
+    host=REDIS_HOST,
+    port=REDIS_PORT,
+    max_connections=REDIS_MAX_CONNECTIONS,
+    timeout=REDIS_POOL_TIMEOUT_SECONDS,
+    **redis_options()
+)
+
+async_redis_client = aioredis.Redis(
+    connection_pool=async_redis_pool
+)
+
+# Subscribers block on reads indefinitely, so they get their own connection
+# without a socket timeout and outside the bounded pool
+async_pubsub_client = aioredis.Redis(
+    connection_pool=PerLoopRedisPool(
+        host=REDIS_HOST,
+        port=REDIS_PORT,
+        socket_connect_timeout=REDIS_SOCKET_CONNECT_TIMEOUT_SECONDS,
+        socket_keepalive=True,
+    )
+)
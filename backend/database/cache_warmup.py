@@ -0,0 +1,120 @@
+import asyncio
+import logging
+import os
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional, Tuple
+from dotenv import load_dotenv
+from sqlalchemy import func, or_, select
+from database.async_database import AsyncSessionLocal
+from database.async_redis import async_redis_client
+from database.redis_cache import queue_set_url
+from database.shards import shards
+from models.click_stat import ClickStat
+from models.url import URL, cache_value
+
+load_dotenv()
+
+CACHE_WARMUP_ON_STARTUP = os.getenv("CACHE_WARMUP_ON_STARTUP", "true").lower() == "true"
+CACHE_WARMUP_TOP_N = int(os.getenv("CACHE_WARMUP_TOP_N", "10000"))
+CACHE_WARMUP_BATCH_SIZE = int(os.getenv("CACHE_WARMUP_BATCH_SIZE", "500"))
+CACHE_WARMUP_WINDOW_DAYS = int(os.getenv("CACHE_WARMUP_WINDOW_DAYS", "7"))
+
+WARMUP_LOCK_KEY = "cache:warmup:lock"
+
+logger = logging.getLogger(__name__)
+
+_warmup_task = None
+
+async def top_links(db, limit: int, now: Optional[datetime] = None) -> List[Tuple[str, str]]:
+    # Most clicked over the recent window according to the daily rollups,
+    # topped up by lifetime clicks (all there is before any rollup has run),
+    # as (short code, cache value) pairs; expired links are left out
+    now = now or datetime.now(timezone.utc)
+    since = now - timedelta(days=CACHE_WARMUP_WINDOW_DAYS)
+    live = or_(URL.expires_at.is_(None), URL.expires_at > now)
+    recent = (
+        select(ClickStat.short_code, func.sum(ClickStat.clicks).label("clicks"))
+        .where(ClickStat.granularity == "d", ClickStat.bucket_start >= since)
+        .group_by(ClickStat.short_code)
+        .order_by(func.sum(ClickStat.clicks).desc())
+        .limit(limit)
+        .subquery()
+    )
+    result = await db.execute(
+        select(URL.short_code, URL.original_url, URL.expires_at, URL.permanent)
+        .join(recent, recent.c.short_code == URL.short_code)
+        .where(live)
+        .order_by(recent.c.clicks.desc())
+    )
+    links = {row.short_code: cache_value(row.original_url, row.expires_at, row.permanent) for row in result}
+    if len(links) < limit:
+        result = await db.execute(
+            select(URL.short_code, URL.original_url, URL.expires_at, URL.permanent).where(live).order_by(URL.clicks.desc().nulls_last()).limit(limit)
+        )
+        for row in result:
+            if len(links) >= limit:
+                break
+            links.setdefault(row.short_code, cache_value(row.original_url, row.expires_at, row.permanent))
+    return list(links.items())
+
+async def warm_url_cache(session_factory=AsyncSessionLocal, limit: int = CACHE_WARMUP_TOP_N) -> int:
+    # One worker warms at a time; the others would only repeat the same writes
+    token = uuid.uuid4().hex
+    if not await async_redis_client.set(WARMUP_LOCK_KEY, token, nx=True, ex=300):
+        return 0
+    try:
+        # Every shard warms its own Redis with its own top links
+        warmed = 0
+        for shard in shards.values():
+            async with shard.session_factory(session_factory)() as db:
+                links = await top_links(db, limit)
+
+            client = shard.client(async_redis_client)
+            for start in range(0, len(links), CACHE_WARMUP_BATCH_SIZE):
+                pipe = client.pipeline(transaction=False)
+                for short_code, value in links[start:start + CACHE_WARMUP_BATCH_SIZE]:
+                    # Never overwrite a mapping written since the query ran
+                    queue_set_url(pipe, short_code, value, only_if_missing=True)
+                await pipe.execute()
+            warmed += len(links)
+        return warmed
+    finally:
+        if await async_redis_client.get(WARMUP_LOCK_KEY) == token.encode("utf-8"):
+            await async_redis_client.delete(WARMUP_LOCK_KEY)
+
+async def check_eviction_policy() -> None:
+    # Only url:/miss: keys carry a TTL. Under an allkeys-* policy Redis may
+    # also evict the short code counter and the analytics buckets
+    try:
+        policy = (await async_redis_client.config_get("maxmemory-policy")).get(b"maxmemory-policy", b"").decode("utf-8")
+    except Exception:
+        return
+    if policy.startswith("allkeys"):
+        logger.warning("Redis maxmemory-policy is %s; use volatile-lfu so only cache entries are evicted", policy)
+
+async def _warm_in_background() -> None:
+    await check_eviction_policy()
+    try:
+        warmed = await warm_url_cache()
+        if warmed:
+            logger.info("Warmed the Redis URL cache with %d links", warmed)
+    except Exception:
+        logger.warning("Could not warm the Redis URL cache", exc_info=True)
+
+def start_cache_warmup() -> None:
+    global _warmup_task
+    if not CACHE_WARMUP_ON_STARTUP or (_warmup_task is not None and not _warmup_task.done()):
+        return
+    _warmup_task = asyncio.get_running_loop().create_task(_warm_in_background())
+
+async def stop_cache_warmup() -> None:
+    global _warmup_task
+    if _warmup_task is None:
+        return
+    _warmup_task.cancel()
+    try:
+        await _warmup_task
+    except asyncio.CancelledError:
+        pass
+    _warmup_task = None
@@ -0,0 +1,113 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Awaitable, Callable, List, Optional, TypeVar
+from dotenv import load_dotenv
+from redis.exceptions import ConnectionError as RedisConnectionError, RedisError, TimeoutError as RedisTimeoutError
+
+load_dotenv()
+
+# Consecutive failed calls that open the circuit
+REDIS_BREAKER_FAILURE_THRESHOLD = int(os.getenv("REDIS_BREAKER_FAILURE_THRESHOLD", "5"))
+# How long an open circuit fails fast before one probe call is let through
+REDIS_BREAKER_RESET_SECONDS = float(os.getenv("REDIS_BREAKER_RESET_SECONDS", "10"))
+# Upper bound for one guarded call, including waiting for a pooled connection;
+# well below the socket timeouts so a slow Redis cannot stall redirects
+REDIS_CALL_TIMEOUT_SECONDS = float(os.getenv("REDIS_CALL_TIMEOUT_SECONDS", "0.5"))
+
+T = TypeVar("T")
+
+logger = logging.getLogger(__name__)
+
+class CircuitOpenError(RedisConnectionError):
+    """Raised instead of calling Redis while the circuit is open."""
+
+class CircuitBreaker:
+    """Fails fast once a dependency has failed several times in a row.
+
+    After ``reset_timeout`` a single call is let through (half-open): if it
+    succeeds the circuit closes again, otherwise it stays open for another
+    period.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, name: str, failure_threshold: int = REDIS_BREAKER_FAILURE_THRESHOLD,
+                 reset_timeout: float = REDIS_BREAKER_RESET_SECONDS, call_timeout: float = REDIS_CALL_TIMEOUT_SECONDS):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.call_timeout = call_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.trips = 0
+        self._opened_at = 0.0
+        self._probing = False
+        # Called when the circuit closes again after having been open
+        self.on_close: List[Callable[[], None]] = []
+
+    @property
+    def is_open(self) -> bool:
+        return self.state != self.CLOSED
+
+    def allow(self) -> bool:
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+            self.state = self.HALF_OPEN
+            self._probing = False
+        if self.state == self.HALF_OPEN and not self._probing:
+            self._probing = True
+            return True
+        return False
+
+    def record_success(self) -> None:
+        recovered = self.state != self.CLOSED
+        if recovered:
+            logger.warning("%s answered again, closing the circuit", self.name)
+        self.state = self.CLOSED
+        self.failures = 0
+        self._probing = False
+        if recovered:
+            for callback in self.on_close:
+                callback()
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state == self.CLOSED:
+                self.trips += 1
+                logger.warning("%s failed %d times in a row, failing fast for %ss", self.name, self.failures, self.reset_timeout)
+            self.state = self.OPEN
+            self._opened_at = time.monotonic()
+            self._probing = False
+
+    async def call(self, func: Callable[..., Awaitable[T]], *args, timeout: Optional[float] = None, **kwargs) -> T:
+        # timeout overrides call_timeout, e.g. for large background pipelines
+        if not self.allow():
+            raise CircuitOpenError(f"{self.name} circuit is open")
+        timeout = timeout or self.call_timeout
+        try:
+            result = await asyncio.wait_for(func(*args, **kwargs), timeout)
+        except asyncio.TimeoutError as exc:
+            self.record_failure()
+            raise RedisTimeoutError(f"{self.name} did not answer within {timeout}s") from exc
+        except (RedisConnectionError, RedisTimeoutError, OSError):
+            self.record_failure()
+            raise
+        except RedisError:
+            # Any other Redis error still means the server answered
+            self.record_success()
+            raise
+        except BaseException:
+            # A cancelled probe lets the next call probe instead
+            self._probing = False
+            raise
+        self.record_success()
+        return result
+
+    def describe(self) -> dict:
+        return {"state": self.state, "consecutive_failures": self.failures, "trips": self.trips}
+
+redis_breaker = CircuitBreaker("Redis")
@@ -0,0 +1,167 @@
+import asyncio
+import logging
+import os
+import threading
+from collections import defaultdict
+from typing import Dict, List, Optional, Set, Tuple
+from dotenv import load_dotenv
+from sqlalchemy import Integer, String, bindparam, column, func, update, values
+from database.async_database import AsyncSessionLocal
+from database.shards import group_by_shard, shard_for, shards
+from models.url import URL
+from services.metrics import DROPPED_CLICKS
+
+load_dotenv()
+
+CLICK_FLUSH_INTERVAL_SECONDS = float(os.getenv("CLICK_FLUSH_INTERVAL_SECONDS", "5"))
+CLICK_FLUSH_BATCH_SIZE = int(os.getenv("CLICK_FLUSH_BATCH_SIZE", "500"))
+
+logger = logging.getLogger(__name__)
+
+class ClickBuffer:
+    """Accumulates click increments per short code until they are flushed."""
+
+    def __init__(self):
+        self._pending: Dict[str, int] = defaultdict(int)
+        self._lock = threading.Lock()
+        # Created by start_click_flusher, so it belongs to the running loop
+        self.batch_ready: Optional[asyncio.Event] = None
+
+    def record(self, short_code: str, count: int = 1) -> None:
+        with self._lock:
+            self._pending[short_code] += count
+            size = len(self._pending)
+        if size >= CLICK_FLUSH_BATCH_SIZE and self.batch_ready is not None:
+            self.batch_ready.set()
+
+    def pending(self, short_code: str) -> int:
+        with self._lock:
+            return self._pending.get(short_code, 0)
+
+    def drain(self) -> Dict[str, int]:
+        with self._lock:
+            pending, self._pending = self._pending, defaultdict(int)
+        if self.batch_ready is not None:
+            self.batch_ready.clear()
+        return dict(pending)
+
+    def restore(self, counts: Dict[str, int]) -> None:
+        # Put back increments whose flush failed so the next one retries them
+        with self._lock:
+            for short_code, count in counts.items():
+                self._pending[short_code] += count
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+click_buffer = ClickBuffer()
+
+_flusher_task = None
+
+urls_table = URL.__table__
+
+def _bulk_update_statement(rows: List[Tuple[str, int]]):
+    # UPDATE urls SET clicks = clicks + v.delta FROM (VALUES ...) AS v(short_code, delta)
+    deltas = values(
+        column("short_code", String),
+        column("delta", Integer),
+        name="v",
+    ).data(rows)
+    return (
+        update(urls_table)
+        .values(clicks=func.coalesce(urls_table.c.clicks, 0) + deltas.c.delta)
+        .where(urls_table.c.short_code == deltas.c.short_code)
+    )
+
+async def _write_batch(db, rows: List[Tuple[str, int]]) -> Set[str]:
+    # The short codes this shard holds, i.e. whose clicks were written
+    if db.bind.dialect.name == "postgresql":
+        result = await db.execute(_bulk_update_statement(rows).returning(urls_table.c.short_code))
+        return set(result.scalars())
+    # SQLite (used by the tests) has no VALUES table aliases, fall back to one update per code
+    written = set()
+    statement = (
+        update(urls_table)
+        .where(urls_table.c.short_code == bindparam("code"))
+        .values(clicks=func.coalesce(urls_table.c.clicks, 0) + bindparam("delta"))
+    )
+    for short_code, delta in rows:
+        result = await db.execute(statement, {"code": short_code, "delta": delta})
+        if result.rowcount:
+            written.add(short_code)
+    return written
+
+async def _write_to(name: str, short_codes: List[str], counts: Dict[str, int], flushed: Set[str], session_factory) -> None:
+    # Adds each committed batch's codes to flushed, so a later failure does
+    # not put them back in the buffer
+    async with shards[name].session_factory(session_factory)() as db:
+        for start in range(0, len(short_codes), CLICK_FLUSH_BATCH_SIZE):
+            batch = [(short_code, counts[short_code]) for short_code in short_codes[start:start + CLICK_FLUSH_BATCH_SIZE]]
+            written = await _write_batch(db, batch)
+            await db.commit()
+            flushed |= written
+
+async def flush_clicks(buffer: ClickBuffer = click_buffer, session_factory=AsyncSessionLocal) -> int:
+    counts = buffer.drain()
+    if not counts:
+        return 0
+
+    # Sorted so concurrent flushes from other workers lock rows in the same order
+    flushed = set()
+    try:
+        for name, short_codes in group_by_shard(sorted(counts)).items():
+            await _write_to(name, short_codes, counts, flushed, session_factory)
+        # A code its shard does not hold may be mid-rebalance, or this worker
+        # may still hash with the old ring: look for it on the other shards
+        missing = sorted(set(counts) - flushed)
+        for name in shards:
+            if missing:
+                candidates = [short_code for short_code in missing if shard_for(short_code).name != name]
+                if candidates:
+                    await _write_to(name, candidates, counts, flushed, session_factory)
+                    missing = [short_code for short_code in missing if short_code not in flushed]
+    except Exception:
+        buffer.restore({short_code: count for short_code, count in counts.items() if short_code not in flushed})
+        raise
+    if missing:
+        # Deleted (swept as expired) since they were clicked
+        dropped = sum(counts[short_code] for short_code in missing)
+        DROPPED_CLICKS.inc(dropped)
+        logger.warning("Dropped %d clicks of %d short codes no shard holds", dropped, len(missing))
+    return len(flushed)
+
+async def _run_flusher(buffer: ClickBuffer) -> None:
+    while True:
+        try:
+            await asyncio.wait_for(buffer.batch_ready.wait(), timeout=CLICK_FLUSH_INTERVAL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+        try:
+            await flush_clicks(buffer)
+        except Exception:
+            logger.exception("Failed to flush %d buffered click counters", len(buffer))
+
+def start_click_flusher(buffer: ClickBuffer = click_buffer) -> None:
+    global _flusher_task
+    if _flusher_task is not None and not _flusher_task.done():
+        return
+    buffer.batch_ready = asyncio.Event()
+    if len(buffer) >= CLICK_FLUSH_BATCH_SIZE:
+        buffer.batch_ready.set()
+    _flusher_task = asyncio.get_running_loop().create_task(_run_flusher(buffer))
+
+async def stop_click_flusher(buffer: ClickBuffer = click_buffer) -> None:
+    global _flusher_task
+    if _flusher_task is not None:
+        _flusher_task.cancel()
+        try:
+            await _flusher_task
+        except asyncio.CancelledError:
+            pass
+        _flusher_task = None
+    buffer.batch_ready = None
+    # Write out whatever is still buffered before the worker exits
+    try:
+        await flush_clicks(buffer)
+    except Exception:
+        logger.exception("Dropping %d buffered click counters on shutdown", len(buffer))
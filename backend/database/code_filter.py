@@ -0,0 +1,121 @@
+import asyncio
+import hashlib
+import logging
+import math
+import os
+from typing import Iterable, Optional
+from dotenv import load_dotenv
+from sqlalchemy import func, select
+from database.async_database import AsyncSessionLocal
+from database.shards import shards
+from models.url import URL
+
+load_dotenv()
+
+CODE_FILTER_CAPACITY = int(os.getenv("CODE_FILTER_CAPACITY", "1000000"))
+CODE_FILTER_ERROR_RATE = float(os.getenv("CODE_FILTER_ERROR_RATE", "0.01"))
+CODE_FILTER_REBUILD_BATCH_SIZE = int(os.getenv("CODE_FILTER_REBUILD_BATCH_SIZE", "10000"))
+
+logger = logging.getLogger(__name__)
+
+class BloomFilter:
+    """Probabilistic set of short codes.
+
+    ``code in bloom`` is never False for a code that was added; it is True for
+    a code that was not added with probability of about ``error_rate`` while
+    the filter holds at most ``capacity`` codes.
+    """
+
+    def __init__(self, capacity: int = CODE_FILTER_CAPACITY, error_rate: float = CODE_FILTER_ERROR_RATE):
+        capacity = max(capacity, 1)
+        self.size = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key: str) -> Iterable[int]:
+        # Double hashing: k positions from two 64-bit halves of one digest
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "big")
+        second = int.from_bytes(digest[8:], "big") | 1
+        return ((first + i * second) % self.size for i in range(self.hash_count))
+
+    def add(self, key: str) -> None:
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+class CodeFilter:
+    """Per-worker membership filter of every short code in the ``urls`` table."""
+
+    def __init__(self):
+        self._bloom: Optional[BloomFilter] = None
+        self._added_during_rebuild: Optional[set] = None
+        self._rebuild_task = None
+
+    @property
+    def ready(self) -> bool:
+        return self._bloom is not None
+
+    def might_exist(self, short_code: str) -> bool:
+        # Until the filter has been built every code might exist
+        return self._bloom is None or short_code in self._bloom
+
+    def add(self, short_code: str) -> None:
+        if self._bloom is not None:
+            self._bloom.add(short_code)
+        if self._added_during_rebuild is not None:
+            self._added_during_rebuild.add(short_code)
+
+    async def rebuild(self, session_factory=AsyncSessionLocal) -> None:
+        self._added_during_rebuild = set()
+        try:
+            factories = [shard.session_factory(session_factory) for shard in shards.values()]
+            count = 0
+            for factory in factories:
+                async with factory() as db:
+                    count += (await db.execute(select(func.count(URL.id)))).scalar_one()
+            # Leave room to grow so the false-positive rate holds until the next rebuild
+            bloom = BloomFilter(capacity=max(CODE_FILTER_CAPACITY, count * 2))
+            for factory in factories:
+                async with factory() as db:
+                    result = await db.stream_scalars(
+                        select(URL.short_code).execution_options(yield_per=CODE_FILTER_REBUILD_BATCH_SIZE)
+                    )
+                    async for short_code in result:
+                        bloom.add(short_code)
+            for short_code in self._added_during_rebuild:
+                bloom.add(short_code)
+            self._bloom = bloom
+            logger.info("Short code filter built from %d codes", count)
+        finally:
+            self._added_during_rebuild = None
+
+    def reset(self) -> None:
+        # Forget the filter (every code "might exist") and build a fresh one
+        self._bloom = None
+        self.schedule_rebuild()
+
+    def schedule_rebuild(self) -> None:
+        if self._rebuild_task is not None and not self._rebuild_task.done():
+            return
+
+        async def run():
+            try:
+                await self.rebuild()
+            except Exception:
+                logger.exception("Could not build the short code filter")
+
+        self._rebuild_task = asyncio.get_running_loop().create_task(run())
+
+    async def stop(self) -> None:
+        if self._rebuild_task is not None:
+            self._rebuild_task.cancel()
+            try:
+                await self._rebuild_task
+            except asyncio.CancelledError:
+                pass
+            self._rebuild_task = None
+
+code_filter = CodeFilter()
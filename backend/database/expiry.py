@@ -0,0 +1,79 @@
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+from dotenv import load_dotenv
+from sqlalchemy import delete, select
+from database.async_database import AsyncSessionLocal
+from database.redis_cache import EXPIRED_URL_CACHE_SECONDS, forget_urls
+from database.shards import shards
+from models.click_stat import ClickStat
+from models.url import URL
+
+load_dotenv()
+
+URL_EXPIRY_SWEEP_INTERVAL_SECONDS = float(os.getenv("URL_EXPIRY_SWEEP_INTERVAL_SECONDS", "60"))
+URL_EXPIRY_SWEEP_BATCH_SIZE = int(os.getenv("URL_EXPIRY_SWEEP_BATCH_SIZE", "1000"))
+
+logger = logging.getLogger(__name__)
+
+_sweeper_task = None
+
+async def sweep_expired(session_factory=AsyncSessionLocal, now: Optional[datetime] = None,
+                        batch_size: int = URL_EXPIRY_SWEEP_BATCH_SIZE) -> int:
+    # Deletes links (and their click stats) that expired more than
+    # EXPIRED_URL_CACHE_SECONDS ago: until then redirects answer 410 from the
+    # caches, afterwards 404. One batch and transaction at a time per shard,
+    # walking ix_urls_expires_at; SKIP LOCKED keeps workers sweeping at the
+    # same time from waiting on each other
+    before = (now or datetime.now(timezone.utc)) - timedelta(seconds=EXPIRED_URL_CACHE_SECONDS)
+    swept = 0
+    for shard in shards.values():
+        while True:
+            async with shard.session_factory(session_factory)() as db:
+                rows = (await db.execute(
+                    select(URL.id, URL.short_code)
+                    .where(URL.expires_at < before)
+                    .order_by(URL.expires_at)
+                    .limit(batch_size)
+                    .with_for_update(skip_locked=True)
+                )).all()
+                if not rows:
+                    break
+                short_codes = [row.short_code for row in rows]
+                await db.execute(delete(ClickStat).where(ClickStat.short_code.in_(short_codes)))
+                await db.execute(delete(URL).where(URL.id.in_([row.id for row in rows])))
+                await db.commit()
+            await forget_urls(short_codes)
+            swept += len(rows)
+            if len(rows) < batch_size:
+                break
+    return swept
+
+async def _run_sweeper() -> None:
+    while True:
+        await asyncio.sleep(URL_EXPIRY_SWEEP_INTERVAL_SECONDS)
+        try:
+            swept = await sweep_expired()
+            if swept:
+                logger.info("Deleted %d expired links", swept)
+        except Exception:
+            logger.exception("Failed to sweep expired links")
+
+def start_expiry_sweeper() -> None:
+    global _sweeper_task
+    if URL_EXPIRY_SWEEP_INTERVAL_SECONDS <= 0 or (_sweeper_task is not None and not _sweeper_task.done()):
+        return
+    _sweeper_task = asyncio.get_running_loop().create_task(_run_sweeper())
+
+async def stop_expiry_sweeper() -> None:
+    global _sweeper_task
+    if _sweeper_task is None:
+        return
+    _sweeper_task.cancel()
+    try:
+        await _sweeper_task
+    except asyncio.CancelledError:
+        pass
+    _sweeper_task = None
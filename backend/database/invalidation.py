@@ -0,0 +1,135 @@
+import asyncio
+import logging
+import os
+from typing import Iterable, List, Set
+from dotenv import load_dotenv
+from redis.exceptions import RedisError
+from database.async_redis import async_pubsub_client, async_redis_client
+from database.circuit_breaker import redis_breaker
+from database.local_cache import url_cache, principal_cache
+from database.code_filter import code_filter
+
+load_dotenv()
+
+INVALIDATION_CHANNEL = os.getenv("CACHE_INVALIDATION_CHANNEL", "url-cache:invalidate")
+USER_INVALIDATION_CHANNEL = os.getenv("USER_INVALIDATION_CHANNEL", "user-cache:invalidate")
+# How often new codes whose announcement was lost are published again
+ANNOUNCE_RETRY_SECONDS = float(os.getenv("ANNOUNCE_RETRY_SECONDS", "1"))
+
+logger = logging.getLogger(__name__)
+
+_listener_task = None
+_subscribed = False
+_announce_task = None
+# New codes the other workers have not been told about yet
+_unannounced: Set[str] = set()
+
+# A message carries one or more short codes separated by newlines
+def encode_codes(short_codes: Iterable[str]) -> str:
+    return "\n".join(short_codes)
+
+def decode_codes(data: bytes) -> List[str]:
+    return data.decode("utf-8").split("\n")
+
+def apply_changes(short_codes: Iterable[str]) -> None:
+    # A code whose mapping changed exists, so it also goes into the filter
+    for short_code in short_codes:
+        url_cache.delete(short_code)
+        code_filter.add(short_code)
+
+async def invalidate_url(short_code: str) -> None:
+    # Drop the mapping locally right away, then tell the other workers
+    apply_changes([short_code])
+    try:
+        await async_redis_client.publish(INVALIDATION_CHANNEL, short_code)
+    except Exception:
+        logger.warning("Could not publish cache invalidation for %s", short_code, exc_info=True)
+
+async def invalidate_user(user_id: int) -> None:
+    principal_cache.delete(user_id)
+    try:
+        await async_redis_client.publish(USER_INVALIDATION_CHANNEL, str(user_id))
+    except Exception:
+        logger.warning("Could not publish cache invalidation for user %s", user_id, exc_info=True)
+
+def filter_misses_are_final() -> bool:
+    # Other workers announce the codes they create over pub/sub. While that
+    # cannot reach this worker (listener down, Redis circuit open) a code
+    # the filter has not seen may have been created elsewhere
+    return _subscribed and not redis_breaker.is_open and not _unannounced
+
+def announce_later(short_codes: Iterable[str]) -> None:
+    # The announcement of these new codes was lost, so no worker's filter
+    # holds them. Until a retry gets through, this worker does not trust its
+    # filter either; the others learn the codes from the retry
+    short_codes = list(short_codes)
+    apply_changes(short_codes)
+    _unannounced.update(short_codes)
+    global _announce_task
+    if _announce_task is None or _announce_task.done():
+        _announce_task = asyncio.get_running_loop().create_task(_announce())
+
+async def _announce() -> None:
+    while _unannounced:
+        await asyncio.sleep(ANNOUNCE_RETRY_SECONDS)
+        short_codes = list(_unannounced)
+        try:
+            await redis_breaker.call(async_redis_client.publish, INVALIDATION_CHANNEL, encode_codes(short_codes))
+        except RedisError as exc:
+            logger.warning("Could not announce %d new short codes, retrying: %s", len(short_codes), exc)
+            continue
+        _unannounced.difference_update(short_codes)
+
+def forget_filter() -> None:
+    # Codes announced while the circuit was open were lost, so the filter
+    # starts over (every code "might exist") once Redis answers again
+    code_filter.reset()
+
+redis_breaker.on_close.append(forget_filter)
+
+async def _listen() -> None:
+    global _subscribed
+    while True:
+        pubsub = async_pubsub_client.pubsub(ignore_subscribe_messages=True)
+        try:
+            await pubsub.subscribe(INVALIDATION_CHANNEL, USER_INVALIDATION_CHANNEL)
+            _subscribed = True
+            # Anything published while we were not subscribed is lost, so
+            # start from empty caches and a freshly built filter after
+            # every (re)subscribe
+            url_cache.clear()
+            principal_cache.clear()
+            code_filter.reset()
+            async for message in pubsub.listen():
+                if message["type"] != "message":
+                    continue
+                if message["channel"].decode("utf-8") == USER_INVALIDATION_CHANNEL:
+                    principal_cache.delete(int(message["data"]))
+                else:
+                    apply_changes(decode_codes(message["data"]))
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.warning("Cache invalidation listener disconnected, retrying", exc_info=True)
+            await asyncio.sleep(1.0)
+        finally:
+            _subscribed = False
+            await pubsub.aclose()
+
+def start_invalidation_listener() -> None:
+    global _listener_task
+    if _listener_task is not None and not _listener_task.done():
+        return
+    _listener_task = asyncio.get_running_loop().create_task(_listen())
+
+async def stop_invalidation_listener() -> None:
+    global _listener_task, _announce_task
+    for task in (_listener_task, _announce_task):
+        if task is None:
+            continue
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+    _listener_task = _announce_task = None
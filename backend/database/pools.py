@@ -0,0 +1,173 @@
+import asyncio
+import os
+import threading
+import time
+from typing import Dict
+from dotenv import load_dotenv
+import redis.asyncio
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+load_dotenv()
+
+# Size workers x (DB_POOL_SIZE + DB_MAX_OVERFLOW) to stay under Postgres max_connections
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT_SECONDS = float(os.getenv("DB_POOL_TIMEOUT_SECONDS", "30"))
+DB_POOL_RECYCLE_SECONDS = int(os.getenv("DB_POOL_RECYCLE_SECONDS", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+DB_CONNECT_TIMEOUT_SECONDS = int(os.getenv("DB_CONNECT_TIMEOUT_SECONDS", "10"))
+
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", "50"))
+REDIS_POOL_TIMEOUT_SECONDS = float(os.getenv("REDIS_POOL_TIMEOUT_SECONDS", "5"))
+REDIS_SOCKET_TIMEOUT_SECONDS = float(os.getenv("REDIS_SOCKET_TIMEOUT_SECONDS", "2"))
+REDIS_SOCKET_CONNECT_TIMEOUT_SECONDS = float(os.getenv("REDIS_SOCKET_CONNECT_TIMEOUT_SECONDS", "2"))
+REDIS_HEALTH_CHECK_INTERVAL_SECONDS = int(os.getenv("REDIS_HEALTH_CHECK_INTERVAL_SECONDS", "30"))
+
+def engine_options() -> dict:
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT_SECONDS,
+        "pool_recycle": DB_POOL_RECYCLE_SECONDS,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+
+def redis_options() -> dict:
+    return {
+        "socket_timeout": REDIS_SOCKET_TIMEOUT_SECONDS,
+        "socket_connect_timeout": REDIS_SOCKET_CONNECT_TIMEOUT_SECONDS,
+        "socket_keepalive": True,
+        "health_check_interval": REDIS_HEALTH_CHECK_INTERVAL_SECONDS,
+        "retry_on_timeout": True,
+    }
+
+class PoolStats:
+    """Counts checkouts from a connection pool and how long callers waited for them."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.waits = 0
+        self.timeouts = 0
+        self.checkout_seconds = 0.0
+        self.max_checkout_seconds = 0.0
+
+    def record(self, elapsed: float, waited: bool) -> None:
+        with self._lock:
+            self.checkouts += 1
+            self.waits += int(waited)
+            self.checkout_seconds += elapsed
+            self.max_checkout_seconds = max(self.max_checkout_seconds, elapsed)
+
+    def record_timeout(self) -> None:
+        with self._lock:
+            self.timeouts += 1
+
+    def snapshot(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                "checkouts": self.checkouts,
+                "waits": self.waits,
+                "timeouts": self.timeouts,
+                "avg_checkout_ms": round(1000 * self.checkout_seconds / self.checkouts, 3) if self.checkouts else 0.0,
+                "max_checkout_ms": round(1000 * self.max_checkout_seconds, 3),
+            }
+
+class _InstrumentedQueuePool:
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = PoolStats()
+
+    def recreate(self):
+        # Pre-ping invalidation and dispose() swap in a fresh pool, keep the counters
+        pool = super().recreate()
+        pool.stats = self.stats
+        return pool
+
+    def _do_get(self):
+        # With nothing idle and no overflow left the caller has to wait for a checkin
+        waited = self.checkedin() == 0 and self._max_overflow > -1 and self.overflow() >= self._max_overflow
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except Exception:
+            self.stats.record_timeout()
+            raise
+        self.stats.record(time.perf_counter() - started, waited)
+        return connection
+
+    def describe(self) -> Dict[str, float]:
+        return {
+            "size": self.size(),
+            "max_overflow": self._max_overflow,
+            "in_use": self.checkedout(),
+            "idle": self.checkedin(),
+            "overflow": max(self.overflow(), 0),
+            **self.stats.snapshot(),
+        }
+
+class InstrumentedQueuePool(_InstrumentedQueuePool, QueuePool):
+    pass
+
+class InstrumentedAsyncQueuePool(_InstrumentedQueuePool, AsyncAdaptedQueuePool):
+    pass
+
+class _PerLoopRedisPool:
+    # Connections (and the blocking pool's condition) belong to the event loop
+    # they were made on. The clients are module-level, so a process that runs
+    # more than one loop, like the test client, starts over on each new one
+    _loop = None
+
+    def _check_loop(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self._loop is loop:
+            return
+        if self._loop is not None:
+            self.reset()
+            self._rebind()
+        self._loop = loop
+
+    def _rebind(self) -> None:
+        pass
+
+    async def get_connection(self, command_name, *keys, **options):
+        self._check_loop()
+        return await super().get_connection(command_name, *keys, **options)
+
+    async def release(self, connection):
+        # Connections handed out on a previous loop were dropped with it
+        if connection in self._in_use_connections:
+            await super().release(connection)
+
+class PerLoopRedisPool(_PerLoopRedisPool, redis.asyncio.ConnectionPool):
+    pass
+
+class InstrumentedRedisPool(_PerLoopRedisPool, redis.asyncio.BlockingConnectionPool):
+    """Blocks up to ``timeout`` seconds for a free connection instead of failing immediately."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = PoolStats()
+
+    def _rebind(self) -> None:
+        self._condition = asyncio.Condition()
+
+    async def get_connection(self, command_name, *keys, **options):
+        self._check_loop()
+        waited = not self._available_connections and len(self._in_use_connections) >= self.max_connections
+        started = time.perf_counter()
+        try:
+            connection = await super().get_connection(command_name, *keys, **options)
+        except redis.asyncio.ConnectionError:
+            self.stats.record_timeout()
+            raise
+        self.stats.record(time.perf_counter() - started, waited)
+        return connection
+
+    def describe(self) -> Dict[str, float]:
+        return {
+            "max_connections": self.max_connections,
+            "in_use": len(self._in_use_connections),
+            "idle": len(self._available_connections),
+            **self.stats.snapshot(),
+        }
@@ -0,0 +1,135 @@
+"""Move urls and their click stats to the shard the hash ring assigns them.
+
+Changing DB_SHARD_HOSTS moves part of the codes to other shards. Copy them
+there before the new setting goes live, then copy what was created in the
+meantime and delete the moved rows from their old shard::
+
+    cd backend
+    DB_SHARD_HOSTS=db-2,db-3 python -m database.rebalance --copy-only
+    # ...deploy DB_SHARD_HOSTS=db-2,db-3...
+    DB_SHARD_HOSTS=db-2,db-3 python -m database.rebalance
+
+A shard being removed is emptied with ``--drain HOST`` while it is no longer
+listed in DB_SHARD_HOSTS.
+"""
+import argparse
+import asyncio
+import logging
+import sys
+from typing import List
+
+from sqlalchemy import case, delete, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from database.async_database import AsyncSessionLocal, async_engine
+from database.shards import DEFAULT_SHARD, Shard, build_shards, group_by_shard, shard_for, shards
+from models.click_stat import ClickStat
+from models.url import URL
+import models.user
+
+REBALANCE_BATCH_SIZE = 1000
+
+logger = logging.getLogger(__name__)
+
+def _insert(session):
+    return pg_insert if session.bind.dialect.name == "postgresql" else sqlite_insert
+
+async def copy_rows(target: Shard, source_db, urls: List[URL], default_factory=AsyncSessionLocal) -> None:
+    # Idempotent, so a second pass only adds what changed since the first;
+    # counters keep the larger value rather than adding up on every pass
+    short_codes = [db_url.short_code for db_url in urls]
+    stats = (await source_db.execute(select(ClickStat).where(ClickStat.short_code.in_(short_codes)))).scalars().all()
+
+    async with target.session_factory(default_factory)() as db:
+        insert = _insert(db)
+        stmt = insert(URL).values([
+            {
+                "original_url": db_url.original_url,
+                "short_code": db_url.short_code,
+                "created_at": db_url.created_at,
+                "clicks": db_url.clicks,
+                "user_id": db_url.user_id,
+                "url_hash": db_url.url_hash,
+                "expires_at": db_url.expires_at,
+                "permanent": db_url.permanent,
+            }
+            for db_url in urls
+        ])
+        await db.execute(stmt.on_conflict_do_update(
+            index_elements=["short_code"],
+            set_={"clicks": case((stmt.excluded.clicks > URL.clicks, stmt.excluded.clicks), else_=URL.clicks)},
+        ))
+        if stats:
+            stmt = insert(ClickStat).values([
+                {
+                    "short_code": stat.short_code,
+                    "granularity": stat.granularity,
+                    "bucket_start": stat.bucket_start,
+                    "clicks": stat.clicks,
+                    "uniques": stat.uniques,
+                }
+                for stat in stats
+            ])
+            await db.execute(stmt.on_conflict_do_update(
+                index_elements=["short_code", "granularity", "bucket_start"],
+                set_={"clicks": case((stmt.excluded.clicks > ClickStat.clicks, stmt.excluded.clicks), else_=ClickStat.clicks)},
+            ))
+        await db.commit()
+
+async def rebalance_shard(source: Shard, batch_size: int = REBALANCE_BATCH_SIZE, copy_only: bool = False,
+                          default_factory=AsyncSessionLocal) -> int:
+    # Walks the source shard in id order and moves every row the ring places
+    # elsewhere, one batch (and one transaction per shard) at a time
+    moved = 0
+    last_id = 0
+    async with source.session_factory(default_factory)() as db:
+        while True:
+            urls = (await db.execute(
+                select(URL).where(URL.id > last_id).order_by(URL.id).limit(batch_size)
+            )).scalars().all()
+            if not urls:
+                return moved
+            last_id = urls[-1].id
+
+            misplaced = [db_url for db_url in urls if shard_for(db_url.short_code).name != source.name]
+            for name, group in group_by_shard(misplaced, key=lambda db_url: db_url.short_code).items():
+                await copy_rows(shards[name], db, group, default_factory)
+            if misplaced and not copy_only:
+                short_codes = [db_url.short_code for db_url in misplaced]
+                await db.execute(delete(ClickStat).where(ClickStat.short_code.in_(short_codes)))
+                await db.execute(delete(URL).where(URL.short_code.in_(short_codes)))
+                await db.commit()
+            # Nothing in the batch is needed again
+            db.expunge_all()
+            moved += len(misplaced)
+
+async def run(args) -> dict:
+    draining = build_shards(args.drain, [])
+    del draining[DEFAULT_SHARD]
+    sources = list(shards.values()) + list(draining.values())
+    moved = {}
+    try:
+        for source in sources:
+            moved[source.name] = await rebalance_shard(source, args.batch_size, args.copy_only)
+            logger.warning("%s: %s %d urls", source.name, "copied" if args.copy_only else "moved", moved[source.name])
+    finally:
+        for shard in sources:
+            if not shard.is_default:
+                await shard.engine.dispose()
+        await async_engine.dispose()
+    return moved
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--batch-size", type=int, default=REBALANCE_BATCH_SIZE, help="urls read from a shard at a time")
+    parser.add_argument("--copy-only", action="store_true", help="copy misplaced rows without deleting them from their old shard")
+    parser.add_argument("--drain", action="append", default=[], metavar="HOST", help="shard being removed; every row on it is moved")
+    return parser.parse_args(argv)
+
+def main(argv=None) -> None:
+    logging.basicConfig(level=logging.WARNING, format="%(message)s")
+    asyncio.run(run(parse_args(argv)))
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,195 @@
+import asyncio
+import logging
+import os
+import time
+import zlib
+from typing import Dict, Iterable, Optional, Tuple
+from dotenv import load_dotenv
+from redis.exceptions import RedisError
+from database.async_redis import async_redis_client
+from database.circuit_breaker import CircuitOpenError, redis_breaker
+from database.invalidation import INVALIDATION_CHANNEL, announce_later, encode_codes
+from database.shards import group_by_shard, shard_for, shards
+from models.url import split_cache_value
+from services.metrics import record_cache
+
+load_dotenv()
+
+NEGATIVE_CACHE_TTL_SECONDS = int(os.getenv("NEGATIVE_CACHE_TTL_SECONDS", "30"))
+# Mappings expire unless they keep getting hit; 0 keeps them forever
+URL_CACHE_TTL_SECONDS = int(os.getenv("URL_CACHE_TTL_SECONDS", "86400"))
+# Expiring links stay cached this long past their expiry to answer 410
+EXPIRED_URL_CACHE_SECONDS = int(os.getenv("EXPIRED_URL_CACHE_SECONDS", "3600"))
+
+# "keys" stores one url:{code} string per code. "hash" groups codes into
+# REDIS_URL_HASH_BUCKETS small hashes that Redis keeps listpack-encoded, which
+# costs far less memory per code; the expiry then applies to a whole bucket
+REDIS_URL_LAYOUT = os.getenv("REDIS_URL_LAYOUT", "keys")
+REDIS_URL_HASH_BUCKETS = int(os.getenv("REDIS_URL_HASH_BUCKETS", "65536"))
+
+logger = logging.getLogger(__name__)
+
+# KEYS: url bucket, miss key. ARGV: short code, ttl. Returns the URL on a hit
+# (sliding the bucket's expiry), otherwise whether the code is known missing
+LOOKUP_BUCKET_SCRIPT = """
+local url = redis.call('HGET', KEYS[1], ARGV[1])
+if url then
+    if tonumber(ARGV[2]) > 0 then
+        redis.call('EXPIRE', KEYS[1], ARGV[2])
+    end
+    return url
+end
+return redis.call('EXISTS', KEYS[2])
+"""
+
+# KEYS: url key, miss key. ARGV: ttl. The same for the keys layout; the
+# expiry of an expiring link (a value whose header holds digits, see
+# models.url.cache_value) is never slid
+LOOKUP_KEY_SCRIPT = """
+local url = redis.call('GET', KEYS[1])
+if url then
+    local header = string.find(url, '\\0', 1, true)
+    local expiring = header and string.find(string.sub(url, 1, header), '%d')
+    if tonumber(ARGV[1]) > 0 and not expiring then
+        redis.call('EXPIRE', KEYS[1], ARGV[1])
+    end
+    return url
+end
+return redis.call('EXISTS', KEYS[2])
+"""
+
+lookup_bucket = async_redis_client.register_script(LOOKUP_BUCKET_SCRIPT)
+lookup_key = async_redis_client.register_script(LOOKUP_KEY_SCRIPT)
+
+def redis_for(short_code: str):
+    # The Redis caching the shard that holds short_code
+    return shard_for(short_code).client(async_redis_client)
+
+def breaker_for(short_code: str):
+    return shard_for(short_code).circuit(redis_breaker)
+
+def url_key(short_code: str) -> str:
+    return f"url:{short_code}"
+
+def url_bucket_key(short_code: str) -> str:
+    # Hashed rather than taken from a code prefix, so custom codes spread as
+    # evenly as generated ones
+    return f"urls:{zlib.crc32(short_code.encode('utf-8')) % REDIS_URL_HASH_BUCKETS:x}"
+
+def miss_key(short_code: str) -> str:
+    return f"miss:{short_code}"
+
+def url_ttl(value: Optional[str] = None) -> Optional[int]:
+    # The key of an expiring link goes away EXPIRED_URL_CACHE_SECONDS after
+    # the link does, however long URL_CACHE_TTL_SECONDS is
+    expires = split_cache_value(value).expires if value is not None else None
+    if expires is None:
+        return URL_CACHE_TTL_SECONDS or None
+    remaining = max(expires - int(time.time()), 0) + EXPIRED_URL_CACHE_SECONDS
+    return min(remaining, URL_CACHE_TTL_SECONDS) if URL_CACHE_TTL_SECONDS else remaining
+
+def queue_set_url(pipe, short_code: str, value: str, only_if_missing: bool = False) -> None:
+    # Adds the commands that store one mapping (see models.url.cache_value)
+    # to a pipeline. Hash buckets expire as a whole, so the expiry sweep
+    # removes expired links from them instead
+    if REDIS_URL_LAYOUT == "hash":
+        bucket = url_bucket_key(short_code)
+        if only_if_missing:
+            pipe.hsetnx(bucket, short_code, value)
+        else:
+            pipe.hset(bucket, short_code, value)
+        if URL_CACHE_TTL_SECONDS:
+            pipe.expire(bucket, URL_CACHE_TTL_SECONDS)
+    else:
+        pipe.set(url_key(short_code), value, ex=url_ttl(value), nx=only_if_missing)
+
+def queue_delete_url(pipe, short_code: str) -> None:
+    if REDIS_URL_LAYOUT == "hash":
+        pipe.hdel(url_bucket_key(short_code), short_code)
+    else:
+        pipe.delete(url_key(short_code))
+
+async def _lookup(short_code: str) -> Tuple[Optional[bytes], bool]:
+    client = redis_for(short_code)
+    if REDIS_URL_LAYOUT == "hash":
+        reply = await lookup_bucket(keys=[url_bucket_key(short_code), miss_key(short_code)], args=[short_code, URL_CACHE_TTL_SECONDS], client=client)
+    else:
+        reply = await lookup_key(keys=[url_key(short_code), miss_key(short_code)], args=[URL_CACHE_TTL_SECONDS], client=client)
+    if isinstance(reply, bytes):
+        return reply, False
+    return None, bool(reply)
+
+async def lookup_url(short_code: str) -> Tuple[Optional[str], bool]:
+    # Returns (cached value, known_missing) in a single round trip, sliding
+    # the mapping's expiry forward on a hit. While Redis is failing this
+    # reports a plain miss so the caller falls back to Postgres
+    try:
+        cached_url, known_missing = await breaker_for(short_code).call(_lookup, short_code)
+    except CircuitOpenError:
+        record_cache("redis", "open")
+        return None, False
+    except RedisError as exc:
+        record_cache("redis", "error")
+        logger.warning("Redis lookup for %s failed: %s", short_code, exc)
+        return None, False
+    if cached_url:
+        record_cache("redis", "hit")
+        return cached_url.decode("utf-8"), False
+    record_cache("redis", "negative" if known_missing else "miss")
+    return None, known_missing
+
+async def _best_effort(short_code: str, func, *args, **kwargs) -> None:
+    # Cache writes are skipped rather than failing the request while Redis is down
+    try:
+        await breaker_for(short_code).call(func, *args, **kwargs)
+    except CircuitOpenError:
+        pass
+    except RedisError as exc:
+        logger.warning("Redis write for %s failed: %s", short_code, exc)
+
+async def cache_url(short_code: str, value: str) -> None:
+    pipe = redis_for(short_code).pipeline(transaction=False)
+    queue_set_url(pipe, short_code, value)
+    await _best_effort(short_code, pipe.execute)
+
+async def mark_missing(short_code: str) -> None:
+    await _best_effort(short_code, redis_for(short_code).set, miss_key(short_code), b"1", ex=NEGATIVE_CACHE_TTL_SECONDS)
+
+async def publish_new_urls(urls: Dict[str, str]) -> None:
+    # Write new mappings (short code -> cache value) through to Redis, drop
+    # any negative entries for the codes and tell every worker about them,
+    # one round trip per shard's Redis
+    if not urls:
+        return
+    pipes = {}
+    for name, short_codes in group_by_shard(urls).items():
+        shard = shards[name]
+        client = shard.client(async_redis_client)
+        pipe, _ = pipes.setdefault(id(client), (client.pipeline(transaction=False), shard.circuit(redis_breaker)))
+        for short_code in short_codes:
+            queue_set_url(pipe, short_code, urls[short_code])
+        pipe.delete(*(miss_key(short_code) for short_code in short_codes))
+    pipe, _ = pipes.setdefault(id(async_redis_client), (async_redis_client.pipeline(transaction=False), redis_breaker))
+    pipe.publish(INVALIDATION_CHANNEL, encode_codes(urls))
+    results = await asyncio.gather(*(breaker.call(pipe.execute) for pipe, breaker in pipes.values()), return_exceptions=True)
+    for key, result in zip(pipes, results):
+        if not isinstance(result, Exception):
+            continue
+        if key == id(async_redis_client):
+            # Other workers would keep answering 404 for these codes
+            announce_later(urls)
+        if not isinstance(result, CircuitOpenError):
+            logger.warning("Could not publish %d new short codes: %s", len(urls), result)
+
+async def forget_urls(short_codes: Iterable[str]) -> None:
+    # Drops swept links from the cache; keys expire on their own by then,
+    # but hash buckets only ever expire as a whole
+    for name, codes in group_by_shard(short_codes).items():
+        shard = shards[name]
+        pipe = shard.client(async_redis_client).pipeline(transaction=False)
+        for short_code in codes:
+            queue_delete_url(pipe, short_code)
+        try:
+            await shard.circuit(redis_breaker).call(pipe.execute)
+        except RedisError as exc:
+            logger.warning("Could not drop %d expired links from Redis: %s", len(codes), exc)
@@ -0,0 +1,143 @@
+import itertools
+import logging
+import os
+import time
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, TypeVar
+from dotenv import load_dotenv
+from fastapi import Depends
+from sqlalchemy import event
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
+from database.async_database import AsyncSessionLocal, get_async_db
+from database.async_redis import async_redis_client
+from database.circuit_breaker import CircuitOpenError, redis_breaker
+from database.pools import DB_CONNECT_TIMEOUT_SECONDS, InstrumentedAsyncQueuePool, engine_options
+
+load_dotenv()
+
+# Comma-separated replica hosts sharing the primary's credentials and database
+DB_REPLICA_HOSTS = [host.strip() for host in os.getenv("DB_REPLICA_HOSTS", "").split(",") if host.strip()]
+# How long a replica that failed is skipped before it is tried again
+DB_REPLICA_RETRY_SECONDS = float(os.getenv("DB_REPLICA_RETRY_SECONDS", "30"))
+# How long a user's reads stay on the primary after they wrote; keep it above the replication lag
+DB_REPLICA_STICKY_SECONDS = int(os.getenv("DB_REPLICA_STICKY_SECONDS", "10"))
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+class ReplicaSet:
+    """Round-robins reads over replica engines, skipping ones that recently failed."""
+
+    def __init__(self, engines: List[AsyncEngine], retry_after: float = DB_REPLICA_RETRY_SECONDS):
+        self.engines = engines
+        self.retry_after = retry_after
+        self._down_until: Dict[int, float] = {}
+        self._turn = itertools.count()
+        for engine in engines:
+            self._watch(engine)
+
+    def _watch(self, engine: AsyncEngine) -> None:
+        @event.listens_for(engine.sync_engine, "handle_error")
+        def handle_error(exception_context):
+            # Raised while connecting (no connection yet) or a dropped connection
+            if exception_context.connection is None or exception_context.is_disconnect:
+                self.mark_down(engine)
+
+    def mark_down(self, engine: AsyncEngine) -> None:
+        if id(engine) not in self._down_until:
+            logger.warning("Replica %s is unhealthy, reading from the primary for %ss", engine.url.host, self.retry_after)
+        self._down_until[id(engine)] = time.monotonic() + self.retry_after
+
+    def choose(self) -> Optional[AsyncEngine]:
+        now = time.monotonic()
+        for _ in range(len(self.engines)):
+            engine = self.engines[next(self._turn) % len(self.engines)]
+            if self._down_until.get(id(engine), 0) <= now:
+                self._down_until.pop(id(engine), None)
+                return engine
+        return None
+
+    def describe(self) -> Dict[str, dict]:
+        now = time.monotonic()
+        return {
+            engine.url.host: {**engine.pool.describe(), "healthy": self._down_until.get(id(engine), 0) <= now}
+            for engine in self.engines
+        }
+
+def replica_url(host: str) -> str:
+    return f"postgresql+asyncpg://{os.getenv('DB_USER')}:{os.getenv('DB_PASSWORD')}@{host}/{os.getenv('DB_NAME')}"
+
+replicas = ReplicaSet([
+    create_async_engine(
+        replica_url(host),
+        poolclass=InstrumentedAsyncQueuePool,
+        connect_args={"timeout": DB_CONNECT_TIMEOUT_SECONDS},
+        **engine_options()
+    )
+    for host in DB_REPLICA_HOSTS
+])
+
+ReplicaSessionLocal = async_sessionmaker(class_=AsyncSession, autoflush=False, expire_on_commit=False, info={"replica": True})
+
+def sticky_key(user_id: int) -> str:
+    return f"primary-reads:{user_id}"
+
+async def pin_reads_to_primary(user_id: int) -> None:
+    # Read-your-writes: the user's next reads skip the (possibly lagging) replicas
+    if not replicas.engines:
+        return
+    try:
+        await redis_breaker.call(async_redis_client.set, sticky_key(user_id), b"1", ex=DB_REPLICA_STICKY_SECONDS)
+    except CircuitOpenError:
+        pass
+    except Exception:
+        logger.warning("Could not pin reads of user %s to the primary", user_id, exc_info=True)
+
+async def reads_pinned_to_primary(user_id: int) -> bool:
+    if not replicas.engines:
+        return False
+    try:
+        return bool(await redis_breaker.call(async_redis_client.exists, sticky_key(user_id)))
+    except CircuitOpenError:
+        # Pins cannot be read (or set) during the outage, and sending every
+        # read to the primary until it ends would overload it
+        return False
+    except Exception:
+        return True
+
+async def read_session(primary: AsyncSession) -> AsyncIterator[AsyncSession]:
+    engine = replicas.choose()
+    if engine is None:
+        yield primary
+        return
+    async with ReplicaSessionLocal(bind=engine) as db:
+        yield db
+
+# Dependency for read-only handlers that have no read-your-writes concerns
+async def get_replica_db(primary: AsyncSession = Depends(get_async_db)) -> AsyncIterator[AsyncSession]:
+    async for db in read_session(primary):
+        yield db
+
+async def run_with_fallback(db: AsyncSession, query: Callable[[AsyncSession], Awaitable[T]]) -> T:
+    # A replica miss (None) may only be lag behind a fresh insert, and a
+    # failing replica should not fail the request: both run query again on
+    # the primary, so every statement in it reads from the same session
+    if not db.info.get("replica"):
+        return await query(db)
+    try:
+        result = await query(db)
+        if result is not None:
+            return result
+    except (DBAPIError, OSError):
+        logger.warning("Replica read failed, retrying on the primary", exc_info=True)
+    async with AsyncSessionLocal() as primary:
+        return await query(primary)
+
+async def first_with_fallback(db: AsyncSession, statement, scalar: bool = True):
+    # scalar=False returns the whole first row
+    async def first(session: AsyncSession):
+        result = await session.execute(statement)
+        return result.scalars().first() if scalar else result.first()
+
+    return await run_with_fallback(db, first)
@@ -0,0 +1,151 @@
+import asyncio
+import bisect
+import hashlib
+import os
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable, Dict, Iterable, List, TypeVar
+import redis.asyncio as aioredis
+from dotenv import load_dotenv
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from database.circuit_breaker import CircuitBreaker
+from database.pools import (
+    DB_CONNECT_TIMEOUT_SECONDS,
+    REDIS_MAX_CONNECTIONS,
+    REDIS_POOL_TIMEOUT_SECONDS,
+    InstrumentedAsyncQueuePool,
+    InstrumentedRedisPool,
+    engine_options,
+    redis_options,
+)
+
+load_dotenv()
+
+# Extra Postgres hosts (same credentials and database name as DB_HOST) that
+# urls are spread over by short code. DB_HOST is always the "default" shard
+# and the only one holding users
+DB_SHARD_HOSTS = [host.strip() for host in os.getenv("DB_SHARD_HOSTS", "").split(",") if host.strip()]
+# host:port of the Redis caching each shard's codes, in the same order as
+# DB_SHARD_HOSTS; shards without one share the default Redis
+REDIS_SHARD_HOSTS = [host.strip() for host in os.getenv("REDIS_SHARD_HOSTS", "").split(",") if host.strip()]
+SHARD_VIRTUAL_NODES = int(os.getenv("SHARD_VIRTUAL_NODES", "160"))
+
+DEFAULT_SHARD = "default"
+
+T = TypeVar("T")
+
+class HashRing:
+    """Consistent hash ring; adding a shard only moves the codes it takes over."""
+
+    def __init__(self, nodes: Iterable[str], virtual_nodes: int = SHARD_VIRTUAL_NODES):
+        points = sorted((self._hash(f"{node}#{index}"), node) for node in nodes for index in range(virtual_nodes))
+        self._hashes = [point for point, _ in points]
+        self._nodes = [node for _, node in points]
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        return int.from_bytes(hashlib.md5(key.encode("utf-8"), usedforsecurity=False).digest()[:8], "big")
+
+    def node_for(self, key: str) -> str:
+        index = bisect.bisect(self._hashes, self._hash(key)) % len(self._hashes)
+        return self._nodes[index]
+
+class Shard:
+    """One Postgres database holding part of the urls, and the Redis caching them.
+
+    The default shard has no engine or client of its own: callers keep using
+    their usual session and Redis client for it.
+    """
+
+    def __init__(self, name: str, engine=None, redis=None):
+        self.name = name
+        self.engine = engine
+        self.redis = redis
+        self.breaker = CircuitBreaker(f"Redis for shard {name}") if redis is not None else None
+        self.sessions = None
+        if engine is not None:
+            self.sessions = async_sessionmaker(engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
+    @property
+    def is_default(self) -> bool:
+        return self.engine is None
+
+    def session_factory(self, default):
+        return default if self.is_default else self.sessions
+
+    def client(self, default):
+        return default if self.is_default or self.redis is None else self.redis
+
+    def circuit(self, default):
+        return default if self.is_default or self.breaker is None else self.breaker
+
+def shard_url(host: str) -> str:
+    return f"postgresql+asyncpg://{os.getenv('DB_USER')}:{os.getenv('DB_PASSWORD')}@{host}/{os.getenv('DB_NAME')}"
+
+def _redis_client(address: str) -> aioredis.Redis:
+    host, _, port = address.partition(":")
+    pool = InstrumentedRedisPool(
+        host=host,
+        port=int(port or 6379),
+        max_connections=REDIS_MAX_CONNECTIONS,
+        timeout=REDIS_POOL_TIMEOUT_SECONDS,
+        **redis_options()
+    )
+    return aioredis.Redis(connection_pool=pool)
+
+def build_shards(hosts: List[str], redis_hosts: List[str]) -> Dict[str, Shard]:
+    built = {DEFAULT_SHARD: Shard(DEFAULT_SHARD)}
+    for index, host in enumerate(hosts):
+        engine = create_async_engine(
+            shard_url(host),
+            poolclass=InstrumentedAsyncQueuePool,
+            connect_args={"timeout": DB_CONNECT_TIMEOUT_SECONDS},
+            **engine_options()
+        )
+        redis = _redis_client(redis_hosts[index]) if index < len(redis_hosts) else None
+        built[host] = Shard(host, engine, redis)
+    return built
+
+shards = build_shards(DB_SHARD_HOSTS, REDIS_SHARD_HOSTS)
+ring = HashRing(shards)
+
+def shard_for(short_code: str) -> Shard:
+    return shards[ring.node_for(short_code)]
+
+def group_by_shard(items: Iterable[T], key: Callable[[T], str] = lambda short_code: short_code) -> Dict[str, List[T]]:
+    # Keeps the input order within each shard's group
+    groups: Dict[str, List[T]] = {}
+    for item in items:
+        groups.setdefault(ring.node_for(key(item)), []).append(item)
+    return groups
+
+@asynccontextmanager
+async def shard_session(short_code: str, default: AsyncSession) -> AsyncIterator[AsyncSession]:
+    # The session for the shard holding short_code; `default` serves the default shard
+    shard = shard_for(short_code)
+    if shard.is_default:
+        yield default
+        return
+    async with shard.sessions() as db:
+        yield db
+
+async def fan_out(default: AsyncSession, query: Callable[[AsyncSession, Shard], Awaitable[T]]) -> List[T]:
+    # Runs query on every shard concurrently; results come back in shard order
+    async def run(shard: Shard) -> T:
+        if shard.is_default:
+            return await query(default, shard)
+        async with shard.sessions() as db:
+            return await query(db, shard)
+
+    return list(await asyncio.gather(*(run(shard) for shard in shards.values())))
+
+async def merge_streams(streams: List[AsyncIterator[T]], key: Callable[[T], object], reverse: bool = False) -> AsyncIterator[T]:
+    # Merges streams that are each already ordered by key, never reordering
+    # the items of one stream
+    heads = [await anext(stream, None) for stream in streams]
+    while True:
+        live = [index for index, item in enumerate(heads) if item is not None]
+        if not live:
+            return
+        index = (max if reverse else min)(live, key=lambda index: key(heads[index]))
+        yield heads[index]
+        heads[index] = await anext(streams[index], None)
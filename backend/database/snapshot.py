@@ -0,0 +1,384 @@
+"""Export short code -> URL mappings into a memory-mapped snapshot file.
+
+Workers search the snapshot before Redis and Postgres, so redirects for the
+codes in it keep working without either, and every worker shares the same
+page-cache pages. Rebuilds are incremental unless --full is given::
+
+    cd backend
+    python -m database.snapshot                      # add rows created since the last build
+    python -m database.snapshot --every 300          # keep doing so
+    python -m database.snapshot --nginx-map /var/lib/url-shortener/redirects.map
+
+Incremental builds only add rows, so links swept as expired stay in the
+snapshot (and still get their 410), and a row whose transaction committed
+after the next build had moved its high-water mark SNAPSHOT_ID_OVERLAP ids
+past it is missed. Instead of tracking deletions, a build becomes a full one
+once the last full build is REDIRECT_SNAPSHOT_FULL_EVERY_SECONDS old; full
+builds stream every shard in code order straight into the file.
+
+The nginx map holds links older than --nginx-min-age-days, most clicked
+first; nginx answers them itself (see docker/nginx.conf), so their clicks are
+not counted.
+"""
+import argparse
+import asyncio
+import heapq
+import json
+import logging
+import mmap
+import os
+import re
+import struct
+import sys
+import tempfile
+import time
+from array import array
+from datetime import datetime, timedelta, timezone
+from contextlib import AsyncExitStack
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Tuple
+from dotenv import load_dotenv
+from sqlalchemy import func, select
+from database.async_database import AsyncSessionLocal, async_engine
+from database.shards import shards
+from models.url import URL, cache_value
+
+load_dotenv()
+
+# Empty disables the snapshot
+REDIRECT_SNAPSHOT_PATH = os.getenv("REDIRECT_SNAPSHOT_PATH", "")
+# How often workers look for a newer snapshot file
+REDIRECT_SNAPSHOT_CHECK_SECONDS = float(os.getenv("REDIRECT_SNAPSHOT_CHECK_SECONDS", "5"))
+# Incremental builds become full ones, which drop removed rows, once the last
+# full build is this old
+REDIRECT_SNAPSHOT_FULL_EVERY_SECONDS = float(os.getenv("REDIRECT_SNAPSHOT_FULL_EVERY_SECONDS", "3600"))
+SNAPSHOT_FETCH_BATCH_SIZE = 10000
+# Ids are handed out before the inserting transaction commits, so incremental
+# builds re-read this many ids below the last high-water mark
+SNAPSHOT_ID_OVERLAP = 1000
+
+# Records ("code\tvalue", sorted by code, with the value from
+# models.url.cache_value) start at offset 0 and are followed by
+# count + 1 little-endian u64 record offsets, a JSON header and this trailer
+MAGIC = b"URLSNAP1"
+TRAILER = struct.Struct("<QQI8s")
+OFFSET = struct.Struct("<Q")
+
+# Anything else could break out of the quoted nginx string or expand a variable
+NGINX_SAFE_URL = re.compile(r"^[A-Za-z0-9._~:/?#\[\]@!&'()*+,;=%-]+$")
+
+logger = logging.getLogger(__name__)
+
+class RedirectSnapshot:
+    """Binary-searches a snapshot file through a read-only memory map.
+
+    A rebuilt snapshot replaces the file atomically; the map follows it on the
+    next lookup after REDIRECT_SNAPSHOT_CHECK_SECONDS.
+    """
+
+    def __init__(self, path: str, check_interval: float = REDIRECT_SNAPSHOT_CHECK_SECONDS):
+        self.path = path
+        self.check_interval = check_interval
+        self._map: Optional[mmap.mmap] = None
+        self._identity = None
+        self._next_check = 0.0
+        self.count = 0
+        self.header: dict = {}
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    def refresh(self) -> None:
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            self.close()
+            return
+        identity = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if identity == self._identity:
+            return
+        try:
+            with open(self.path, "rb") as file:
+                mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            offsets_start, count, header_length, magic = TRAILER.unpack_from(mapped, len(mapped) - TRAILER.size)
+            if magic != MAGIC:
+                raise ValueError("not a redirect snapshot")
+            header_start = len(mapped) - TRAILER.size - header_length
+            header = json.loads(mapped[header_start:header_start + header_length])
+        except (OSError, ValueError, struct.error):
+            logger.warning("Ignoring unreadable redirect snapshot %s", self.path, exc_info=True)
+            return
+        self.close()
+        self._map, self._identity = mapped, identity
+        self._offsets_start, self.count, self.header = offsets_start, count, header
+
+    def close(self) -> None:
+        if self._map is not None:
+            self._map.close()
+        self._map, self._identity, self.count, self.header = None, None, 0, {}
+
+    def _offset(self, index: int) -> int:
+        return OFFSET.unpack_from(self._map, self._offsets_start + OFFSET.size * index)[0]
+
+    def _record(self, index: int) -> Tuple[bytes, bytes]:
+        start, end = self._offset(index), self._offset(index + 1)
+        separator = self._map.find(b"\t", start, end)
+        return self._map[start:separator], self._map[separator + 1:end]
+
+    def get(self, short_code: str) -> Optional[str]:
+        if not self.enabled:
+            return None
+        now = time.monotonic()
+        if now >= self._next_check:
+            self._next_check = now + self.check_interval
+            self.refresh()
+        if self._map is None:
+            return None
+
+        key = short_code.encode("utf-8")
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            start = self._offset(middle)
+            separator = self._map.find(b"\t", start)
+            code = self._map[start:separator]
+            if code < key:
+                low = middle + 1
+            elif code > key:
+                high = middle
+            else:
+                return self._map[separator + 1:self._offset(middle + 1)].decode("utf-8")
+        return None
+
+    def __iter__(self) -> Iterator[Tuple[bytes, bytes]]:
+        for index in range(self.count):
+            yield self._record(index)
+
+redirect_snapshot = RedirectSnapshot(REDIRECT_SNAPSHOT_PATH)
+
+class SnapshotWriter:
+    """Writes sorted entries into a temporary file next to ``path``; ``commit`` renames it into place."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._offsets = array("Q")
+        self._position = 0
+        descriptor, self._temporary = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix=".snapshot-")
+        self._file = os.fdopen(descriptor, "wb")
+
+    def add(self, code: bytes, value: bytes) -> None:
+        self._offsets.append(self._position)
+        self._position += self._file.write(code + b"\t" + value)
+
+    def commit(self, header: dict) -> int:
+        # Readers only ever see a complete snapshot
+        count = len(self._offsets)
+        offsets = self._offsets
+        offsets.append(self._position)
+        if sys.byteorder != "little":
+            offsets.byteswap()
+        offsets.tofile(self._file)
+        encoded_header = json.dumps({**header, "count": count}).encode("utf-8")
+        self._file.write(encoded_header)
+        self._file.write(TRAILER.pack(self._position, count, len(encoded_header), MAGIC))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        os.chmod(self._temporary, 0o644)
+        os.replace(self._temporary, self.path)
+        return count
+
+    def __enter__(self) -> "SnapshotWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, traceback) -> None:
+        # Left behind only when the snapshot was not committed
+        self._file.close()
+        if os.path.exists(self._temporary):
+            os.unlink(self._temporary)
+
+def write_snapshot(path: str, entries: Iterator[Tuple[bytes, bytes]], header: dict) -> int:
+    with SnapshotWriter(path) as writer:
+        for code, value in entries:
+            writer.add(code, value)
+        return writer.commit(header)
+
+def merge_entries(previous: Iterator[Tuple[bytes, bytes]], added: List[Tuple[bytes, bytes]]) -> Iterator[Tuple[bytes, bytes]]:
+    # Both inputs are sorted by code; a code in both keeps the newer value
+    last = None
+    for code, value in heapq.merge(added, previous, key=lambda entry: entry[0]):
+        if code != last:
+            yield code, value
+            last = code
+
+async def new_rows(since: Dict[str, int], session_factory=AsyncSessionLocal) -> Tuple[List[Tuple[bytes, bytes]], Dict[str, int]]:
+    # Rows with an id above the last snapshot's high-water mark, per shard
+    rows = []
+    max_ids = dict(since)
+    for shard in shards.values():
+        last_id = max(since.get(shard.name, 0) - SNAPSHOT_ID_OVERLAP, 0)
+        async with shard.session_factory(session_factory)() as db:
+            while True:
+                batch = (await db.execute(
+                    select(URL.id, URL.short_code, URL.original_url, URL.expires_at, URL.permanent)
+                    .where(URL.id > last_id)
+                    .order_by(URL.id)
+                    .limit(SNAPSHOT_FETCH_BATCH_SIZE)
+                )).all()
+                if not batch:
+                    break
+                last_id = batch[-1].id
+                rows.extend(snapshot_entry(row) for row in batch)
+        max_ids[shard.name] = max(last_id, since.get(shard.name, 0))
+    rows.sort(key=lambda entry: entry[0])
+    return rows, max_ids
+
+def snapshot_entry(row) -> Tuple[bytes, bytes]:
+    return row.short_code.encode("utf-8"), cache_value(row.original_url, row.expires_at, row.permanent).encode("utf-8")
+
+async def shard_entries(db) -> AsyncIterator[Tuple[bytes, bytes]]:
+    # Every row of one shard in byte order of the code (the order the readers
+    # binary-search), sorted by the database and fetched in batches
+    code = URL.short_code.collate("C") if db.get_bind().dialect.name == "postgresql" else URL.short_code
+    result = await db.stream(
+        select(URL.short_code, URL.original_url, URL.expires_at, URL.permanent)
+        .order_by(code)
+        .execution_options(yield_per=SNAPSHOT_FETCH_BATCH_SIZE)
+    )
+    async for row in result:
+        yield snapshot_entry(row)
+
+async def merge_streams(streams: List[AsyncIterator[Tuple[bytes, bytes]]]) -> AsyncIterator[Tuple[bytes, bytes]]:
+    # heapq.merge for async iterators; a code on two shards (mid-rebalance) is written once
+    heap = []
+    for index, stream in enumerate(streams):
+        entry = await anext(stream, None)
+        if entry is not None:
+            heap.append((entry, index))
+    heapq.heapify(heap)
+    last = None
+    while heap:
+        entry, index = heap[0]
+        if entry[0] != last:
+            yield entry
+            last = entry[0]
+        following = await anext(streams[index], None)
+        if following is None:
+            heapq.heappop(heap)
+        else:
+            heapq.heapreplace(heap, (following, index))
+
+async def build_full_snapshot(path: str, session_factory=AsyncSessionLocal) -> int:
+    # Rows inserted while this runs are above the high-water marks taken
+    # first, so the next incremental build adds them
+    async with AsyncExitStack() as stack:
+        max_ids, streams = {}, []
+        for shard in shards.values():
+            db = await stack.enter_async_context(shard.session_factory(session_factory)())
+            max_ids[shard.name] = (await db.execute(select(func.max(URL.id)))).scalar() or 0
+            streams.append(shard_entries(db))
+        now = datetime.now(timezone.utc).isoformat()
+        with SnapshotWriter(path) as writer:
+            async for code, value in merge_streams(streams):
+                writer.add(code, value)
+            return writer.commit({"max_ids": max_ids, "built_at": now, "full_built_at": now})
+
+def full_build_due(header: dict, full_every: float) -> bool:
+    full_built_at = header.get("full_built_at")
+    if full_built_at is None:
+        return True
+    age = datetime.now(timezone.utc) - datetime.fromisoformat(full_built_at)
+    return age.total_seconds() >= full_every
+
+async def build_snapshot(path: str, full: bool = False, session_factory=AsyncSessionLocal, full_every: float = REDIRECT_SNAPSHOT_FULL_EVERY_SECONDS) -> int:
+    # The number of codes written: all of them for a full build, the new or
+    # changed ones for an incremental one
+    previous = RedirectSnapshot(path, check_interval=float("inf"))
+    previous.refresh()
+    try:
+        if full or full_build_due(previous.header, full_every):
+            previous.close()
+            return await build_full_snapshot(path, session_factory)
+        rows, max_ids = await new_rows(previous.header.get("max_ids", {}), session_factory)
+        rows = [(code, value) for code, value in rows if previous.get(code.decode("utf-8")) != value.decode("utf-8")]
+        if not rows:
+            return 0
+        header = {**previous.header, "max_ids": max_ids, "built_at": datetime.now(timezone.utc).isoformat()}
+        write_snapshot(path, merge_entries(iter(previous), rows), header)
+        return len(rows)
+    finally:
+        previous.close()
+
+async def stable_links(min_age_days: int, limit: int, session_factory=AsyncSessionLocal) -> List[Tuple[str, str]]:
+    # The most clicked permanent links older than min_age_days that never
+    # expire, across every shard; nginx answers them without counting clicks,
+    # which only permanent links allow
+    before = datetime.now(timezone.utc) - timedelta(days=min_age_days)
+    links = []
+    for shard in shards.values():
+        async with shard.session_factory(session_factory)() as db:
+            result = await db.execute(
+                select(URL.clicks, URL.short_code, URL.original_url)
+                .where(URL.created_at < before, URL.expires_at.is_(None), URL.permanent.is_(True))
+                .order_by(URL.clicks.desc().nulls_last())
+                .limit(limit)
+            )
+            links.extend((clicks or 0, short_code, original_url) for clicks, short_code, original_url in result)
+    links.sort(key=lambda link: link[0], reverse=True)
+    return sorted((short_code, original_url) for _, short_code, original_url in links[:limit])
+
+def write_nginx_map(path: str, links: List[Tuple[str, str]]) -> int:
+    # Entries for a `map $uri ...` block; URLs get the scheme the redirect
+    # endpoint would add
+    lines = []
+    for short_code, original_url in links:
+        if not original_url.startswith(("http://", "https://")):
+            original_url = "http://" + original_url
+        if NGINX_SAFE_URL.match(original_url) and NGINX_SAFE_URL.match(short_code):
+            lines.append(f'"/{short_code}" "{original_url}";\n')
+    directory = os.path.dirname(os.path.abspath(path))
+    descriptor, temporary = tempfile.mkstemp(dir=directory, prefix=".redirects-")
+    with os.fdopen(descriptor, "w") as file:
+        file.writelines(lines)
+    os.chmod(temporary, 0o644)
+    os.replace(temporary, path)
+    return len(lines)
+
+async def run(args) -> None:
+    try:
+        while True:
+            if args.path:
+                added = await build_snapshot(args.path, full=args.full)
+                logger.warning("Snapshot %s: %d codes written", args.path, added)
+            if args.nginx_map:
+                exported = write_nginx_map(args.nginx_map, await stable_links(args.nginx_min_age_days, args.nginx_limit))
+                logger.warning("nginx map %s: %d links (reload nginx to apply)", args.nginx_map, exported)
+            if not args.every:
+                return
+            args.full = False
+            await asyncio.sleep(args.every)
+    finally:
+        for shard in shards.values():
+            if not shard.is_default:
+                await shard.engine.dispose()
+        await async_engine.dispose()
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--path", default=REDIRECT_SNAPSHOT_PATH, help="snapshot file (default REDIRECT_SNAPSHOT_PATH)")
+    parser.add_argument("--full", action="store_true", help="rebuild from scratch now instead of adding new rows")
+    parser.add_argument("--every", type=float, default=0, help="rebuild every this many seconds instead of once")
+    parser.add_argument("--nginx-map", default=None, help="also write an nginx map include with the stable links")
+    parser.add_argument("--nginx-min-age-days", type=int, default=30, help="only export links at least this old")
+    parser.add_argument("--nginx-limit", type=int, default=100000, help="export at most this many links")
+    args = parser.parse_args(argv)
+    if not args.path and not args.nginx_map:
+        parser.error("set REDIRECT_SNAPSHOT_PATH, --path or --nginx-map")
+    return args
+
+def main(argv=None) -> None:
+    logging.basicConfig(level=logging.WARNING, format="%(message)s")
+    asyncio.run(run(parse_args(argv)))
+
+if __name__ == "__main__":
+    sys.exit(main())
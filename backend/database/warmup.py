@@ -0,0 +1,38 @@
+import asyncio
+import logging
+import os
+from dotenv import load_dotenv
+from sqlalchemy import text
+from database.async_database import async_engine
+from database.async_redis import async_redis_client
+from database.pools import DB_POOL_SIZE
+
+load_dotenv()
+
+# Connections opened per worker at startup; 0 leaves the pools cold
+STARTUP_WARM_CONNECTIONS = int(os.getenv("STARTUP_WARM_CONNECTIONS", str(min(DB_POOL_SIZE, 2))))
+STARTUP_WARMUP_TIMEOUT_SECONDS = float(os.getenv("STARTUP_WARMUP_TIMEOUT_SECONDS", "5"))
+
+logger = logging.getLogger(__name__)
+
+async def _warm_database(connections: int) -> None:
+    async def check_out():
+        async with async_engine.connect() as connection:
+            await connection.execute(text("SELECT 1"))
+
+    # Held concurrently, so each one is a separate pooled connection
+    await asyncio.gather(*(check_out() for _ in range(connections)))
+
+async def _warm_redis(connections: int) -> None:
+    await asyncio.gather(*(async_redis_client.ping() for _ in range(connections)))
+
+async def warm_up() -> None:
+    # No DDL here: the schema is managed by `alembic upgrade head`. A slow or
+    # unreachable backend only delays the first requests, never the startup
+    if STARTUP_WARM_CONNECTIONS <= 0:
+        return
+    for name, warm in (("Postgres", _warm_database), ("Redis", _warm_redis)):
+        try:
+            await asyncio.wait_for(warm(STARTUP_WARM_CONNECTIONS), STARTUP_WARMUP_TIMEOUT_SECONDS)
+        except Exception:
+            logger.warning("Could not warm the %s pool at startup", name, exc_info=True)
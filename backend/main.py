@@ -1,20 +1,55 @@
-from fastapi import FastAPI, Depends, HTTPException
+from fastapi import FastAPI, Depends, Header, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import RedirectResponse
+from fastapi.responses import RedirectResponse, Response
 import uvicorn
 from api.urls import router as urls_router
 from api.users import router as users_router
-from database.database import engine, get_db
-from models.url import Base as URLBase, URL
-from models.user import Base as UserBase
-from database.redis import redis_client
-from sqlalchemy.orm import Session
+from api.internal import router as internal_router, check_internal_token
+from database.database import engine
+from database.async_database import async_engine
+from database.replicas import first_with_fallback, get_replica_db, replicas
+from database.shards import shard_session, shards
+from models.url import URL, cache_value, has_expired, split_cache_value
+from database.local_cache import url_cache, MISSING
+from database.redis_cache import NEGATIVE_CACHE_TTL_SECONDS, cache_url, lookup_url, mark_missing
+from database.code_filter import code_filter
+from database.snapshot import redirect_snapshot
+from database.invalidation import filter_misses_are_final, start_invalidation_listener, stop_invalidation_listener
+from database.warmup import warm_up
+from database.cache_warmup import start_cache_warmup, stop_cache_warmup
+from database.click_buffer import click_buffer, start_click_flusher, stop_click_flusher
+from database.expiry import start_expiry_sweeper, stop_expiry_sweeper
+from services.analytics import click_events, visitor_id, start_analytics, stop_analytics
+from services.passwords import shutdown_executor
+from services.http_cache import is_purge_request, redirect_policy
+from services.proxies import client_ip
+from services.rate_limit import limit_redirects
+from services.metrics import MetricsMiddleware, instrument_engine, mark_worker_dead, record_cache, render_metrics
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Optional
+from contextlib import asynccontextmanager
 
-# Create database tables
-URLBase.metadata.create_all(bind=engine)
-UserBase.metadata.create_all(bind=engine)
+# The schema is managed by Alembic (`alembic upgrade head`), never created here
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await warm_up()
+    start_invalidation_listener()
+    start_click_flusher()
+    start_analytics()
+    start_cache_warmup()
+    start_expiry_sweeper()
+    yield
+    await stop_expiry_sweeper()
+    await stop_cache_warmup()
+    await stop_invalidation_listener()
+    await code_filter.stop()
+    await stop_click_flusher()
+    await stop_analytics()
+    shutdown_executor()
+    mark_worker_dead()
 
-app = FastAPI(title="URL Shortener API")
+app = FastAPI(title="URL Shortener API", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -23,56 +58,101 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(MetricsMiddleware)
+
+instrument_engine(engine)
+instrument_engine(async_engine.sync_engine)
+for replica_engine in replicas.engines:
+    instrument_engine(replica_engine.sync_engine)
+for shard in shards.values():
+    if not shard.is_default:
+        instrument_engine(shard.engine.sync_engine)
 
 # Mount the routers
 app.include_router(urls_router, prefix="/api/urls", tags=["urls"])
 app.include_router(users_router, prefix="/api/auth", tags=["auth"])
+app.include_router(internal_router, prefix="/internal", tags=["internal"])
 
 @app.get("/")
 async def root():
     return {"message": "URL Shortener API"}
 
-@app.get("/{short_code}")
-def redirect_to_url(short_code: str, db: Session = Depends(get_db)):
-    # Try to get URL from Redis cache first
-    cached_url = redis_client.get(f"url:{short_code}")
-
-    original_url = None
-
-    if cached_url:
-        # Increment clicks in Redis
-        redis_client.incr(f"clicks:{short_code}")
-        # Update DB clicks periodically (every 10 clicks)
-        cached_clicks = int(redis_client.get(f"clicks:{short_code}") or 0)
-        if cached_clicks % 10 == 0:
-            db_url = db.query(URL).filter(URL.short_code == short_code).first()
-            if db_url:
-                db_url.clicks = cached_clicks
-                db.commit()
-        original_url = cached_url.decode('utf-8')
-    else:
-        # If not in cache, get from DB
-        db_url = db.query(URL).filter(URL.short_code == short_code).first()
+# Declared before /{short_code} so it is not taken for a short code. Like
+# /internal/*, it answers 404 until INTERNAL_API_TOKEN is set
+@app.get("/metrics", include_in_schema=False)
+async def metrics(x_internal_token: Optional[str] = Header(None)):
+    check_internal_token(x_internal_token)
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
+@app.get("/{short_code}", dependencies=[Depends(limit_redirects)])
+async def redirect_to_url(short_code: str, request: Request, db: AsyncSession = Depends(get_replica_db)):
+    # Try the in-process cache first, then the snapshot file, then Redis.
+    # Each holds the value from models.url.cache_value
+    value = url_cache.get(short_code)
+    request.state.cache = "hit"
+    if value is MISSING:
+        record_cache("local", "negative")
+        request.state.cache = "negative"
+        raise HTTPException(status_code=404, detail="URL not found")
+    record_cache("local", "hit" if value is not None else "miss")
+
+    if value is None and redirect_snapshot.enabled:
+        # Shared by every worker through the page cache, and needs neither
+        # Redis nor Postgres
+        value = redirect_snapshot.get(short_code)
+        record_cache("snapshot", "hit" if value is not None else "miss")
+        if value is not None:
+            url_cache.set(short_code, value)
+
+    if value is None:
+        value, known_missing = await lookup_url(short_code)
+        # Codes the filter has never seen and codes that recently missed the
+        # database are answered without querying it, as long as this worker
+        # is hearing about codes created by the others
+        if known_missing or (value is None and filter_misses_are_final() and not code_filter.might_exist(short_code)):
+            request.state.cache = "negative"
+            url_cache.set(short_code, MISSING, ttl=NEGATIVE_CACHE_TTL_SECONDS)
+            raise HTTPException(status_code=404, detail="URL not found")
+        if value is not None:
+            url_cache.set(short_code, value)
+
+    if value is None:
+        # If not in cache, get from the shard holding the code (a replica, on
+        # the default shard); a replica that has not seen the code yet is
+        # double-checked on the primary before caching a miss
+        request.state.cache = "miss"
+        async with shard_session(short_code, db) as session:
+            db_url = await first_with_fallback(session, select(URL).where(URL.short_code == short_code))
 
         if db_url is None:
+            await mark_missing(short_code)
+            url_cache.set(short_code, MISSING, ttl=NEGATIVE_CACHE_TTL_SECONDS)
             raise HTTPException(status_code=404, detail="URL not found")
 
-        # Cache the URL and initialize click counter
-        redis_client.set(f"url:{short_code}", db_url.original_url)
-        redis_client.set(f"clicks:{short_code}", db_url.clicks)
+        value = cache_value(db_url.original_url, db_url.expires_at, db_url.permanent)
+        await cache_url(short_code, value)
+        url_cache.set(short_code, value)
 
-        # Increment clicks
-        db_url.clicks += 1
-        db.commit()
+    cached = split_cache_value(value)
+    if has_expired(cached.expires):
+        raise HTTPException(status_code=410, detail="URL has expired")
 
-        original_url = db_url.original_url
+    # Clicks are buffered in-process and written to Postgres in batches;
+    # time-bucketed analytics are aggregated here and pipelined to Redis.
+    # nginx refreshing its cached copy is not a click
+    if not is_purge_request(request):
+        click_buffer.record(short_code)
+        click_events.record(short_code, visitor_id(client_ip(request), request.headers.get("user-agent")))
 
     # Make sure the URL has http:// or https:// prefix
+    original_url = cached.original_url
     if not original_url.startswith(('http://', 'https://')):
         original_url = 'http://' + original_url
 
-    # Return a redirect response
-    return RedirectResponse(url=original_url, status_code=307)
+    # Permanent links may be cached by browsers and nginx, temporary ones never
+    status_code, cache_control = redirect_policy(cached)
+    return RedirectResponse(url=original_url, status_code=status_code, headers={"Cache-Control": cache_control})
 
 if __name__ == "__main__":
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
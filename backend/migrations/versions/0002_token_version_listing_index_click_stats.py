@@ -0,0 +1,41 @@
+"""token version, listing index and click stats
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18 05:52:41.118204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0002'
+down_revision: Union[str, None] = '0001'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('users', sa.Column('token_version', sa.Integer(), server_default='0', nullable=False))
+    op.create_index('ix_urls_user_id_id', 'urls', ['user_id', 'id'], unique=False)
+    op.create_table('click_stats',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('short_code', sa.String(), nullable=False),
+    sa.Column('granularity', sa.String(length=1), nullable=False),
+    sa.Column('bucket_start', sa.DateTime(timezone=True), nullable=False),
+    sa.Column('clicks', sa.Integer(), nullable=False),
+    sa.Column('uniques', sa.Integer(), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('short_code', 'granularity', 'bucket_start', name='uq_click_stats_bucket')
+    )
+    op.create_index(op.f('ix_click_stats_id'), 'click_stats', ['id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_click_stats_id'), table_name='click_stats')
+    op.drop_table('click_stats')
+    op.drop_index('ix_urls_user_id_id', table_name='urls')
+    op.drop_column('users', 'token_version')
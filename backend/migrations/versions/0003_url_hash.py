@@ -0,0 +1,32 @@
+"""url hash for deduplicating original urls
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18 06:14:09.530127
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0003'
+down_revision: Union[str, None] = '0002'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('urls', sa.Column('url_hash', sa.BigInteger(), nullable=True))
+    # Same value as models.url.hash_url; other databases keep NULL for
+    # existing rows, which only means those rows are never deduplicated
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute("UPDATE urls SET url_hash = ('x' || substr(md5(original_url), 1, 16))::bit(64)::bigint")
+    op.create_index('ix_urls_url_hash_user_id', 'urls', ['url_hash', 'user_id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_urls_url_hash_user_id', table_name='urls')
+    op.drop_column('urls', 'url_hash')
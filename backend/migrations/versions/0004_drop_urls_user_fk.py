@@ -0,0 +1,40 @@
+"""drop the urls.user_id foreign key for sharding
+
+urls can live on shard databases whose users table is empty, so the owner is
+no longer enforced by a foreign key. Run the migrations against every shard.
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18 07:02:37.204518
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0004'
+down_revision: Union[str, None] = '0003'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# 0001 left the constraint unnamed; SQLite needs a name to find it again
+NAMING_CONVENTION = {"fk": "fk_%(table_name)s_%(column_0_name)s_%(referred_table_name)s"}
+
+
+def upgrade() -> None:
+    if op.get_bind().dialect.name == 'postgresql':
+        op.drop_constraint('urls_user_id_fkey', 'urls', type_='foreignkey')
+    else:
+        with op.batch_alter_table('urls', naming_convention=NAMING_CONVENTION) as batch_op:
+            batch_op.drop_constraint('fk_urls_user_id_users', type_='foreignkey')
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name == 'postgresql':
+        op.create_foreign_key('urls_user_id_fkey', 'urls', 'users', ['user_id'], ['id'])
+    else:
+        with op.batch_alter_table('urls') as batch_op:
+            batch_op.create_foreign_key('fk_urls_user_id_users', 'users', ['user_id'], ['id'])
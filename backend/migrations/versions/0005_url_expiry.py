@@ -0,0 +1,33 @@
+"""optional expiry for urls
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18 08:12:44.907311
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0005'
+down_revision: Union[str, None] = '0004'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('urls', sa.Column('expires_at', sa.DateTime(timezone=True), nullable=True))
+    # Partial, so the index only grows with the links that can expire
+    op.create_index(
+        'ix_urls_expires_at', 'urls', ['expires_at'], unique=False,
+        postgresql_where=sa.text('expires_at IS NOT NULL'),
+        sqlite_where=sa.text('expires_at IS NOT NULL'),
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_urls_expires_at', table_name='urls')
+    op.drop_column('urls', 'expires_at')
@@ -0,0 +1,36 @@
+"""sequence for the sequence short code allocator
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-18 14:21:05.318224
+
+"""
+import os
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0007'
+down_revision: Union[str, None] = '0006'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Every nextval() leases a whole block, so the sequence steps by the block
+# size in use when it is created; the allocator reads the step back from
+# pg_sequences. SQLite (the tests) has no sequences
+short_code_id_seq = sa.Sequence(
+    'short_code_id_seq', start=0, minvalue=0, increment=int(os.getenv('SHORT_CODE_BLOCK_SIZE', '1000')),
+)
+
+
+def upgrade() -> None:
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute(sa.schema.CreateSequence(short_code_id_seq, if_not_exists=True))
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute(sa.schema.DropSequence(short_code_id_seq, if_exists=True))
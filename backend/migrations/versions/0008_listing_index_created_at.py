@@ -0,0 +1,28 @@
+"""listing index on (user_id, created_at, id)
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-18 16:41:07.384215
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0008'
+down_revision: Union[str, None] = '0007'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_urls_user_id_created_at_id', 'urls', ['user_id', 'created_at', 'id'], unique=False)
+    op.drop_index('ix_urls_user_id_id', table_name='urls')
+
+
+def downgrade() -> None:
+    op.create_index('ix_urls_user_id_id', 'urls', ['user_id', 'id'], unique=False)
+    op.drop_index('ix_urls_user_id_created_at_id', table_name='urls')
@@ -0,0 +1,19 @@
+from sqlalchemy import Column, Integer, String, DateTime, UniqueConstraint
+from database.database import Base
+
+class ClickStat(Base):
+    __tablename__ = "click_stats"
+
+    id = Column(Integer, primary_key=True, index=True)
+    short_code = Column(String, nullable=False)
+    # "m" (minute), "h" (hour) or "d" (day)
+    granularity = Column(String(1), nullable=False)
+    bucket_start = Column(DateTime(timezone=True), nullable=False)
+    clicks = Column(Integer, nullable=False, default=0)
+    # Approximate unique visitors (HyperLogLog), not tracked per minute
+    uniques = Column(Integer, nullable=True)
+
+    __table_args__ = (
+        # Also serves range scans for one code and granularity
+        UniqueConstraint("short_code", "granularity", "bucket_start", name="uq_click_stats_bucket"),
+    )
@@ -1,9 +1,46 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey
+import hashlib
+import time
+from sqlalchemy import BigInteger, Boolean, Column, Integer, String, DateTime, Index, false
 from sqlalchemy.sql import func
-from sqlalchemy.orm import relationship
-from datetime import datetime
+from sqlalchemy.orm import relationship, validates
+from datetime import datetime, timezone
+from typing import NamedTuple, Optional
 from database.database import Base
 
+# Cached values carry a header ahead of the URL for links that expire or
+# redirect permanently: "p" for permanent, then the expiry in epoch seconds.
+# Every cache layer can then answer without asking Postgres
+HEADER_SEPARATOR = "\x00"
+
+class CachedURL(NamedTuple):
+    original_url: str
+    expires: Optional[int]
+    permanent: bool
+
+def hash_url(original_url: str) -> int:
+    # First 8 bytes of the MD5 as a signed 64-bit int; Postgres computes the
+    # same value with ('x' || substr(md5(original_url), 1, 16))::bit(64)::bigint
+    digest = hashlib.md5(original_url.encode("utf-8"), usedforsecurity=False).digest()
+    return int.from_bytes(digest[:8], "big", signed=True)
+
+def cache_value(original_url: str, expires_at: Optional[datetime], permanent: bool = False) -> str:
+    header = "p" if permanent else ""
+    if expires_at is not None:
+        if expires_at.tzinfo is None:
+            expires_at = expires_at.replace(tzinfo=timezone.utc)
+        header += str(int(expires_at.timestamp()))
+    return f"{header}{HEADER_SEPARATOR}{original_url}" if header else original_url
+
+def split_cache_value(value: str) -> CachedURL:
+    header, separator, original_url = value.partition(HEADER_SEPARATOR)
+    if not separator:
+        return CachedURL(value, None, False)
+    expires = header.lstrip("p")
+    return CachedURL(original_url, int(expires) if expires else None, header.startswith("p"))
+
+def has_expired(expires: Optional[int]) -> bool:
+    return expires is not None and expires <= time.time()
+
 class URL(Base):
     __tablename__ = "urls"
 
@@ -12,5 +49,33 @@ class URL(Base):
     short_code = Column(String, unique=True, index=True, nullable=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     clicks = Column(Integer, default=0)
-    user_id = Column(Integer, ForeignKey("users.id"), nullable=True)
-    user = relationship("User", back_populates="urls")
+    # No foreign key: urls on other shards reference users kept on the default one
+    user_id = Column(Integer, nullable=True)
+    # Fixed-size lookup key for deduplicating original_url
+    url_hash = Column(BigInteger, nullable=True)
+    # NULL for links that never expire
+    expires_at = Column(DateTime(timezone=True), nullable=True)
+    # Permanent redirects may be cached by browsers and proxies, so their
+    # clicks are undercounted; temporary ones reach the backend every time
+    permanent = Column(Boolean, nullable=False, default=False, server_default=false())
+    user = relationship("User", primaryjoin="foreign(URL.user_id) == User.id", back_populates="urls")
+
+    # Fetch id and created_at with INSERT ... RETURNING instead of a refresh
+    __mapper_args__ = {"eager_defaults": True}
+
+    __table_args__ = (
+        # Keyset pagination of a user's (or the unclaimed) URLs, newest first
+        # Listings, newest first per owner
+        Index("ix_urls_user_id_created_at_id", "user_id", "created_at", "id"),
+        Index("ix_urls_url_hash_user_id", "url_hash", "user_id"),
+        # Expiry sweeps; only expiring links are indexed
+        Index(
+            "ix_urls_expires_at", "expires_at",
+            postgresql_where=expires_at.isnot(None), sqlite_where=expires_at.isnot(None),
+        ),
+    )
+
+    @validates("original_url")
+    def _set_url_hash(self, key, original_url):
+        self.url_hash = hash_url(original_url)
+        return original_url
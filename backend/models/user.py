@@ -11,4 +11,6 @@ class User(Base):
     username = Column(String, unique=True, index=True)
     hashed_password = Column(String)
     created_at = Column(DateTime, default=datetime.utcnow)
-    urls = relationship("URL", back_populates="user")
+    # Bumped whenever the user changes; tokens carrying an older version are rejected
+    token_version = Column(Integer, nullable=False, default=0, server_default="0")
+    urls = relationship("URL", primaryjoin="User.id == foreign(URL.user_id)", back_populates="user")
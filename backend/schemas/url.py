@@ -1,18 +1,57 @@
-from pydantic import BaseModel, HttpUrl, Field
-from datetime import datetime
-from typing import Optional
+from pydantic import BaseModel, ConfigDict, HttpUrl, Field, field_validator
+from datetime import datetime, timezone
+from typing import List, Optional
+
+# Paths served at the root before /{short_code} (main.py and FastAPI's docs),
+# so a custom code equal to one of them could never redirect
+RESERVED_SHORT_CODES = {"api", "docs", "internal", "metrics", "redoc"}
 
 class URLBase(BaseModel):
     original_url: HttpUrl
 
 class URLCreate(URLBase):
     custom_short_code: Optional[str] = Field(None, min_length=3, max_length=20, pattern=r'^[a-zA-Z0-9_-]+$')
+    # Redirects answer 410 from then on; times without a zone are UTC
+    expires_at: Optional[datetime] = None
+    # 301 that browsers and proxies may cache, instead of a 307 that counts every click
+    permanent: bool = False
+
+    @field_validator("custom_short_code")
+    @classmethod
+    def _not_reserved(cls, custom_short_code: Optional[str]) -> Optional[str]:
+        if custom_short_code in RESERVED_SHORT_CODES:
+            raise ValueError(f"'{custom_short_code}' is reserved")
+        return custom_short_code
+
+    @field_validator("expires_at")
+    @classmethod
+    def _in_the_future(cls, expires_at: Optional[datetime]) -> Optional[datetime]:
+        if expires_at is None:
+            return None
+        if expires_at.tzinfo is None:
+            expires_at = expires_at.replace(tzinfo=timezone.utc)
+        if expires_at <= datetime.now(timezone.utc):
+            raise ValueError("expires_at must be in the future")
+        return expires_at
 
 class URL(URLBase):
+    model_config = ConfigDict(from_attributes=True)
+
     id: int
     short_code: str
     created_at: datetime
     clicks: int
+    expires_at: Optional[datetime] = None
+    permanent: bool = False
 
-    class Config:
-        orm_mode = True
+class ClickStatPoint(BaseModel):
+    bucket: datetime
+    clicks: int
+    uniques: Optional[int] = None
+
+class ClickTimeSeries(BaseModel):
+    short_code: str
+    granularity: str
+    start: datetime
+    end: datetime
+    points: List[ClickStatPoint]
@@ -1,4 +1,4 @@
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, ConfigDict, EmailStr
 from datetime import datetime
 from typing import Optional, List
 from .url import URL
@@ -22,9 +22,8 @@ class TokenData(BaseModel):
     email: Optional[str] = None
 
 class User(UserBase):
+    model_config = ConfigDict(from_attributes=True)
+
     id: int
     created_at: datetime
     urls: List[URL] = []
-
-    class Config:
-        from_attributes = True
@@ -0,0 +1,320 @@
+import asyncio
+import hashlib
+import logging
+import os
+import threading
+import uuid
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Set, Tuple
+from dotenv import load_dotenv
+from sqlalchemy import case, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from redis.exceptions import RedisError
+from sqlalchemy.ext.asyncio import AsyncSession
+from database.async_database import AsyncSessionLocal
+from database.async_redis import async_redis_client
+from database.circuit_breaker import CircuitOpenError, redis_breaker
+from database.shards import group_by_shard, shards
+from models.click_stat import ClickStat
+
+load_dotenv()
+
+ANALYTICS_FLUSH_INTERVAL_SECONDS = float(os.getenv("ANALYTICS_FLUSH_INTERVAL_SECONDS", "2"))
+ANALYTICS_ROLLUP_INTERVAL_SECONDS = float(os.getenv("ANALYTICS_ROLLUP_INTERVAL_SECONDS", "60"))
+ANALYTICS_ROLLUP_BATCH_SIZE = int(os.getenv("ANALYTICS_ROLLUP_BATCH_SIZE", "500"))
+ANALYTICS_MAX_POINTS = int(os.getenv("ANALYTICS_MAX_POINTS", "5000"))
+UNIQUE_VISITORS_TTL_SECONDS = int(os.getenv("UNIQUE_VISITORS_TTL_SECONDS", str(8 * 24 * 3600)))
+# A flush after an outage replays everything buffered meanwhile, so it gets
+# more time than the breaker's per-request deadline
+ANALYTICS_FLUSH_TIMEOUT_SECONDS = 10
+
+# name -> (key letter, bucket id length, bucket width). Bucket ids are
+# UTC timestamps formatted as %Y%m%d%H%M, truncated: a day id is a prefix of
+# its hour ids, which are prefixes of their minute ids
+GRANULARITIES = {
+    "minute": ("m", 12, timedelta(minutes=1)),
+    "hour": ("h", 10, timedelta(hours=1)),
+    "day": ("d", 8, timedelta(days=1)),
+}
+UNIQUE_GRANULARITIES = ("hour", "day")
+
+DIRTY_KEY = "stats:dirty"
+ROLLUP_LOCK_KEY = "stats:rollup:lock"
+
+logger = logging.getLogger(__name__)
+
+def counter_key(letter: str, short_code: str) -> str:
+    return f"stats:{letter}:{short_code}"
+
+def visitors_key(letter: str, short_code: str, bucket: str) -> str:
+    return f"uv:{letter}:{short_code}:{bucket}"
+
+def minute_bucket(moment: datetime) -> str:
+    return moment.astimezone(timezone.utc).strftime("%Y%m%d%H%M")
+
+def bucket_start(bucket: str) -> datetime:
+    return datetime.strptime(bucket.ljust(12, "0"), "%Y%m%d%H%M").replace(tzinfo=timezone.utc)
+
+def as_utc(moment: datetime) -> datetime:
+    if moment.tzinfo is None:
+        return moment.replace(tzinfo=timezone.utc)
+    return moment.astimezone(timezone.utc)
+
+def visitor_id(ip: Optional[str], user_agent: Optional[str]) -> str:
+    return hashlib.blake2b(f"{ip}|{user_agent}".encode("utf-8"), digest_size=8).hexdigest()
+
+class ClickEvents:
+    """Aggregates clicks per (code, minute) and visitors per (code, hour/day) between flushes."""
+
+    def __init__(self):
+        self._counts: Dict[Tuple[str, str], int] = defaultdict(int)
+        self._visitors: Dict[Tuple[str, str, str], Set[str]] = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def record(self, short_code: str, visitor: str, moment: Optional[datetime] = None) -> None:
+        minute = minute_bucket(moment or datetime.now(timezone.utc))
+        with self._lock:
+            self._counts[(short_code, minute)] += 1
+            for name in UNIQUE_GRANULARITIES:
+                letter, length, _ = GRANULARITIES[name]
+                self._visitors[(short_code, letter, minute[:length])].add(visitor)
+
+    def drain(self):
+        with self._lock:
+            counts, self._counts = self._counts, defaultdict(int)
+            visitors, self._visitors = self._visitors, defaultdict(set)
+        return counts, visitors
+
+    def restore(self, counts, visitors) -> None:
+        with self._lock:
+            for key, count in counts.items():
+                self._counts[key] += count
+            for key, ids in visitors.items():
+                self._visitors[key] |= ids
+
+    def __len__(self) -> int:
+        return len(self._counts)
+
+click_events = ClickEvents()
+
+_tasks: List[asyncio.Task] = []
+
+async def flush_events(events: ClickEvents = click_events) -> None:
+    counts, visitors = events.drain()
+    if not counts and not visitors:
+        return
+
+    # Everything collected since the last flush goes out in one round trip
+    pipe = async_redis_client.pipeline(transaction=False)
+    codes = set()
+    for (short_code, minute), count in counts.items():
+        codes.add(short_code)
+        for letter, length, _ in GRANULARITIES.values():
+            pipe.hincrby(counter_key(letter, short_code), minute[:length], count)
+    for (short_code, letter, bucket), ids in visitors.items():
+        key = visitors_key(letter, short_code, bucket)
+        pipe.pfadd(key, *ids)
+        pipe.expire(key, UNIQUE_VISITORS_TTL_SECONDS)
+    if codes:
+        pipe.sadd(DIRTY_KEY, *codes)
+    # While Redis is unavailable the buckets stay buffered here and are
+    # replayed by the first flush after it recovers
+    try:
+        await redis_breaker.call(pipe.execute, timeout=ANALYTICS_FLUSH_TIMEOUT_SECONDS)
+    except CircuitOpenError:
+        events.restore(counts, visitors)
+    except Exception:
+        events.restore(counts, visitors)
+        raise
+
+def _upsert_statement(dialect_name: str, rows: List[dict]):
+    insert = pg_insert if dialect_name == "postgresql" else sqlite_insert
+    stmt = insert(ClickStat).values(rows)
+    excluded = stmt.excluded
+    return stmt.on_conflict_do_update(
+        index_elements=["short_code", "granularity", "bucket_start"],
+        set_={
+            "clicks": ClickStat.clicks + excluded.clicks,
+            # HyperLogLog counts only grow, keep the larger estimate
+            "uniques": case(
+                (excluded.uniques == None, ClickStat.uniques),
+                (ClickStat.uniques == None, excluded.uniques),
+                (excluded.uniques > ClickStat.uniques, excluded.uniques),
+                else_=ClickStat.uniques,
+            ),
+        },
+    )
+
+async def rollup(session_factory=AsyncSessionLocal, now: Optional[datetime] = None) -> int:
+    # Flushes probe Redis while the circuit is open; rollups just wait for it
+    if redis_breaker.is_open:
+        return 0
+
+    # Only one worker rolls up at a time
+    token = uuid.uuid4().hex
+    lock_ttl = max(int(ANALYTICS_ROLLUP_INTERVAL_SECONDS), 30)
+    if not await async_redis_client.set(ROLLUP_LOCK_KEY, token, nx=True, ex=lock_ttl):
+        return 0
+
+    try:
+        codes = [code.decode("utf-8") for code in await async_redis_client.spop(DIRTY_KEY, ANALYTICS_ROLLUP_BATCH_SIZE) or []]
+        if not codes:
+            return 0
+
+        # Buckets that ended before the last flush from every worker are complete
+        cutoff = minute_bucket((now or datetime.now(timezone.utc)) - timedelta(seconds=2 * ANALYTICS_FLUSH_INTERVAL_SECONDS))
+        pipe = async_redis_client.pipeline(transaction=False)
+        for short_code in codes:
+            for letter, _, _ in GRANULARITIES.values():
+                pipe.hkeys(counter_key(letter, short_code))
+        all_fields = iter(await pipe.execute())
+
+        complete = []
+        still_dirty = set()
+        for short_code in codes:
+            for name, (letter, length, _) in GRANULARITIES.items():
+                fields = [field.decode("utf-8") for field in next(all_fields)]
+                done = [field for field in fields if field < cutoff[:length]]
+                if len(done) < len(fields):
+                    still_dirty.add(short_code)
+                if done:
+                    complete.append((name, letter, short_code, done))
+
+        # Read and delete the complete buckets atomically, so increments that
+        # arrive late land in a new field and are rolled up next time
+        pipe = async_redis_client.pipeline(transaction=True)
+        for _, letter, short_code, done in complete:
+            pipe.hmget(counter_key(letter, short_code), done)
+            pipe.hdel(counter_key(letter, short_code), *done)
+        for name, letter, short_code, done in complete:
+            if name in UNIQUE_GRANULARITIES:
+                for bucket in done:
+                    pipe.pfcount(visitors_key(letter, short_code, bucket))
+        replies = await pipe.execute()
+        counters = iter(replies[:2 * len(complete):2])
+        uniques = iter(replies[2 * len(complete):])
+
+        rolled = []
+        rows = []
+        for name, letter, short_code, done in complete:
+            values = next(counters)
+            for bucket, value in zip(done, values):
+                count = next(uniques) if name in UNIQUE_GRANULARITIES else None
+                if value is None:
+                    continue
+                rolled.append((letter, short_code, bucket, int(value)))
+                rows.append({
+                    "short_code": short_code,
+                    "granularity": letter,
+                    "bucket_start": bucket_start(bucket),
+                    "clicks": int(value),
+                    "uniques": count,
+                })
+
+        # click_stats rows live on the shard of their short code
+        stored = set()
+        try:
+            for name, shard_codes in group_by_shard({row["short_code"] for row in rows}).items():
+                shard_codes = set(shard_codes)
+                shard_rows = [row for row in rows if row["short_code"] in shard_codes]
+                async with shards[name].session_factory(session_factory)() as db:
+                    for start in range(0, len(shard_rows), ANALYTICS_ROLLUP_BATCH_SIZE):
+                        await db.execute(_upsert_statement(db.bind.dialect.name, shard_rows[start:start + ANALYTICS_ROLLUP_BATCH_SIZE]))
+                    await db.commit()
+                stored |= shard_codes
+        except Exception:
+            # Put the counts back so the next rollup retries them
+            pipe = async_redis_client.pipeline(transaction=False)
+            for letter, short_code, bucket, clicks in rolled:
+                if short_code not in stored:
+                    pipe.hincrby(counter_key(letter, short_code), bucket, clicks)
+            pipe.sadd(DIRTY_KEY, *codes)
+            await pipe.execute()
+            raise
+
+        if still_dirty:
+            await async_redis_client.sadd(DIRTY_KEY, *still_dirty)
+        return len(rows)
+    finally:
+        if await async_redis_client.get(ROLLUP_LOCK_KEY) == token.encode("utf-8"):
+            await async_redis_client.delete(ROLLUP_LOCK_KEY)
+
+async def get_time_series(db: AsyncSession, short_code: str, granularity: str, start: datetime, end: datetime) -> List[dict]:
+    letter, length, width = GRANULARITIES[granularity]
+    # Widen the range to whole buckets
+    start = bucket_start(minute_bucket(as_utc(start))[:length])
+    end = as_utc(end)
+    if (end - start) / width > ANALYTICS_MAX_POINTS:
+        raise ValueError(f"Range covers more than {ANALYTICS_MAX_POINTS} {granularity} buckets")
+
+    points: Dict[datetime, dict] = {}
+    result = await db.execute(
+        select(ClickStat.bucket_start, ClickStat.clicks, ClickStat.uniques)
+        .where(
+            ClickStat.short_code == short_code,
+            ClickStat.granularity == letter,
+            ClickStat.bucket_start >= start,
+            ClickStat.bucket_start < end,
+        )
+        .order_by(ClickStat.bucket_start)
+    )
+    for moment, clicks, uniques in result:
+        points[as_utc(moment)] = {"bucket": as_utc(moment), "clicks": clicks, "uniques": uniques}
+
+    # Add the buckets that have not been rolled up yet, unless Redis is unavailable
+    try:
+        live = await redis_breaker.call(async_redis_client.hgetall, counter_key(letter, short_code))
+    except RedisError:
+        live = {}
+    live_buckets = sorted(
+        (field.decode("utf-8"), int(value)) for field, value in live.items()
+        if start <= bucket_start(field.decode("utf-8")) < end
+    )
+    estimates = []
+    if granularity in UNIQUE_GRANULARITIES and live_buckets:
+        pipe = async_redis_client.pipeline(transaction=False)
+        for bucket, _ in live_buckets:
+            pipe.pfcount(visitors_key(letter, short_code, bucket))
+        try:
+            estimates = await redis_breaker.call(pipe.execute)
+        except RedisError:
+            estimates = []
+    for index, (bucket, clicks) in enumerate(live_buckets):
+        moment = bucket_start(bucket)
+        point = points.setdefault(moment, {"bucket": moment, "clicks": 0, "uniques": None})
+        point["clicks"] += clicks
+        if estimates:
+            point["uniques"] = max(point["uniques"] or 0, estimates[index])
+
+    return [points[moment] for moment in sorted(points)]
+
+async def _run_periodically(interval: float, job, description: str) -> None:
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await job()
+        except Exception:
+            logger.exception("Failed to %s", description)
+
+def start_analytics() -> None:
+    if _tasks:
+        return
+    loop = asyncio.get_running_loop()
+    _tasks.append(loop.create_task(_run_periodically(ANALYTICS_FLUSH_INTERVAL_SECONDS, flush_events, "flush click analytics")))
+    _tasks.append(loop.create_task(_run_periodically(ANALYTICS_ROLLUP_INTERVAL_SECONDS, rollup, "roll up click analytics")))
+
+async def stop_analytics() -> None:
+    for task in _tasks:
+        task.cancel()
+    for task in _tasks:
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+    _tasks.clear()
+    try:
+        await flush_events()
+    except Exception:
+        logger.exception("Dropping %d buffered click analytics buckets on shutdown", len(click_events))
@@ -0,0 +1,71 @@
+import asyncio
+import hashlib
+import http.client
+import logging
+import os
+import time
+from typing import Tuple
+from urllib.parse import urlsplit
+from dotenv import load_dotenv
+from fastapi import Request, Response
+from models.url import CachedURL
+from services.proxies import from_trusted_proxy
+
+load_dotenv()
+
+# How long browsers and proxies may reuse a permanent redirect; capped by
+# the link's expiry
+REDIRECT_MAX_AGE_SECONDS = int(os.getenv("REDIRECT_MAX_AGE_SECONDS", "86400"))
+# The nginx in front of the backend (e.g. http://frontend); empty disables
+# purging its proxy cache
+EDGE_CACHE_URL = os.getenv("EDGE_CACHE_URL", "")
+EDGE_CACHE_PURGE_TIMEOUT_SECONDS = float(os.getenv("EDGE_CACHE_PURGE_TIMEOUT_SECONDS", "2"))
+
+# nginx sets this to 1 on refresh requests from the backend network, see
+# docker/nginx.conf; it is ignored from anywhere but TRUSTED_PROXY_NETWORKS
+PURGE_HEADER = "X-Cache-Purge"
+
+logger = logging.getLogger(__name__)
+
+def redirect_policy(cached: CachedURL) -> Tuple[int, str]:
+    # Temporary redirects must reach the backend every time to be counted
+    if not cached.permanent:
+        return 307, "no-store"
+    max_age = REDIRECT_MAX_AGE_SECONDS
+    if cached.expires is not None:
+        max_age = max(min(max_age, cached.expires - int(time.time())), 0)
+    return 301, f"public, max-age={max_age}"
+
+def is_purge_request(request: Request) -> bool:
+    # Only nginx may send it: it skips the rate limit and click counting
+    return request.headers.get(PURGE_HEADER) == "1" and from_trusted_proxy(request)
+
+def etag_response(request: Request, body: bytes, media_type: str = "application/json") -> Response:
+    # 304 when the client already holds this exact body; private, because
+    # what a caller may see depends on who they are
+    etag = f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache", "Vary": "Authorization"}
+    if_none_match = request.headers.get("if-none-match", "")
+    if etag in (tag.strip().removeprefix("W/") for tag in if_none_match.split(",")) or if_none_match.strip() == "*":
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type=media_type, headers=headers)
+
+def _refresh(path: str) -> None:
+    parts = urlsplit(EDGE_CACHE_URL)
+    connection_class = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+    connection = connection_class(parts.netloc, timeout=EDGE_CACHE_PURGE_TIMEOUT_SECONDS)
+    try:
+        connection.request("GET", parts.path.rstrip("/") + path, headers={PURGE_HEADER: "1"})
+        connection.getresponse().read()
+    finally:
+        connection.close()
+
+async def purge_redirect(short_code: str) -> None:
+    # Open source nginx has no purge; a request that bypasses the cache
+    # replaces the stored redirect with a fresh response instead
+    if not EDGE_CACHE_URL:
+        return
+    try:
+        await asyncio.to_thread(_refresh, f"/{short_code}")
+    except (OSError, http.client.HTTPException) as exc:
+        logger.warning("Could not purge the cached redirect for %s: %s", short_code, exc)
@@ -0,0 +1,132 @@
+import os
+import time
+from dotenv import load_dotenv
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    REGISTRY,
+    generate_latest,
+)
+from prometheus_client import multiprocess
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+load_dotenv()
+
+# With several uvicorn workers every process writes its samples to files in
+# this directory and /metrics aggregates them. It must be set (and emptied)
+# before the workers start
+PROMETHEUS_MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "HTTP request latency by route",
+    ["method", "route", "status", "cache"],
+    buckets=LATENCY_BUCKETS,
+)
+CACHE_REQUESTS = Counter(
+    "cache_requests_total",
+    "URL cache lookups by layer and result",
+    ["layer", "result"],
+)
+DB_QUERY_LATENCY = Histogram(
+    "db_query_duration_seconds",
+    "SQL statement execution time",
+    ["operation"],
+    buckets=LATENCY_BUCKETS,
+)
+SHORT_CODE_RETRIES = Counter(
+    "short_code_retries_total",
+    "Generated short codes that collided with an existing one and were retried",
+)
+DROPPED_CLICKS = Counter(
+    "dropped_clicks_total",
+    "Buffered clicks whose short code no shard held when they were flushed",
+)
+RATE_LIMITED_REQUESTS = Counter(
+    "rate_limited_requests_total",
+    "Requests rejected by a rate limit, by policy and the layer that rejected them",
+    ["policy", "layer"],
+)
+
+def record_cache(layer: str, result: str) -> None:
+    CACHE_REQUESTS.labels(layer=layer, result=result).inc()
+
+def record_rate_limited(policy: str, layer: str) -> None:
+    RATE_LIMITED_REQUESTS.labels(policy=policy, layer=layer).inc()
+
+def render_metrics():
+    if PROMETHEUS_MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+def mark_worker_dead() -> None:
+    # Drop this worker's live gauges; its counters stay in the aggregate
+    if PROMETHEUS_MULTIPROC_DIR:
+        multiprocess.mark_process_dead(os.getpid())
+
+def _statement_operation(statement: str) -> str:
+    words = statement.lstrip().split(None, 1)
+    return words[0].upper() if words else "UNKNOWN"
+
+def instrument_engine(engine: Engine) -> None:
+    # Pass async_engine.sync_engine for async engines
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["query_started"].pop()
+        DB_QUERY_LATENCY.labels(operation=_statement_operation(statement)).observe(time.perf_counter() - started)
+
+    @event.listens_for(engine, "handle_error")
+    def handle_error(exception_context):
+        # A failed statement never reaches after_cursor_execute
+        connection = exception_context.connection
+        if connection is not None and connection.info.get("query_started"):
+            connection.info["query_started"].pop()
+
+class MetricsMiddleware:
+    """Times every request and labels it with its route template.
+
+    Handlers can set ``request.state.cache`` to split a route's latency by
+    cache outcome.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            state = scope.get("state") or {}
+            REQUEST_LATENCY.labels(
+                method=scope["method"],
+                # Unmatched paths share one label to keep cardinality bounded
+                route=route.path if route is not None else "unmatched",
+                status=str(status_code),
+                cache=state.get("cache", ""),
+            ).observe(time.perf_counter() - started)
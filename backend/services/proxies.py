@@ -0,0 +1,34 @@
+import ipaddress
+import os
+from typing import Optional
+from dotenv import load_dotenv
+from fastapi import Request
+
+load_dotenv()
+
+# Addresses whose X-Real-IP (and X-Cache-Purge) headers are believed: the
+# nginx in front of the backend. The default matches $purge_allowed in
+# docker/nginx.conf
+TRUSTED_PROXY_NETWORKS = [
+    ipaddress.ip_network(network.strip())
+    for network in os.getenv("TRUSTED_PROXY_NETWORKS", "127.0.0.0/8,10.0.0.0/8,172.16.0.0/12,192.168.0.0/16").split(",")
+    if network.strip()
+]
+
+def from_trusted_proxy(request: Request) -> bool:
+    if request.client is None:
+        return False
+    try:
+        address = ipaddress.ip_address(request.client.host)
+    except ValueError:
+        return False
+    return any(address in network for network in TRUSTED_PROXY_NETWORKS)
+
+def client_ip(request: Request) -> Optional[str]:
+    # nginx passes the caller's address as X-Real-IP; anyone else connecting
+    # directly could send any value
+    if from_trusted_proxy(request):
+        forwarded = request.headers.get("x-real-ip")
+        if forwarded:
+            return forwarded
+    return request.client.host if request.client else None
@@ -0,0 +1,140 @@
+import logging
+import math
+import os
+import time
+from typing import NamedTuple
+from dotenv import load_dotenv
+from fastapi import HTTPException, Request
+from database.async_redis import async_redis_client
+from database.circuit_breaker import CircuitOpenError, redis_breaker
+from database.local_cache import LRUCache
+from services.http_cache import is_purge_request
+from services.metrics import record_rate_limited
+from services.proxies import client_ip
+
+load_dotenv()
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+# Requests allowed per client in any RATE_LIMIT_WINDOW_SECONDS; 0 disables a policy
+RATE_LIMIT_REDIRECTS = int(os.getenv("RATE_LIMIT_REDIRECTS", "600"))
+RATE_LIMIT_CREATES = int(os.getenv("RATE_LIMIT_CREATES", "30"))
+RATE_LIMIT_WINDOW_SECONDS = float(os.getenv("RATE_LIMIT_WINDOW_SECONDS", "60"))
+# Clients each worker remembers as blocked, so their retries are turned away
+# without asking Redis
+RATE_LIMIT_LOCAL_MAX_SIZE = int(os.getenv("RATE_LIMIT_LOCAL_MAX_SIZE", "10000"))
+# Redirects a worker takes from a client's allowance in Redis at once and then
+# admits locally, so most redirects skip the round trip
+RATE_LIMIT_REDIRECT_BATCH = int(os.getenv("RATE_LIMIT_REDIRECT_BATCH", "10"))
+
+# KEYS: this window's counter, the previous window's. ARGV: limit, window and
+# time into the current window, in ms, and the most requests to grant. The
+# previous window counts in proportion to how much of it still overlaps the
+# sliding window. Returns the number of requests granted (and counted) and,
+# when that is none, the ms until one would be
+SLIDING_WINDOW_SCRIPT = """
+local limit = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local elapsed = tonumber(ARGV[3])
+local batch = tonumber(ARGV[4])
+local current = tonumber(redis.call('GET', KEYS[1]) or '0')
+local previous = tonumber(redis.call('GET', KEYS[2]) or '0')
+local room = math.ceil(limit - previous * (window - elapsed) / window - current)
+if room > 0 then
+    local granted = math.min(batch, room)
+    redis.call('INCRBY', KEYS[1], granted)
+    redis.call('PEXPIRE', KEYS[1], window * 2)
+    return {granted, 0}
+end
+local wait
+if current < limit then
+    wait = window * (1 - (limit - current) / previous) - elapsed
+else
+    wait = window - elapsed + window * (1 - limit / current)
+end
+return {0, math.max(math.ceil(wait), 1)}
+"""
+
+logger = logging.getLogger(__name__)
+
+class Policy(NamedTuple):
+    name: str
+    limit: int
+    window: float
+    batch: int = 1
+
+REDIRECTS = Policy("redirect", RATE_LIMIT_REDIRECTS, RATE_LIMIT_WINDOW_SECONDS, RATE_LIMIT_REDIRECT_BATCH)
+CREATES = Policy("create", RATE_LIMIT_CREATES, RATE_LIMIT_WINDOW_SECONDS)
+
+class RateLimiter:
+    """Sliding-window limits shared by every worker through Redis.
+
+    A client Redis has rejected is remembered in-process until it may retry,
+    so repeated rejections cost no round trip. Policies with a ``batch`` take
+    that many requests from Redis at once and admit the rest locally. While
+    Redis is unavailable requests are let through rather than failed.
+    """
+
+    def __init__(self, client=async_redis_client, breaker=redis_breaker, max_size: int = RATE_LIMIT_LOCAL_MAX_SIZE):
+        self.breaker = breaker
+        self._script = client.register_script(SLIDING_WINDOW_SCRIPT)
+        self._blocked = LRUCache(max_size=max_size)
+        self._allowance = LRUCache(max_size=max_size)
+
+    async def retry_after(self, policy: Policy, identity: str) -> float:
+        # Seconds until identity may make another request under policy; 0
+        # when this one is allowed (and has been counted)
+        key = (policy.name, identity)
+        blocked_until = self._blocked.get(key)
+        if blocked_until is not None:
+            record_rate_limited(policy.name, "local")
+            return max(blocked_until - time.monotonic(), 0.001)
+        allowance = self._allowance.get(key)
+        if allowance:
+            allowance[0] -= 1
+            if not allowance[0]:
+                self._allowance.delete(key)
+            return 0
+
+        window_ms = int(policy.window * 1000)
+        now_ms = int(time.time() * 1000)
+        index, elapsed = divmod(now_ms, window_ms)
+        prefix = f"ratelimit:{policy.name}:{identity}"
+        try:
+            granted, wait_ms = await self.breaker.call(
+                self._script,
+                keys=[f"{prefix}:{index}", f"{prefix}:{index - 1}"],
+                args=[policy.limit, window_ms, elapsed, max(policy.batch, 1)],
+            )
+        except CircuitOpenError:
+            return 0
+        except Exception as exc:
+            # A limiter failure of any kind must not fail the request it guards
+            logger.warning("Could not check the %s rate limit: %s", policy.name, exc)
+            return 0
+        if granted:
+            # The rest were counted in this window, so they are only good until it ends
+            if granted > 1:
+                self._allowance.set(key, [granted - 1], ttl=(window_ms - elapsed) / 1000)
+            return 0
+        wait = wait_ms / 1000
+        self._blocked.set(key, time.monotonic() + wait, ttl=wait)
+        record_rate_limited(policy.name, "redis")
+        return wait
+
+rate_limiter = RateLimiter()
+
+async def enforce(policy: Policy, identity: str) -> None:
+    if not RATE_LIMIT_ENABLED or policy.limit <= 0:
+        return
+    wait = await rate_limiter.retry_after(policy, identity)
+    if wait:
+        raise HTTPException(
+            status_code=429,
+            detail="Too many requests",
+            headers={"Retry-After": str(math.ceil(wait))},
+        )
+
+async def limit_redirects(request: Request) -> None:
+    # nginx refreshing a cached redirect is not a client request
+    if not is_purge_request(request):
+        await enforce(REDIRECTS, f"ip:{client_ip(request)}")
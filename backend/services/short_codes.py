@@ -0,0 +1,173 @@
+import asyncio
+import hashlib
+import os
+import string
+from abc import ABC, abstractmethod
+from typing import List, Tuple
+from dotenv import load_dotenv
+from sqlalchemy import text
+from database.async_database import AsyncSessionLocal
+from database.async_redis import async_redis_client
+from database.circuit_breaker import redis_breaker
+
+load_dotenv()
+
+SHORT_CODE_ALLOCATOR = os.getenv("SHORT_CODE_ALLOCATOR", "redis")
+SHORT_CODE_MIN_LENGTH = int(os.getenv("SHORT_CODE_MIN_LENGTH", "6"))
+SHORT_CODE_BLOCK_SIZE = int(os.getenv("SHORT_CODE_BLOCK_SIZE", "1000"))
+SHORT_CODE_SECRET = os.getenv("SHORT_CODE_SECRET", "change-me-short-code-secret")
+SHORT_CODE_COUNTER_KEY = os.getenv("SHORT_CODE_COUNTER_KEY", "short_code:counter")
+SHORT_CODE_SEQUENCE = "short_code_id_seq"
+
+ALPHABET = string.digits + string.ascii_uppercase + string.ascii_lowercase
+BASE = len(ALPHABET)
+
+def base62_encode(number: int, length: int) -> str:
+    chars = []
+    for _ in range(length):
+        number, remainder = divmod(number, BASE)
+        chars.append(ALPHABET[remainder])
+    if number:
+        raise ValueError("Number does not fit in the requested length")
+    return "".join(reversed(chars))
+
+def base62_decode(code: str) -> int:
+    number = 0
+    for char in code:
+        number = number * BASE + ALPHABET.index(char)
+    return number
+
+class FeistelPermutation:
+    """Keyed bijection on ``range(BASE ** length)``.
+
+    A balanced Feistel network scrambles the bits of a sequential id and
+    cycle-walking keeps the result inside the domain, so consecutive ids map
+    to unrelated-looking codes without ever colliding.
+    """
+
+    def __init__(self, key: bytes, rounds: int = 4):
+        self.key = key
+        self.rounds = rounds
+
+    def _round(self, value: int, round_index: int, half_bits: int) -> int:
+        digest = hashlib.blake2b(
+            value.to_bytes(8, "big"),
+            key=self.key[:64],
+            digest_size=8,
+            person=round_index.to_bytes(16, "big"),
+        ).digest()
+        return int.from_bytes(digest, "big") & ((1 << half_bits) - 1)
+
+    def _encrypt(self, value: int, half_bits: int) -> int:
+        mask = (1 << half_bits) - 1
+        left, right = value >> half_bits, value & mask
+        for round_index in range(self.rounds):
+            left, right = right, left ^ self._round(right, round_index, half_bits)
+        return (left << half_bits) | right
+
+    def _decrypt(self, value: int, half_bits: int) -> int:
+        mask = (1 << half_bits) - 1
+        left, right = value >> half_bits, value & mask
+        for round_index in reversed(range(self.rounds)):
+            left, right = right ^ self._round(left, round_index, half_bits), left
+        return (left << half_bits) | right
+
+    @staticmethod
+    def _half_bits(domain: int) -> int:
+        return ((domain - 1).bit_length() + 1) // 2
+
+    def permute(self, value: int, domain: int) -> int:
+        half_bits = self._half_bits(domain)
+        value = self._encrypt(value, half_bits)
+        while value >= domain:
+            value = self._encrypt(value, half_bits)
+        return value
+
+    def invert(self, value: int, domain: int) -> int:
+        half_bits = self._half_bits(domain)
+        value = self._decrypt(value, half_bits)
+        while value >= domain:
+            value = self._decrypt(value, half_bits)
+        return value
+
+_permutation = FeistelPermutation(SHORT_CODE_SECRET.encode("utf-8"))
+
+def encode_id(number: int, min_length: int = SHORT_CODE_MIN_LENGTH) -> str:
+    # Ids fill every code of min_length first, then move on to longer codes,
+    # so codes of different lengths can never collide either
+    length = min_length
+    while number >= BASE ** length:
+        number -= BASE ** length
+        length += 1
+    return base62_encode(_permutation.permute(number, BASE ** length), length)
+
+def decode_id(code: str, min_length: int = SHORT_CODE_MIN_LENGTH) -> int:
+    length = len(code)
+    offset = sum(BASE ** size for size in range(min_length, length))
+    return offset + _permutation.invert(base62_decode(code), BASE ** length)
+
+class ShortCodeAllocator(ABC):
+    """Hands out unique short codes from ids leased in blocks."""
+
+    def __init__(self, block_size: int = SHORT_CODE_BLOCK_SIZE):
+        self.block_size = block_size
+        self._next_id = 0
+        self._end_id = 0
+        self._lock = asyncio.Lock()
+
+    @abstractmethod
+    async def _lease(self, size: int) -> Tuple[int, int]:
+        # Reserve at least one id and return (first id, number of ids reserved)
+        ...
+
+    async def allocate(self) -> str:
+        return (await self.allocate_many(1))[0]
+
+    async def allocate_many(self, count: int) -> List[str]:
+        ids = []
+        async with self._lock:
+            while len(ids) < count:
+                if self._next_id >= self._end_id:
+                    start, size = await self._lease(max(self.block_size, count - len(ids)))
+                    self._next_id, self._end_id = start, start + size
+                take = min(count - len(ids), self._end_id - self._next_id)
+                ids.extend(range(self._next_id, self._next_id + take))
+                self._next_id += take
+        return [encode_id(number) for number in ids]
+
+class RedisBlockAllocator(ShortCodeAllocator):
+    # The counter must survive Redis restarts, so run Redis with AOF or RDB persistence
+    async def _lease(self, size: int) -> Tuple[int, int]:
+        end = await redis_breaker.call(async_redis_client.incrby, SHORT_CODE_COUNTER_KEY, size)
+        return end - size, size
+
+class SequenceBlockAllocator(ShortCodeAllocator):
+    # Every nextval() on a sequence that increments by the block size leases
+    # a whole block. The sequence is created by migration 0007
+    def __init__(self, block_size: int = SHORT_CODE_BLOCK_SIZE):
+        super().__init__(block_size)
+        self._increment = None
+
+    async def _lease(self, size: int) -> Tuple[int, int]:
+        async with AsyncSessionLocal() as db:
+            if self._increment is None:
+                result = await db.execute(
+                    text("SELECT increment_by FROM pg_sequences WHERE sequencename = :name"),
+                    {"name": SHORT_CODE_SEQUENCE},
+                )
+                self._increment = result.scalar_one()
+            result = await db.execute(text(f"SELECT nextval('{SHORT_CODE_SEQUENCE}')"))
+            return result.scalar_one(), self._increment
+
+ALLOCATORS = {
+    "redis": RedisBlockAllocator,
+    "sequence": SequenceBlockAllocator,
+}
+
+def get_allocator(name: str = SHORT_CODE_ALLOCATOR) -> ShortCodeAllocator:
+    try:
+        return ALLOCATORS[name]()
+    except KeyError:
+        raise ValueError(f"Unknown short code allocator: {name}")
+
+short_code_allocator = get_allocator()
@@ -1,5 +1,6 @@
 import pytest
 from fastapi import status
+from api.auth import create_access_token
 
 def test_register_user(client):
     user_data = {
@@ -80,3 +81,25 @@ def test_get_current_user_invalid_token(client):
     response = client.get("/api/auth/me", headers=headers)
     assert response.status_code == 401
     assert "Could not validate credentials" in response.json()["detail"]
+
+def test_logout_all_revokes_tokens(test_client, auth_headers):
+    response = test_client.get("/api/auth/me", headers=auth_headers)
+    assert response.status_code == 200
+
+    response = test_client.post("/api/auth/logout-all", headers=auth_headers)
+    assert response.status_code == 204
+
+    # The old token carries a stale version and is rejected from now on
+    response = test_client.get("/api/auth/me", headers=auth_headers)
+    assert response.status_code == 401
+
+def test_logout_all_revokes_tokens_without_an_id(test_client, test_user, auth_headers):
+    legacy_headers = {"Authorization": f"Bearer {create_access_token({'sub': test_user['email']})}"}
+    response = test_client.get("/api/auth/me", headers=legacy_headers)
+    assert response.status_code == 200
+
+    response = test_client.post("/api/auth/logout-all", headers=auth_headers)
+    assert response.status_code == 204
+
+    response = test_client.get("/api/auth/me", headers=legacy_headers)
+    assert response.status_code == 401
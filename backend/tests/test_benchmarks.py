@@ -0,0 +1,16 @@
+from benchmarks.run import percentile, summarize
+
+def test_percentile_uses_nearest_rank():
+    values = [float(value) for value in range(1, 101)]
+    assert percentile(values, 0.50) == 50.0
+    assert percentile(values, 0.99) == 99.0
+    assert percentile([], 0.99) == 0.0
+
+def test_summarize_reports_throughput_and_tail_latency():
+    summary = summarize([0.001] * 98 + [0.010, 0.020], errors=1, elapsed=0.5, concurrency=4, items_per_request=10)
+    assert summary["requests"] == 100
+    assert summary["requests_per_second"] == 200.0
+    assert summary["items_per_second"] == 2000.0
+    assert summary["p50_ms"] == 1.0
+    assert summary["p99_ms"] == 10.0
+    assert summary["max_ms"] == 20.0
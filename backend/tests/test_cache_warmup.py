@@ -0,0 +1,37 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+import fakeredis
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from database import cache_warmup
+from database.database import Base
+from models.click_stat import ClickStat
+from models.url import URL
+import models.user
+
+def test_warm_up_loads_recently_hot_links_first(monkeypatch):
+    redis = fakeredis.aioredis.FakeRedis(server=fakeredis.FakeServer())
+    monkeypatch.setattr(cache_warmup, "async_redis_client", redis)
+
+    async def run():
+        engine = create_async_engine("sqlite+aiosqlite://")
+        async with engine.begin() as connection:
+            await connection.run_sync(Base.metadata.create_all)
+        session_factory = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+        async with session_factory() as db:
+            db.add_all(URL(original_url=f"https://example.com/{i}", short_code=f"code{i}", clicks=i) for i in range(5))
+            db.add(ClickStat(short_code="code1", granularity="d", bucket_start=datetime.now(timezone.utc) - timedelta(days=1), clicks=50))
+            await db.commit()
+            links = await cache_warmup.top_links(db, 2)
+
+        assert [short_code for short_code, _ in links] == ["code1", "code4"]
+
+        await redis.set("url:code1", "https://newer.example.com")
+        assert await cache_warmup.warm_url_cache(session_factory, limit=2) == 2
+        await engine.dispose()
+
+        # Existing mappings are left alone, new ones get the cache TTL
+        assert await redis.get("url:code1") == b"https://newer.example.com"
+        assert await redis.get("url:code4") == b"https://example.com/4"
+        assert await redis.ttl("url:code4") > 0
+
+    asyncio.run(run())
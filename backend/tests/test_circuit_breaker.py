@@ -0,0 +1,94 @@
+import asyncio
+from datetime import datetime, timezone
+import fakeredis
+import pytest
+from redis.exceptions import ConnectionError, TimeoutError
+from database import redis_cache
+from database.circuit_breaker import CircuitBreaker, CircuitOpenError
+from services import analytics
+
+@pytest.fixture
+def server():
+    return fakeredis.FakeServer()
+
+@pytest.fixture
+def breaker(server, monkeypatch):
+    redis = fakeredis.aioredis.FakeRedis(server=server)
+    breaker = CircuitBreaker("test", failure_threshold=2, reset_timeout=60)
+    monkeypatch.setattr(redis_cache, "async_redis_client", redis)
+    monkeypatch.setattr(redis_cache, "redis_breaker", breaker)
+    monkeypatch.setattr(analytics, "async_redis_client", redis)
+    monkeypatch.setattr(analytics, "redis_breaker", breaker)
+    return breaker
+
+def test_breaker_opens_after_consecutive_failures_and_probes_once():
+    breaker = CircuitBreaker("test", failure_threshold=2, reset_timeout=0)
+    calls = []
+
+    async def failing():
+        calls.append(1)
+        raise ConnectionError("down")
+
+    async def working():
+        calls.append(1)
+        return "ok"
+
+    async def run():
+        for _ in range(2):
+            with pytest.raises(ConnectionError):
+                await breaker.call(failing)
+        assert breaker.state == breaker.OPEN
+
+        # reset_timeout=0: the next call is the half-open probe
+        with pytest.raises(ConnectionError):
+            await breaker.call(failing)
+        assert breaker.state == breaker.OPEN
+
+        assert await breaker.call(working) == "ok"
+        assert breaker.state == breaker.CLOSED and breaker.failures == 0
+        assert len(calls) == 4
+    asyncio.run(run())
+
+def test_slow_calls_count_as_failures():
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=60, call_timeout=0.01)
+
+    async def run():
+        with pytest.raises(TimeoutError):
+            await breaker.call(asyncio.sleep, 1)
+        with pytest.raises(CircuitOpenError):
+            await breaker.call(asyncio.sleep, 0)
+    asyncio.run(run())
+
+def test_lookups_degrade_to_misses_while_redis_is_down(server, breaker):
+    async def run():
+        await redis_cache.cache_url("abc123", "https://example.com")
+        server.connected = False
+        for _ in range(3):
+            assert await redis_cache.lookup_url("abc123") == (None, False)
+        await redis_cache.cache_url("abc123", "https://example.com")
+        assert breaker.state == breaker.OPEN
+    asyncio.run(run())
+
+def test_clicks_are_buffered_during_outage_and_replayed(server, breaker):
+    events = analytics.ClickEvents()
+    moment = datetime(2026, 1, 2, 3, 4, tzinfo=timezone.utc)
+
+    async def run():
+        server.connected = False
+        events.record("abc123", "visitor", moment)
+        for _ in range(3):
+            try:
+                await analytics.flush_events(events)
+            except ConnectionError:
+                pass
+        events.record("abc123", "visitor", moment)
+        await analytics.flush_events(events)
+        assert breaker.state == breaker.OPEN and len(events) == 1
+
+        server.connected = True
+        breaker.reset_timeout = 0
+        await analytics.flush_events(events)
+        assert breaker.state == breaker.CLOSED and len(events) == 0
+        counters = await analytics.async_redis_client.hgetall(analytics.counter_key("m", "abc123"))
+        assert counters == {b"202601020304": b"2"}
+    asyncio.run(run())
@@ -0,0 +1,63 @@
+import asyncio
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from database import click_buffer as click_buffer_module
+from database.click_buffer import ClickBuffer, flush_clicks, start_click_flusher, stop_click_flusher
+from database.database import Base
+from database.shards import Shard
+from models.url import URL
+from services.metrics import DROPPED_CLICKS
+import models.user
+
+def test_flusher_restarts_on_a_new_event_loop():
+    """Test that the flusher can run again after the app restarts on another loop."""
+    buffer = ClickBuffer()
+
+    async def cycle():
+        start_click_flusher(buffer)
+        await asyncio.sleep(0.01)
+        await stop_click_flusher(buffer)
+
+    asyncio.run(cycle())
+    asyncio.run(cycle())
+    assert buffer.batch_ready is None
+
+def test_clicks_of_moved_codes_follow_them_to_their_new_shard(monkeypatch):
+    """Test that clicks for a code its ring shard no longer holds are written where it is."""
+    async def run():
+        engines = [create_async_engine("sqlite+aiosqlite://"), create_async_engine("sqlite+aiosqlite://")]
+        for engine in engines:
+            async with engine.begin() as connection:
+                await connection.run_sync(Base.metadata.create_all)
+        default_sessions = async_sessionmaker(engines[0], class_=AsyncSession, expire_on_commit=False)
+        other = Shard("other", engines[1])
+        async with default_sessions() as db:
+            db.add(URL(original_url="https://example.com/kept", short_code="kept", clicks=0))
+            await db.commit()
+        async with other.sessions() as db:
+            db.add(URL(original_url="https://example.com/moved", short_code="moved", clicks=0))
+            await db.commit()
+
+        # This worker's ring still places every code on the default shard
+        shards = {"default": Shard("default"), "other": other}
+        monkeypatch.setattr(click_buffer_module, "shards", shards)
+        monkeypatch.setattr(click_buffer_module, "shard_for", lambda short_code: shards["default"])
+        monkeypatch.setattr(click_buffer_module, "group_by_shard", lambda short_codes: {"default": list(short_codes)})
+
+        buffer = ClickBuffer()
+        buffer.record("kept", 2)
+        buffer.record("moved", 3)
+        buffer.record("deleted", 4)
+        dropped_before = DROPPED_CLICKS._value.get()
+        assert await flush_clicks(buffer, session_factory=default_sessions) == 2
+        assert len(buffer) == 0
+        assert DROPPED_CLICKS._value.get() - dropped_before == 4
+
+        async with default_sessions() as db:
+            assert (await db.execute(select(URL.clicks).where(URL.short_code == "kept"))).scalar() == 2
+        async with other.sessions() as db:
+            assert (await db.execute(select(URL.clicks).where(URL.short_code == "moved"))).scalar() == 3
+        for engine in engines:
+            await engine.dispose()
+
+    asyncio.run(run())
@@ -0,0 +1,52 @@
+import asyncio
+from database import invalidation
+from database.circuit_breaker import CircuitBreaker
+from database.code_filter import BloomFilter, CodeFilter
+
+def test_bloom_filter_has_no_false_negatives():
+    """Test that every added code is reported as present."""
+    bloom = BloomFilter(capacity=1000, error_rate=0.01)
+    codes = [f"code{i}" for i in range(1000)]
+    for code in codes:
+        bloom.add(code)
+    assert all(code in bloom for code in codes)
+
+def test_bloom_filter_false_positive_rate():
+    """Test that unknown codes are rarely reported as present."""
+    bloom = BloomFilter(capacity=1000, error_rate=0.01)
+    for i in range(1000):
+        bloom.add(f"code{i}")
+    false_positives = sum(f"other{i}" in bloom for i in range(10000))
+    assert false_positives < 300
+
+def test_code_filter_allows_everything_until_built():
+    """Test that an unbuilt filter never rejects a code."""
+    code_filter = CodeFilter()
+    assert not code_filter.ready
+    assert code_filter.might_exist("anything")
+
+def test_filter_misses_are_not_final_while_new_codes_cannot_arrive(monkeypatch):
+    """Test that a filter miss only stands while pub/sub and Redis are up."""
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=60)
+    breaker.on_close.append(invalidation.forget_filter)
+    code_filter = CodeFilter()
+    code_filter._bloom = BloomFilter(capacity=100)
+    monkeypatch.setattr(invalidation, "redis_breaker", breaker)
+    monkeypatch.setattr(invalidation, "code_filter", code_filter)
+    monkeypatch.setattr(invalidation, "_subscribed", False)
+    assert not invalidation.filter_misses_are_final()
+
+    monkeypatch.setattr(invalidation, "_subscribed", True)
+    assert invalidation.filter_misses_are_final()
+
+    breaker.record_failure()
+    assert not invalidation.filter_misses_are_final()
+
+    async def recover():
+        monkeypatch.setattr(code_filter, "rebuild", lambda: asyncio.sleep(0))
+        breaker.record_success()
+        # Codes announced during the outage were lost, so the filter starts over
+        assert invalidation.filter_misses_are_final()
+        assert not code_filter.ready and code_filter.might_exist("created-elsewhere")
+        await code_filter.stop()
+    asyncio.run(recover())
@@ -0,0 +1,58 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+import fakeredis
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from database import expiry, redis_cache
+from database.database import Base
+from models.click_stat import ClickStat
+from models.url import URL, cache_value, has_expired, split_cache_value
+import models.user
+
+def test_cached_values_carry_the_expiry_and_align_the_redis_ttl(monkeypatch):
+    redis = fakeredis.aioredis.FakeRedis(server=fakeredis.FakeServer())
+    monkeypatch.setattr(redis_cache, "async_redis_client", redis)
+    monkeypatch.setattr(redis_cache, "EXPIRED_URL_CACHE_SECONDS", 60)
+    soon = datetime.now(timezone.utc) + timedelta(seconds=100)
+    past = datetime.now(timezone.utc) - timedelta(seconds=5)
+
+    assert cache_value("https://example.com", None) == "https://example.com"
+    cached = split_cache_value(cache_value("https://example.com", soon))
+    assert cached.original_url == "https://example.com" and not has_expired(cached.expires)
+    assert has_expired(split_cache_value(cache_value("https://example.com", past)).expires)
+
+    async def run():
+        await redis_cache.cache_url("soon00", cache_value("https://example.com", soon))
+        assert 100 <= await redis.ttl("url:soon00") <= 160
+        # Hits do not slide an expiring link past its expiry
+        assert (await redis_cache.lookup_url("soon00"))[0] == cache_value("https://example.com", soon)
+        assert await redis.ttl("url:soon00") <= 160
+    asyncio.run(run())
+
+def test_sweep_deletes_links_expired_past_the_grace_period(monkeypatch):
+    redis = fakeredis.aioredis.FakeRedis(server=fakeredis.FakeServer())
+    monkeypatch.setattr(redis_cache, "async_redis_client", redis)
+    monkeypatch.setattr(expiry, "EXPIRED_URL_CACHE_SECONDS", 60)
+    now = datetime.now(timezone.utc)
+
+    async def run():
+        engine = create_async_engine("sqlite+aiosqlite://")
+        async with engine.begin() as connection:
+            await connection.run_sync(Base.metadata.create_all)
+        session_factory = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+        async with session_factory() as db:
+            db.add_all(URL(original_url="https://example.com/old", short_code=f"old{i}", expires_at=now - timedelta(hours=1)) for i in range(5))
+            db.add(URL(original_url="https://example.com/recent", short_code="recent", expires_at=now - timedelta(seconds=10)))
+            db.add(URL(original_url="https://example.com/live", short_code="live", expires_at=now + timedelta(hours=1)))
+            db.add(URL(original_url="https://example.com/forever", short_code="forever"))
+            db.add(ClickStat(short_code="old0", granularity="d", bucket_start=now - timedelta(days=1), clicks=3))
+            await db.commit()
+        await redis_cache.cache_url("old0", cache_value("https://example.com/old", now - timedelta(hours=1)))
+
+        assert await expiry.sweep_expired(session_factory, now=now, batch_size=2) == 5
+        async with session_factory() as db:
+            assert set((await db.execute(select(URL.short_code))).scalars()) == {"recent", "live", "forever"}
+            assert (await db.execute(select(ClickStat))).first() is None
+        assert await redis.exists("url:old0") == 0
+        await engine.dispose()
+    asyncio.run(run())
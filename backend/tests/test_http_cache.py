@@ -0,0 +1,47 @@
+import asyncio
+import time
+import fakeredis
+from fastapi import Request
+from database import redis_cache
+from models.url import CachedURL, cache_value, split_cache_value
+from services.http_cache import etag_response, is_purge_request, redirect_policy
+
+def make_request(headers=None, client=None) -> Request:
+    raw = [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in (headers or {}).items()]
+    return Request({"type": "http", "method": "GET", "path": "/", "headers": raw, "client": client})
+
+def test_redirect_policy_per_link():
+    assert redirect_policy(CachedURL("https://example.com", None, False)) == (307, "no-store")
+    status_code, cache_control = redirect_policy(CachedURL("https://example.com", None, True))
+    assert status_code == 301 and cache_control.startswith("public, max-age=")
+
+    # A permanent link is never cached past its expiry
+    assert redirect_policy(CachedURL("https://example.com", int(time.time()) + 30, True))[1] in ("public, max-age=30", "public, max-age=29")
+
+def test_policy_survives_the_redis_round_trip(monkeypatch):
+    redis = fakeredis.aioredis.FakeRedis(server=fakeredis.FakeServer())
+    monkeypatch.setattr(redis_cache, "async_redis_client", redis)
+
+    async def run():
+        await redis_cache.cache_url("perm00", cache_value("https://example.com", None, permanent=True))
+        value, _ = await redis_cache.lookup_url("perm00")
+        assert split_cache_value(value) == CachedURL("https://example.com", None, True)
+        # Permanent links that never expire still slide like any other
+        assert await redis.ttl("url:perm00") == redis_cache.URL_CACHE_TTL_SECONDS
+    asyncio.run(run())
+
+def test_etag_response_answers_304_for_a_matching_tag():
+    body = b'{"clicks": 1}'
+    first = etag_response(make_request(), body)
+    assert first.status_code == 200 and first.body == body
+    etag = first.headers["etag"]
+
+    assert etag_response(make_request({"If-None-Match": etag}), body).status_code == 304
+    assert etag_response(make_request({"If-None-Match": f"W/{etag}"}), body).status_code == 304
+    assert etag_response(make_request({"If-None-Match": etag}), b'{"clicks": 2}').status_code == 200
+
+def test_purge_requests_are_only_honoured_from_trusted_proxies():
+    purge = {"X-Cache-Purge": "1"}
+    assert is_purge_request(make_request(purge, client=("172.18.0.3", 40000)))
+    assert not is_purge_request(make_request(purge, client=("203.0.113.9", 40000)))
+    assert not is_purge_request(make_request({"X-Cache-Purge": "0"}, client=("172.18.0.3", 40000)))
@@ -0,0 +1,17 @@
+import pytest
+from fastapi import HTTPException
+from api import internal
+
+def test_internal_endpoints_are_off_without_a_token(monkeypatch):
+    monkeypatch.setattr(internal, "INTERNAL_API_TOKEN", None)
+    with pytest.raises(HTTPException) as error:
+        internal.check_internal_token(None)
+    assert error.value.status_code == 404
+
+def test_internal_endpoints_require_the_configured_token(monkeypatch):
+    monkeypatch.setattr(internal, "INTERNAL_API_TOKEN", "s3cret")
+    internal.check_internal_token("s3cret")
+    for token in (None, "", "wrong"):
+        with pytest.raises(HTTPException) as error:
+            internal.check_internal_token(token)
+        assert error.value.status_code == 403
@@ -0,0 +1,37 @@
+import time
+from database.local_cache import LRUCache
+
+def test_get_returns_cached_value():
+    """Test that a stored value is returned until it is evicted."""
+    cache = LRUCache(max_size=2, ttl=60)
+    cache.set("abc", "https://www.example.com")
+    assert cache.get("abc") == "https://www.example.com"
+    assert cache.get("missing") is None
+
+def test_least_recently_used_entry_is_evicted():
+    """Test that the cache never grows past max_size."""
+    cache = LRUCache(max_size=2, ttl=60)
+    cache.set("a", "1")
+    cache.set("b", "2")
+    # Touch "a" so that "b" becomes the least recently used entry
+    cache.get("a")
+    cache.set("c", "3")
+    assert len(cache) == 2
+    assert cache.get("b") is None
+    assert cache.get("a") == "1"
+    assert cache.get("c") == "3"
+    assert cache.evictions == 1
+
+def test_entries_expire_after_ttl():
+    """Test that entries are dropped once their TTL has passed."""
+    cache = LRUCache(max_size=10, ttl=0.01)
+    cache.set("a", "1")
+    time.sleep(0.02)
+    assert cache.get("a") is None
+
+def test_delete_invalidates_entry():
+    """Test that deleting a key removes it from the cache."""
+    cache = LRUCache(max_size=10, ttl=60)
+    cache.set("a", "1")
+    cache.delete("a")
+    assert cache.get("a") is None
@@ -0,0 +1,44 @@
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, text
+from services.metrics import MetricsMiddleware, REGISTRY, instrument_engine, render_metrics
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+def make_app():
+    app = FastAPI()
+    app.add_middleware(MetricsMiddleware)
+
+    @app.get("/items/{item_id}")
+    async def read_item(item_id: str, request: Request):
+        request.state.cache = "hit" if item_id == "cached" else "miss"
+        return {"id": item_id}
+
+    return app
+
+def test_latency_is_labelled_by_route_template_and_cache():
+    labels = {"method": "GET", "route": "/items/{item_id}", "status": "200"}
+    hits = sample("http_request_duration_seconds_count", cache="hit", **labels)
+    misses = sample("http_request_duration_seconds_count", cache="miss", **labels)
+    unmatched = sample("http_request_duration_seconds_count", method="GET", route="unmatched", status="404", cache="")
+
+    client = TestClient(make_app())
+    client.get("/items/cached")
+    client.get("/items/cached")
+    client.get("/items/other")
+    client.get("/nowhere/at/all")
+
+    assert sample("http_request_duration_seconds_count", cache="hit", **labels) == hits + 2
+    assert sample("http_request_duration_seconds_count", cache="miss", **labels) == misses + 1
+    assert sample("http_request_duration_seconds_count", method="GET", route="unmatched", status="404", cache="") == unmatched + 1
+
+def test_sql_statements_are_timed():
+    engine = create_engine("sqlite://")
+    instrument_engine(engine)
+    before = sample("db_query_duration_seconds_count", operation="SELECT")
+    with engine.connect() as connection:
+        connection.execute(text("SELECT 1"))
+    assert sample("db_query_duration_seconds_count", operation="SELECT") == before + 1
+    body, _ = render_metrics()
+    assert b"db_query_duration_seconds_bucket" in body
@@ -0,0 +1,18 @@
+import asyncio
+import pytest
+from fastapi import HTTPException
+from services import passwords
+
+def test_hash_and_verify_round_trip():
+    async def run():
+        hashed = await passwords.hash_password("secret")
+        assert await passwords.verify_password("secret", hashed)
+        assert not await passwords.verify_password("wrong", hashed)
+    asyncio.run(run())
+
+def test_saturated_pool_rejects_immediately(monkeypatch):
+    monkeypatch.setattr(passwords, "PASSWORD_POOL_MAX_PENDING", 0)
+    with pytest.raises(HTTPException) as exc_info:
+        asyncio.run(passwords.hash_password("secret"))
+    assert exc_info.value.status_code == 503
+    assert "Retry-After" in exc_info.value.headers
@@ -0,0 +1,53 @@
+import asyncio
+import fakeredis
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from database.pools import InstrumentedQueuePool, InstrumentedRedisPool, PoolStats
+
+def test_pool_stats_snapshot():
+    stats = PoolStats()
+    stats.record(0.002, waited=False)
+    stats.record(0.004, waited=True)
+    stats.record_timeout()
+    snapshot = stats.snapshot()
+    assert snapshot["checkouts"] == 2
+    assert snapshot["waits"] == 1
+    assert snapshot["timeouts"] == 1
+    assert snapshot["avg_checkout_ms"] == pytest.approx(3.0)
+    assert snapshot["max_checkout_ms"] == pytest.approx(4.0)
+
+def test_instrumented_pool_reports_usage_and_waits():
+    engine = create_engine("sqlite://", poolclass=InstrumentedQueuePool, pool_size=1, max_overflow=0, pool_timeout=0.05)
+    connection = engine.connect()
+    assert engine.pool.describe()["in_use"] == 1
+
+    with pytest.raises(PoolTimeoutError):
+        engine.connect()
+
+    connection.close()
+    stats = engine.pool.describe()
+    assert stats["in_use"] == 0
+    assert stats["idle"] == 1
+    assert stats["checkouts"] == 1
+    assert stats["timeouts"] == 1
+    engine.dispose()
+
+def test_redis_pool_can_be_used_from_a_new_event_loop():
+    pool = InstrumentedRedisPool(
+        max_connections=1, timeout=1,
+        connection_class=fakeredis.aioredis.FakeConnection, server=fakeredis.FakeServer(),
+    )
+    client = fakeredis.aioredis.FakeRedis(connection_pool=pool)
+
+    async def hold_and_ping():
+        # Waiting for the only connection binds the condition to this loop
+        connection = await pool.get_connection("PING")
+        waiter = asyncio.ensure_future(client.ping())
+        await asyncio.sleep(0)
+        await pool.release(connection)
+        return await waiter
+
+    assert asyncio.run(hold_and_ping())
+    assert asyncio.run(hold_and_ping())
+    assert pool.describe()["in_use"] == 0
@@ -0,0 +1,109 @@
+import asyncio
+import fakeredis
+import pytest
+from fastapi import HTTPException, Request
+from database.circuit_breaker import CircuitBreaker
+from services import rate_limit
+from services.proxies import client_ip
+from services.rate_limit import Policy, RateLimiter
+
+@pytest.fixture
+def server():
+    return fakeredis.FakeServer()
+
+@pytest.fixture
+def limiter(server, monkeypatch):
+    limiter = RateLimiter(client=fakeredis.aioredis.FakeRedis(server=server), breaker=CircuitBreaker("test"))
+    monkeypatch.setattr(rate_limit, "rate_limiter", limiter)
+    monkeypatch.setattr(rate_limit, "RATE_LIMIT_ENABLED", True)
+    return limiter
+
+def test_clients_are_limited_separately_and_told_when_to_retry(limiter):
+    policy = Policy("create", 3, 60)
+
+    async def run():
+        for _ in range(3):
+            assert await limiter.retry_after(policy, "ip:10.0.0.1") == 0
+        wait = await limiter.retry_after(policy, "ip:10.0.0.1")
+        assert 0 < wait <= 120
+        assert await limiter.retry_after(policy, "ip:10.0.0.2") == 0
+        assert await limiter.retry_after(Policy("redirect", 3, 60), "ip:10.0.0.1") == 0
+
+        with pytest.raises(HTTPException) as error:
+            await rate_limit.enforce(policy, "ip:10.0.0.1")
+        assert error.value.status_code == 429
+        assert int(error.value.headers["Retry-After"]) >= 1
+    asyncio.run(run())
+
+def test_blocked_clients_are_rejected_without_asking_redis(server, limiter):
+    policy = Policy("create", 1, 60)
+
+    async def run():
+        assert await limiter.retry_after(policy, "user:1") == 0
+        assert await limiter.retry_after(policy, "user:1") > 0
+        # Redis being unreachable would let requests through; the local
+        # pre-check still rejects without a round trip
+        server.connected = False
+        assert await limiter.retry_after(policy, "user:1") > 0
+        assert limiter.breaker.failures == 0
+    asyncio.run(run())
+
+def test_requests_are_let_through_while_redis_is_down(server, limiter):
+    policy = Policy("create", 1, 60)
+    server.connected = False
+
+    async def run():
+        for _ in range(3):
+            assert await limiter.retry_after(policy, "ip:10.0.0.1") == 0
+    asyncio.run(run())
+
+def test_the_previous_window_counts_in_proportion_to_its_overlap(server, limiter, monkeypatch):
+    policy = Policy("redirect", 10, 60)
+    clock = [600.0]
+    monkeypatch.setattr(rate_limit.time, "time", lambda: clock[0])
+
+    async def run():
+        for _ in range(10):
+            assert await limiter.retry_after(policy, "ip:10.0.0.1") == 0
+        # A quarter into the next window three quarters of the previous
+        # one's 10 requests still count (7.5), leaving room for three more
+        clock[0] = 675.0
+        limiter._blocked.clear()
+        for _ in range(3):
+            assert await limiter.retry_after(policy, "ip:10.0.0.1") == 0
+        # Another fits once the previous window's share is below 7, 18s in
+        assert await limiter.retry_after(policy, "ip:10.0.0.1") == pytest.approx(3, abs=0.01)
+    asyncio.run(run())
+
+def test_a_batch_is_taken_from_redis_and_admitted_locally(server, limiter):
+    policy = Policy("redirect", 12, 60, batch=5)
+
+    async def run():
+        assert await limiter.retry_after(policy, "ip:10.0.0.1") == 0
+        # The other four come out of the worker's allowance without a round trip
+        server.connected = False
+        for _ in range(4):
+            assert await limiter.retry_after(policy, "ip:10.0.0.1") == 0
+        assert limiter.breaker.failures == 0
+        server.connected = True
+        # Another full batch, then a last one shrunk to the two left
+        for _ in range(7):
+            assert await limiter.retry_after(policy, "ip:10.0.0.1") == 0
+        assert await limiter.retry_after(policy, "ip:10.0.0.1") > 0
+    asyncio.run(run())
+
+def request_from(host, headers=()):
+    return Request({"type": "http", "client": (host, 50000), "headers": [(name.encode(), value.encode()) for name, value in headers]})
+
+def test_x_real_ip_is_only_believed_from_trusted_proxies():
+    forwarded = [("x-real-ip", "203.0.113.9")]
+    assert client_ip(request_from("172.18.0.5", forwarded)) == "203.0.113.9"
+    # A client reaching the backend directly cannot pick its own bucket
+    assert client_ip(request_from("198.51.100.7", forwarded)) == "198.51.100.7"
+    assert client_ip(request_from("172.18.0.5")) == "172.18.0.5"
+
+def test_unexpected_limiter_errors_let_requests_through(limiter, monkeypatch):
+    async def broken(*args, **kwargs):
+        raise RuntimeError("bound to a different event loop")
+    monkeypatch.setattr(limiter.breaker, "call", broken)
+    assert asyncio.run(limiter.retry_after(Policy("redirect", 1, 60), "ip:10.0.0.1")) == 0
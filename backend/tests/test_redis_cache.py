@@ -0,0 +1,77 @@
+import asyncio
+import fakeredis
+import pytest
+from database import invalidation, redis_cache
+from database.circuit_breaker import CircuitBreaker
+from database.code_filter import BloomFilter, CodeFilter
+
+@pytest.fixture(params=["keys", "hash"])
+def redis(request, monkeypatch):
+    redis = fakeredis.aioredis.FakeRedis(server=fakeredis.FakeServer())
+    monkeypatch.setattr(redis_cache, "async_redis_client", redis)
+    monkeypatch.setattr(redis_cache, "lookup_bucket", redis.register_script(redis_cache.LOOKUP_BUCKET_SCRIPT))
+    monkeypatch.setattr(redis_cache, "REDIS_URL_LAYOUT", request.param)
+    return redis
+
+def test_lookup_hits_misses_and_negative_entries(redis):
+    async def run():
+        await redis_cache.cache_url("abc123", "https://example.com")
+        assert await redis_cache.lookup_url("abc123") == ("https://example.com", False)
+        assert await redis_cache.lookup_url("nope00") == (None, False)
+        await redis_cache.mark_missing("nope00")
+        assert await redis_cache.lookup_url("nope00") == (None, True)
+
+        await redis_cache.publish_new_urls({"nope00": "https://example.org"})
+        assert await redis_cache.lookup_url("nope00") == ("https://example.org", False)
+    asyncio.run(run())
+
+def test_hash_layout_groups_codes_and_slides_bucket_expiry(redis, monkeypatch):
+    if redis_cache.REDIS_URL_LAYOUT != "hash":
+        pytest.skip("hash layout only")
+    monkeypatch.setattr(redis_cache, "REDIS_URL_HASH_BUCKETS", 4)
+
+    async def run():
+        await redis_cache.publish_new_urls({f"code{i}": f"https://example.com/{i}" for i in range(40)})
+        assert len(await redis.keys("urls:*")) <= 4
+
+        bucket = redis_cache.url_bucket_key("code7")
+        await redis.expire(bucket, 10)
+        assert await redis_cache.lookup_url("code7") == ("https://example.com/7", False)
+        assert await redis.ttl(bucket) > 10
+    asyncio.run(run())
+
+def test_lost_announcements_are_retried_and_distrust_the_filter(monkeypatch):
+    server = fakeredis.FakeServer()
+    redis = fakeredis.aioredis.FakeRedis(server=server)
+    breaker = CircuitBreaker("test", failure_threshold=5)
+    code_filter = CodeFilter()
+    code_filter._bloom = BloomFilter(capacity=100)
+    monkeypatch.setattr(redis_cache, "async_redis_client", redis)
+    monkeypatch.setattr(redis_cache, "redis_breaker", breaker)
+    monkeypatch.setattr(invalidation, "async_redis_client", redis)
+    monkeypatch.setattr(invalidation, "redis_breaker", breaker)
+    monkeypatch.setattr(invalidation, "code_filter", code_filter)
+    monkeypatch.setattr(invalidation, "ANNOUNCE_RETRY_SECONDS", 0.01)
+    monkeypatch.setattr(invalidation, "_subscribed", True)
+    monkeypatch.setattr(invalidation, "_unannounced", set())
+
+    async def run():
+        pubsub = fakeredis.aioredis.FakeRedis(server=server).pubsub(ignore_subscribe_messages=True)
+        await pubsub.subscribe(invalidation.INVALIDATION_CHANNEL)
+
+        # One transient failure: not enough to open the circuit
+        server.connected = False
+        await redis_cache.publish_new_urls({"fresh1": "https://example.com"})
+        server.connected = True
+        assert not breaker.is_open and not invalidation.filter_misses_are_final()
+        assert code_filter.might_exist("fresh1")
+
+        message = None
+        for _ in range(10):
+            message = message or await pubsub.get_message(timeout=0.1)
+        assert invalidation.decode_codes(message["data"]) == ["fresh1"]
+        await asyncio.sleep(0.01)
+        assert invalidation.filter_misses_are_final()
+        await invalidation.stop_invalidation_listener()
+        await pubsub.aclose()
+    asyncio.run(run())
@@ -0,0 +1,101 @@
+import asyncio
+import fakeredis
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from database import replicas
+from database.circuit_breaker import CircuitBreaker
+from database.database import Base
+from models.url import URL
+import models.user
+
+def test_unhealthy_replicas_are_skipped_until_retry():
+    async def run():
+        first, second = create_async_engine("sqlite+aiosqlite://"), create_async_engine("sqlite+aiosqlite://")
+        replica_set = replicas.ReplicaSet([first, second], retry_after=60)
+
+        assert {replica_set.choose(), replica_set.choose()} == {first, second}
+        replica_set.mark_down(first)
+        assert [replica_set.choose() for _ in range(3)] == [second] * 3
+        replica_set.mark_down(second)
+        assert replica_set.choose() is None
+
+        replica_set.retry_after = 0
+        replica_set.mark_down(first)
+        assert replica_set.choose() is first
+        await first.dispose()
+        await second.dispose()
+
+    asyncio.run(run())
+
+def test_replica_miss_is_retried_on_the_primary(monkeypatch):
+    async def run():
+        primary_engine, replica_engine = create_async_engine("sqlite+aiosqlite://"), create_async_engine("sqlite+aiosqlite://")
+        for engine in (primary_engine, replica_engine):
+            async with engine.begin() as connection:
+                await connection.run_sync(Base.metadata.create_all)
+        primary_sessions = async_sessionmaker(primary_engine, class_=AsyncSession, expire_on_commit=False)
+        monkeypatch.setattr(replicas, "AsyncSessionLocal", primary_sessions)
+        async with primary_sessions() as db:
+            db.add(URL(original_url="https://example.com/fresh", short_code="fresh"))
+            await db.commit()
+
+        # The replica has not caught up with the insert yet
+        statement = select(URL.original_url).where(URL.short_code == "fresh")
+        async with replicas.ReplicaSessionLocal(bind=replica_engine) as db:
+            assert db.info["replica"]
+            assert await replicas.first_with_fallback(db, statement) == "https://example.com/fresh"
+        await primary_engine.dispose()
+        await replica_engine.dispose()
+
+    asyncio.run(run())
+
+def test_a_failed_replica_query_is_run_again_on_the_primary(monkeypatch):
+    async def run():
+        primary_engine, replica_engine = create_async_engine("sqlite+aiosqlite://"), create_async_engine("sqlite+aiosqlite://")
+        monkeypatch.setattr(replicas, "AsyncSessionLocal", async_sessionmaker(primary_engine, class_=AsyncSession))
+        sessions = []
+
+        async def query(session):
+            sessions.append(session)
+            if session.info.get("replica"):
+                raise OSError("replica went away")
+            return "from the primary"
+
+        async with replicas.ReplicaSessionLocal(bind=replica_engine) as db:
+            assert await replicas.run_with_fallback(db, query) == "from the primary"
+        assert [session.info.get("replica", False) for session in sessions] == [True, False]
+        await primary_engine.dispose()
+        await replica_engine.dispose()
+
+    asyncio.run(run())
+
+def test_recent_writers_read_from_the_primary(monkeypatch):
+    monkeypatch.setattr(replicas, "async_redis_client", fakeredis.aioredis.FakeRedis(server=fakeredis.FakeServer()))
+
+    async def run():
+        # Without replicas there is nothing to pin
+        await replicas.pin_reads_to_primary(1)
+        assert not await replicas.reads_pinned_to_primary(1)
+
+        monkeypatch.setattr(replicas.replicas, "engines", [object()])
+        await replicas.pin_reads_to_primary(1)
+        assert await replicas.reads_pinned_to_primary(1)
+        assert not await replicas.reads_pinned_to_primary(2)
+
+    asyncio.run(run())
+
+def test_reads_are_not_pinned_while_the_redis_circuit_is_open(monkeypatch):
+    server = fakeredis.FakeServer()
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=60)
+    monkeypatch.setattr(replicas, "async_redis_client", fakeredis.aioredis.FakeRedis(server=server))
+    monkeypatch.setattr(replicas, "redis_breaker", breaker)
+    monkeypatch.setattr(replicas.replicas, "engines", [object()])
+
+    async def run():
+        await replicas.pin_reads_to_primary(1)
+        server.connected = False
+        await replicas.pin_reads_to_primary(2)
+        assert breaker.is_open
+        assert not await replicas.reads_pinned_to_primary(1)
+
+    asyncio.run(run())
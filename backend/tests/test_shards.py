@@ -0,0 +1,58 @@
+import asyncio
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from database import rebalance, shards
+from database.database import Base
+from models.click_stat import ClickStat
+from models.url import URL
+from datetime import datetime, timezone
+import models.user
+
+def test_adding_a_shard_only_moves_codes_to_it():
+    codes = [f"code{index}" for index in range(5000)]
+    before = shards.HashRing(["default", "db-2"])
+    after = shards.HashRing(["default", "db-2", "db-3"])
+
+    moved = [code for code in codes if before.node_for(code) != after.node_for(code)]
+    assert all(after.node_for(code) == "db-3" for code in moved)
+    # Roughly the new shard's fair share
+    assert 0.2 < len(moved) / len(codes) < 0.45
+
+def test_rebalance_moves_misplaced_rows_with_their_stats(monkeypatch):
+    async def run():
+        default_engine, other_engine = create_async_engine("sqlite+aiosqlite://"), create_async_engine("sqlite+aiosqlite://")
+        for engine in (default_engine, other_engine):
+            async with engine.begin() as connection:
+                await connection.run_sync(Base.metadata.create_all)
+        default_sessions = async_sessionmaker(default_engine, class_=AsyncSession, expire_on_commit=False)
+
+        # Every row starts on the default shard, then db-2 joins the ring
+        async with default_sessions() as db:
+            db.add_all(URL(original_url=f"https://example.com/{index}", short_code=f"code{index}", clicks=index) for index in range(50))
+            db.add_all(
+                ClickStat(short_code=f"code{index}", granularity="d", bucket_start=datetime(2026, 1, 1, tzinfo=timezone.utc), clicks=index)
+                for index in range(50)
+            )
+            await db.commit()
+        monkeypatch.setitem(shards.shards, "db-2", shards.Shard("db-2", other_engine))
+        monkeypatch.setattr(shards, "ring", shards.HashRing(shards.shards))
+        expected = {f"code{index}" for index in range(50) if shards.shard_for(f"code{index}").name == "db-2"}
+
+        default_shard = shards.shards["default"]
+        assert await rebalance.rebalance_shard(default_shard, batch_size=7, copy_only=True, default_factory=default_sessions) == len(expected)
+        assert await rebalance.rebalance_shard(default_shard, batch_size=7, default_factory=default_sessions) == len(expected)
+        assert await rebalance.rebalance_shard(default_shard, batch_size=7, default_factory=default_sessions) == 0
+
+        async with shards.shards["db-2"].sessions() as db:
+            moved = dict((await db.execute(select(URL.short_code, URL.clicks))).all())
+            stats = dict((await db.execute(select(ClickStat.short_code, ClickStat.clicks))).all())
+        async with default_sessions() as db:
+            kept = set((await db.execute(select(URL.short_code))).scalars())
+            kept_stats = set((await db.execute(select(ClickStat.short_code))).scalars())
+        assert set(moved) == set(stats) == expected
+        assert all(moved[code] == stats[code] == int(code[4:]) for code in expected)
+        assert kept == kept_stats == {f"code{index}" for index in range(50)} - expected
+        await default_engine.dispose()
+        await other_engine.dispose()
+
+    asyncio.run(run())
@@ -0,0 +1,87 @@
+import fakeredis
+import pytest
+from redis.exceptions import RedisError
+from database.circuit_breaker import CircuitBreaker
+from services import short_codes
+from services.short_codes import (
+    BASE,
+    FeistelPermutation,
+    RedisBlockAllocator,
+    ShortCodeAllocator,
+    base62_decode,
+    base62_encode,
+    decode_id,
+    encode_id,
+)
+
+class InMemoryAllocator(ShortCodeAllocator):
+    def __init__(self, block_size):
+        super().__init__(block_size)
+        self.counter = 0
+        self.leases = 0
+
+    async def _lease(self, size):
+        start = self.counter
+        self.counter += size
+        self.leases += 1
+        return start, size
+
+def test_base62_round_trip():
+    """Test that base62 encoding pads to the requested length and decodes back."""
+    assert base62_encode(0, 6) == "000000"
+    for number in (0, 1, 61, 62, 123456789, BASE ** 6 - 1):
+        assert base62_decode(base62_encode(number, 6)) == number
+
+def test_permutation_is_a_bijection():
+    """Test that the permutation maps a small domain onto itself without collisions."""
+    permutation = FeistelPermutation(b"test-key")
+    domain = BASE ** 2
+    outputs = {permutation.permute(value, domain) for value in range(domain)}
+    assert outputs == set(range(domain))
+    for value in range(0, domain, 97):
+        assert permutation.invert(permutation.permute(value, domain), domain) == value
+
+def test_encode_id_is_reversible_and_not_sequential():
+    """Test that consecutive ids give unrelated codes that decode back to the id."""
+    codes = [encode_id(number) for number in range(1000)]
+    assert len(set(codes)) == 1000
+    assert all(len(code) == 6 for code in codes)
+    assert codes != sorted(codes)
+    assert [decode_id(code) for code in codes] == list(range(1000))
+
+def test_encode_id_grows_past_the_minimum_length():
+    """Test that ids beyond the 6-character space move on to 7 characters."""
+    code = encode_id(BASE ** 6)
+    assert len(code) == 7
+    assert decode_id(code) == BASE ** 6
+
+@pytest.mark.asyncio
+async def test_allocator_leases_blocks():
+    """Test that the allocator only leases a new block when the current one runs out."""
+    allocator = InMemoryAllocator(block_size=10)
+    codes = [await allocator.allocate() for _ in range(25)]
+    codes += await allocator.allocate_many(40)
+    assert len(set(codes)) == 65
+    assert allocator.leases == 4
+
+@pytest.mark.asyncio
+async def test_redis_allocator_fails_fast_while_redis_is_down(monkeypatch):
+    """Test that leasing goes through the Redis circuit breaker."""
+    server = fakeredis.FakeServer()
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=60)
+    monkeypatch.setattr(short_codes, "async_redis_client", fakeredis.aioredis.FakeRedis(server=server))
+    monkeypatch.setattr(short_codes, "redis_breaker", breaker)
+    allocator = RedisBlockAllocator(block_size=10)
+    assert len(await allocator.allocate_many(15)) == 15
+
+    server.connected = False
+    allocator = RedisBlockAllocator(block_size=10)
+    for _ in range(2):
+        with pytest.raises(RedisError):
+            await allocator.allocate()
+    assert breaker.is_open
+
+def test_allocators_must_implement_lease():
+    """Test that the base allocator cannot be used without a lease strategy."""
+    with pytest.raises(TypeError):
+        ShortCodeAllocator(block_size=10)
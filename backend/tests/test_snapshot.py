@@ -0,0 +1,93 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import delete
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from database import snapshot
+from database.database import Base
+from models.url import URL
+import models.user
+
+def test_incremental_builds_only_add_new_rows(tmp_path):
+    path = str(tmp_path / "redirects.snap")
+
+    async def run():
+        engine = create_async_engine("sqlite+aiosqlite://")
+        async with engine.begin() as connection:
+            await connection.run_sync(Base.metadata.create_all)
+        session_factory = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+        async with session_factory() as db:
+            db.add_all(URL(original_url=f"https://example.com/{index}", short_code=f"code{index}") for index in range(0, 100, 2))
+            await db.commit()
+        assert await snapshot.build_snapshot(path, session_factory=session_factory) == 50
+        assert await snapshot.build_snapshot(path, session_factory=session_factory) == 0
+
+        async with session_factory() as db:
+            db.add_all(URL(original_url=f"https://example.com/{index}", short_code=f"code{index}") for index in range(1, 100, 2))
+            await db.commit()
+        assert await snapshot.build_snapshot(path, session_factory=session_factory) == 50
+        assert await snapshot.build_snapshot(path, full=True, session_factory=session_factory) == 100
+        await engine.dispose()
+
+    asyncio.run(run())
+
+    reader = snapshot.RedirectSnapshot(path)
+    assert all(reader.get(f"code{index}") == f"https://example.com/{index}" for index in range(100))
+    assert reader.get("code100") is None
+    assert reader.get("aaa") is None
+    assert reader.count == 100
+    assert snapshot.RedirectSnapshot("").get("code1") is None
+
+def test_removed_rows_are_dropped_by_the_periodic_full_build(tmp_path):
+    path = str(tmp_path / "redirects.snap")
+
+    async def run():
+        engine = create_async_engine("sqlite+aiosqlite://")
+        async with engine.begin() as connection:
+            await connection.run_sync(Base.metadata.create_all)
+        session_factory = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+        async with session_factory() as db:
+            db.add_all(URL(original_url=f"https://example.com/{code}", short_code=code) for code in ("b", "A", "a", "swept"))
+            await db.commit()
+        assert await snapshot.build_snapshot(path, session_factory=session_factory) == 4
+        async with session_factory() as db:
+            await db.execute(delete(URL).where(URL.short_code == "swept"))
+            await db.commit()
+
+        # Incremental builds cannot see the deletion
+        assert await snapshot.build_snapshot(path, session_factory=session_factory) == 0
+        assert snapshot.RedirectSnapshot(path).get("swept") is not None
+        assert await snapshot.build_snapshot(path, session_factory=session_factory, full_every=0) == 3
+        await engine.dispose()
+
+    asyncio.run(run())
+
+    reader = snapshot.RedirectSnapshot(path)
+    assert reader.get("swept") is None
+    assert [code for code, _ in reader] == [b"A", b"a", b"b"]
+    assert "full_built_at" in reader.header
+
+def test_nginx_map_skips_urls_nginx_would_mangle(tmp_path):
+    path = str(tmp_path / "redirects.map")
+    links = [("abc123", "example.com/a"), ("def456", 'https://example.com/"quoted"'), ("ghi789", "https://example.com/$var")]
+    assert snapshot.write_nginx_map(path, links) == 1
+    assert open(path).read() == '"/abc123" "http://example.com/a";\n'
+
+def test_stable_links_are_old_permanent_ones():
+    async def run():
+        engine = create_async_engine("sqlite+aiosqlite://")
+        async with engine.begin() as connection:
+            await connection.run_sync(Base.metadata.create_all)
+        session_factory = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+        old = datetime.now(timezone.utc) - timedelta(days=60)
+        async with session_factory() as db:
+            db.add(URL(original_url="https://example.com/old", short_code="old", created_at=old, clicks=5, permanent=True))
+            db.add(URL(original_url="https://example.com/busy", short_code="busy", created_at=old, clicks=50, permanent=True))
+            db.add(URL(original_url="https://example.com/new", short_code="new", clicks=500, permanent=True))
+            # Temporary links must reach the backend to be counted
+            db.add(URL(original_url="https://example.com/temp", short_code="temp", created_at=old, clicks=5000))
+            await db.commit()
+        links = await snapshot.stable_links(30, 1, session_factory=session_factory)
+        await engine.dispose()
+        return links
+
+    assert asyncio.run(run()) == [("busy", "https://example.com/busy")]
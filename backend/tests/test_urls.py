@@ -1,3 +1,4 @@
+import json
 import pytest
 from fastapi.testclient import TestClient
 from sqlalchemy.orm import Session
@@ -227,3 +228,102 @@ def test_custom_code_validation(test_client: TestClient, auth_headers: dict):
         }
         response = test_client.post("/api/urls/shorten", json=url_data, headers=auth_headers)
         assert response.status_code == 422
+
+def test_shorten_batch(test_client: TestClient, auth_headers: dict):
+    """Test shortening several URLs in one request with per-item results."""
+    items = [
+        {"original_url": "https://batch1.example.com"},
+        {"original_url": "https://batch2.example.com", "custom_short_code": "batch2"},
+        {"original_url": "https://batch3.example.com", "custom_short_code": "batch2"},
+        {"original_url": "not-a-valid-url"},
+    ]
+    response = test_client.post("/api/urls/shorten/batch", json=items, headers=auth_headers)
+    assert response.status_code == 200
+    results = [json.loads(line) for line in response.text.splitlines()]
+    assert [result["index"] for result in results] == [0, 1, 2, 3]
+    assert "short_code" in results[0]
+    assert results[1]["short_code"] == "batch2"
+    assert "already in use" in results[2]["error"]
+    assert "error" in results[3]
+
+def test_reserved_custom_codes_are_rejected(test_client: TestClient):
+    """Test that custom codes shadowed by other routes cannot be created."""
+    for code in ("metrics", "internal"):
+        url_data = {"original_url": "https://www.example.com", "custom_short_code": code}
+        response = test_client.post("/api/urls/shorten", json=url_data)
+        assert response.status_code == 422
+
+def test_shorten_batch_ndjson(test_client: TestClient):
+    """Test that the batch endpoint accepts an NDJSON stream."""
+    body = "\n".join(json.dumps({"original_url": f"https://ndjson{i}.example.com"}) for i in range(5))
+    response = test_client.post(
+        "/api/urls/shorten/batch",
+        content=body,
+        headers={"Content-Type": "application/x-ndjson"},
+    )
+    assert response.status_code == 200
+    results = [json.loads(line) for line in response.text.splitlines()]
+    assert len(results) == 5
+    assert len({result["short_code"] for result in results}) == 5
+
+def test_shorten_dedup(test_client: TestClient, auth_headers: dict):
+    """Test that dedup=true reuses the caller's existing short URL."""
+    url_data = {"original_url": "https://dedup.example.com/page"}
+    first = test_client.post("/api/urls/shorten?dedup=true", json=url_data).json()
+    again = test_client.post("/api/urls/shorten?dedup=true", json=url_data).json()
+    assert again["short_code"] == first["short_code"]
+
+    # Without the flag, and for another owner, a new code is created
+    fresh = test_client.post("/api/urls/shorten", json=url_data).json()
+    assert fresh["short_code"] != first["short_code"]
+    owned = test_client.post("/api/urls/shorten?dedup=true", json=url_data, headers=auth_headers).json()
+    assert owned["short_code"] not in (first["short_code"], fresh["short_code"])
+
+def test_get_unclaimed_urls_paginated(test_client: TestClient):
+    """Test that unclaimed URLs can be walked page by page with a cursor."""
+    items = [{"original_url": f"https://page{i}.example.com"} for i in range(5)]
+    response = test_client.post("/api/urls/shorten/batch", json=items)
+    assert response.status_code == 200
+
+    codes = []
+    response = test_client.get("/api/urls/unclaimed?limit=2")
+    while True:
+        assert response.status_code == 200
+        assert len(response.json()) <= 2
+        codes += [url["short_code"] for url in response.json()]
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+        response = test_client.get(f"/api/urls/unclaimed?limit=2&cursor={cursor}")
+
+    assert len(codes) == len(set(codes)) == 5
+
+def test_get_unclaimed_urls_ndjson(test_client: TestClient):
+    """Test streaming unclaimed URLs as NDJSON."""
+    items = [{"original_url": f"https://stream{i}.example.com"} for i in range(3)]
+    test_client.post("/api/urls/shorten/batch", json=items)
+
+    response = test_client.get("/api/urls/unclaimed?format=ndjson")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    assert len(response.text.splitlines()) == 3
+
+def test_url_time_series(test_client: TestClient, auth_headers: dict):
+    """Test that the time series endpoint returns hourly buckets for a link."""
+    url_data = {"original_url": "https://www.example.com", "custom_short_code": "series1"}
+    response = test_client.post("/api/urls/shorten", json=url_data, headers=auth_headers)
+    assert response.status_code == 200
+
+    response = test_client.get(
+        "/api/urls/stats/series1/timeseries?granularity=hour", headers=auth_headers
+    )
+    assert response.status_code == 200
+    data = response.json()
+    assert data["short_code"] == "series1"
+    assert data["granularity"] == "hour"
+    assert isinstance(data["points"], list)
+
+    response = test_client.get(
+        "/api/urls/stats/series1/timeseries?granularity=week", headers=auth_headers
+    )
+    assert response.status_code == 422